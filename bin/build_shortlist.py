@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+""" Builds the lexical shortlist for restricting the output vocabulary
+at inference, from the training corpus.
+
+The vocabularies and BPE codes are taken from the same configurations
+as bin.train, e.g.
+
+    python -m bin.build_shortlist \
+        --config_paths "datasets.yml" \
+        --output shortlist.txt
+
+and then infer with `infer: {shortlist_file: shortlist.txt}`. If the
+word alignments of the training corpus (e.g. from fast_align) are provided
+by --alignments, only aligned tokens are candidates of each other.
+"""
+import time
+
+import tensorflow as tf
+import yaml
+
+from njunmt.data.shortlist import build_lexical_shortlist
+from njunmt.data.shortlist import save_lexical_shortlist
+from njunmt.data.vocab import Vocab
+from njunmt.nmt_experiment import TrainingExperiment
+from njunmt.utils.configurable import deep_merge_dict
+from njunmt.utils.configurable import load_from_config_path
+from njunmt.utils.configurable import parse_params
+
+tf.flags.DEFINE_string("config_paths", "",
+                       """Path to a yaml configuration files defining FLAG
+                       values. Multiple files can be separated by commas.""")
+tf.flags.DEFINE_string("data", "", """training data files, vocabulary files, bpe codes""")
+tf.flags.DEFINE_string("alignments", "", """the word alignments file of the training corpus""")
+tf.flags.DEFINE_integer("num_candidates", 100, """the maximum number of candidates of each source token""")
+tf.flags.DEFINE_string("output", "", """the shortlist file""")
+
+FLAGS = tf.flags.FLAGS
+
+
+def main(_argv):
+    if not FLAGS.output:
+        raise ValueError("output should be provided.")
+    model_configs = load_from_config_path(FLAGS.config_paths, {"data": {}})
+    params = yaml.load(FLAGS.data)
+    if params:
+        model_configs = deep_merge_dict(model_configs, {"data": params})
+    data_params = parse_params(
+        params=model_configs["data"],
+        default_params=TrainingExperiment.default_datasets_params())
+
+    vocab_source = Vocab(
+        filename=data_params["source_words_vocabulary"],
+        bpe_codes=data_params["source_bpecodes"])
+    vocab_target = Vocab(
+        filename=data_params["target_words_vocabulary"],
+        bpe_codes=data_params["target_bpecodes"])
+    start_time = time.time()
+    shortlist = build_lexical_shortlist(
+        features_file=data_params["train_features_file"],
+        labels_file=data_params["train_labels_file"],
+        vocab_source=vocab_source,
+        vocab_target=vocab_target,
+        num_candidates=FLAGS.num_candidates,
+        alignments_file=FLAGS.alignments or None)
+    save_lexical_shortlist(shortlist, FLAGS.output, vocab_source, vocab_target)
+    tf.logging.info("Saved the candidates of {} source tokens into {}. Elapsed Time: {}."
+                    .format(len(shortlist), FLAGS.output, str(time.time() - start_time)))
+
+
+if __name__ == "__main__":
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
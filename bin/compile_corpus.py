@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Compiles the training corpus into memory-mapped binary format.
+
+The vocabularies, BPE codes and `reverse_target` are taken from the same
+configurations as bin.train, e.g.
+
+    python -m bin.compile_corpus \
+        --config_paths "datasets.yml,training_options.yml" \
+        --output_prefix corpus/train
+
+and then train with `train: {compiled_corpus: corpus/train}`.
+"""
+import time
+
+import tensorflow as tf
+import yaml
+
+from njunmt.data.compiled_corpus import compile_parallel_corpus
+from njunmt.data.vocab import Vocab
+from njunmt.nmt_experiment import TrainingExperiment
+from njunmt.utils.configurable import deep_merge_dict
+from njunmt.utils.configurable import load_from_config_path
+from njunmt.utils.configurable import parse_params
+
+tf.flags.DEFINE_string("config_paths", "",
+                       """Path to a yaml configuration files defining FLAG
+                       values. Multiple files can be separated by commas.""")
+tf.flags.DEFINE_string("train", "", """training options""")
+tf.flags.DEFINE_string("data", "", """training data files, vocabulary files, bpe codes""")
+tf.flags.DEFINE_string("output_prefix", "", """the prefix of the compiled corpus files""")
+
+FLAGS = tf.flags.FLAGS
+
+
+def main(_argv):
+    if not FLAGS.output_prefix:
+        raise ValueError("output_prefix should be provided.")
+    model_configs = load_from_config_path(FLAGS.config_paths, {"train": {}, "data": {}})
+    for name in ["train", "data"]:
+        params = yaml.load(getattr(FLAGS, name))
+        if params:
+            model_configs = deep_merge_dict(model_configs, {name: params})
+    data_params = parse_params(
+        params=model_configs["data"],
+        default_params=TrainingExperiment.default_datasets_params())
+    training_options = parse_params(
+        params=model_configs["train"],
+        default_params=TrainingExperiment.default_training_options())
+
+    vocab_source = Vocab(
+        filename=data_params["source_words_vocabulary"],
+        bpe_codes=data_params["source_bpecodes"],
+        reverse_seq=False)
+    vocab_target = Vocab(
+        filename=data_params["target_words_vocabulary"],
+        bpe_codes=data_params["target_bpecodes"],
+        reverse_seq=training_options["reverse_target"])
+    start_time = time.time()
+    num_lines = compile_parallel_corpus(
+        features_file=data_params["train_features_file"],
+        labels_file=data_params["train_labels_file"],
+        vocab_source=vocab_source,
+        vocab_target=vocab_target,
+        prefix=FLAGS.output_prefix)
+    tf.logging.info("Compiled {} sentence pairs into {}.*. Elapsed Time: {}."
+                    .format(num_lines, FLAGS.output_prefix, str(time.time() - start_time)))
+
+
+if __name__ == "__main__":
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
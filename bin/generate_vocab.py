@@ -21,7 +21,10 @@ Generate vocabulary for a tokenized text file.
 import sys
 import argparse
 import collections
+import heapq
 import logging
+import os
+from multiprocessing import Pool
 
 parser = argparse.ArgumentParser(
     description="Generate vocabulary for a tokenized text file.")
@@ -43,11 +46,10 @@ parser.add_argument(
     help="If set to true, downcase all text before processing.",
     default=False)
 parser.add_argument(
-    "infile",
-    nargs="?",
-    type=argparse.FileType("r"),
-    default=sys.stdin,
-    help="Input tokenized text file to be processed.")
+    "infiles",
+    nargs="*",
+    help="Input tokenized text files to be processed. "
+         "If not provided, read from standard input.")
 parser.add_argument(
     "--delimiter",
     dest="delimiter",
@@ -55,40 +57,101 @@ parser.add_argument(
     default=" ",
     help="Delimiter character for tokenizing. Use \" \" and \"\" for word and char level respectively."
 )
-args = parser.parse_args()
+parser.add_argument(
+    "--num_processes",
+    dest="num_processes",
+    type=int,
+    default=1,
+    help="Number of processes for counting. Each input file is split into "
+         "byte ranges which are counted in parallel.")
 
-# Counter for all tokens in the vocabulary
-cnt = collections.Counter()
 
-for line in args.infile:
-  if args.downcase:
+def count_line(cnt, line, downcase, delimiter):
+  """Counts the tokens of one line into `cnt`."""
+  if downcase:
     line = line.lower()
-  if args.delimiter == "":
+  if delimiter == "":
     tokens = list(line.strip())
   else:
-    tokens = line.strip().split(args.delimiter)
+    tokens = line.strip().split(delimiter)
   tokens = [_ for _ in tokens if len(_) > 0]
   cnt.update(tokens)
 
-logging.info("Found %d unique tokens in the vocabulary.", len(cnt))
 
-# Filter tokens below the frequency threshold
-if args.min_frequency > 0:
-  filtered_tokens = [(w, c) for w, c in cnt.most_common()
-                     if c >= args.min_frequency]
-  cnt = collections.Counter(dict(filtered_tokens))
+def count_range(args):
+  """Counts the tokens of lines starting in the byte range [start, end) of a file."""
+  filename, start, end, downcase, delimiter = args
+  cnt = collections.Counter()
+  with open(filename, "rb") as fp:
+    if start > 0:
+      # the line containing byte `start - 1` belongs to the previous range
+      fp.seek(start - 1)
+      fp.readline()
+    while fp.tell() < end:
+      line = fp.readline()
+      if not line:
+        break
+      if not isinstance(line, str):
+        # Python 3 counts text as read from stdin, while Python 2 counts
+        # raw bytes (also as read from stdin)
+        line = line.decode("utf-8")
+      count_line(cnt, line, downcase, delimiter)
+  return cnt
+
 
-logging.info("Found %d unique tokens with frequency > %d.",
-             len(cnt), args.min_frequency)
+def count_files(filenames, num_processes, downcase, delimiter):
+  """Counts the tokens of files in byte ranges with a process pool."""
+  ranges = []
+  for filename in filenames:
+    size = os.path.getsize(filename)
+    bounds = [size * i // num_processes for i in range(num_processes + 1)]
+    ranges.extend([(filename, bounds[i], bounds[i + 1], downcase, delimiter)
+                   for i in range(num_processes)])
+  pool = Pool(num_processes)
+  partial_cnts = pool.map(count_range, ranges)
+  pool.close()
+  pool.join()
+  # Partial counters can not be pruned by frequency before merging
+  # (a token may be rare in every range but frequent in total).
+  cnt = collections.Counter()
+  for partial_cnt in partial_cnts:
+    cnt.update(partial_cnt)
+  return cnt
+
+
+def main(args):
+  # Counter for all tokens in the vocabulary
+  if len(args.infiles) == 0:
+    cnt = collections.Counter()
+    for line in sys.stdin:
+      count_line(cnt, line, args.downcase, args.delimiter)
+  else:
+    cnt = count_files(args.infiles, max(args.num_processes, 1),
+                      args.downcase, args.delimiter)
+
+  logging.info("Found %d unique tokens in the vocabulary.", len(cnt))
+
+  # Filter tokens below the frequency threshold
+  word_with_counts = cnt.items()
+  if args.min_frequency > 0:
+    word_with_counts = [(w, c) for w, c in word_with_counts
+                        if c >= args.min_frequency]
+
+  logging.info("Found %d unique tokens with frequency > %d.",
+               len(word_with_counts), args.min_frequency)
+
+  # Sort tokens by 1. frequency 2. lexically to break ties
+  # and take only max-vocab
+  if args.max_vocab_size is not None:
+    word_with_counts = heapq.nlargest(
+        args.max_vocab_size, word_with_counts, key=lambda x: (x[1], x[0]))
+  else:
+    word_with_counts = sorted(
+        word_with_counts, key=lambda x: (x[1], x[0]), reverse=True)
 
-# Sort tokens by 1. frequency 2. lexically to break ties
-word_with_counts = cnt.most_common()
-word_with_counts = sorted(
-    word_with_counts, key=lambda x: (x[1], x[0]), reverse=True)
+  for word, count in word_with_counts:
+    print("{}\t{}".format(word, count))
 
-# Take only max-vocab
-if args.max_vocab_size is not None:
-  word_with_counts = word_with_counts[:args.max_vocab_size]
 
-for word, count in word_with_counts:
-  print("{}\t{}".format(word, count))
+if __name__ == "__main__":
+  main(parser.parse_args())
@@ -3,9 +3,9 @@ from __future__ import absolute_import
 
 import numpy
 import matplotlib.pyplot as plt
-import json
 import argparse
 from njunmt.data.vocab import Vocab
+from njunmt.inference.attention import AttentionReader
 
 
 # input:
@@ -72,7 +72,7 @@ def read_alignment_matrix(f):
     return sid, mma, target_labels, source_labels
 
 
-def read_plot_alignment_matrices(f, target_file=None, vocab_file=None, start=0):
+def read_plot_alignment_matrices(attention_prefix, target_file=None, vocab_file=None, start=0, sample=None):
     vocab = None
     if vocab_file:
         vocab = Vocab(filename=vocab_file)
@@ -92,15 +92,18 @@ def read_plot_alignment_matrices(f, target_file=None, vocab_file=None, start=0):
     #             idx += 1
     #         target = targets
 
-    attentions = json.load(f, encoding="utf-8")
+    # only the index is loaded, the matrices of each sample are read when plotting
+    attentions = AttentionReader(attention_prefix)
+    sample_ids = [sample] if sample is not None else attentions.sample_ids()
 
-    for idx, att in attentions.items():
+    for idx in sample_ids:
         if idx < start: continue
+        att = attentions.read(idx)
         source_labels = att["source"].split() + ["SEQUENCE_END"]
         target_labels = att["translation"].split()
         att_list = att["attentions"]
         assert att_list[0]["type"] == "simple", "Do not use this tool for multihead attention."
-        mma = numpy.array(att_list[0]["value"])
+        mma = att_list[0]["value"].astype(numpy.float32)
         if mma.shape[0] == len(target_labels) + 1:
             target_labels += ["SEQUENCE_END"]
 
@@ -109,21 +112,28 @@ def read_plot_alignment_matrices(f, target_file=None, vocab_file=None, start=0):
                              for e in source_labels]
 
         plot_head_map(mma, target_labels, source_labels)
+    attentions.close()
 
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', '-i', type=argparse.FileType("rb"),
-                        default="trans.att",
+    parser.add_argument('--input', '-i', type=str,
+                        default="trans",
                         metavar='PATH',
-                        help="Input file (default: standard input)")
+                        help="The translation file with attention saved into PATH.attention "
+                             "and PATH.attention.index")
     parser.add_argument('--target', '-t', type=str,
                         default=None)
     parser.add_argument('--vocab', '-v', type=str,
                         default=None)
     parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--sample', type=int, default=None,
+                        help="Only plot the sample with this index (starting from 0).")
 
     args = parser.parse_args()
+    attention_prefix = args.input
+    if attention_prefix.endswith(".attention"):
+        attention_prefix = attention_prefix[:-len(".attention")]
 
-    read_plot_alignment_matrices(args.input, args.target, args.vocab, args.start)
+    read_plot_alignment_matrices(attention_prefix, args.target, args.vocab, args.start, args.sample)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Entrance for serving translation requests from a trained NMT model.
+
+Example:
+    curl -X POST http://localhost:8080/translate -d '{"sentences": ["..."]}'
+"""
+import tensorflow as tf
+
+from njunmt.utils.configurable import ModelConfigs
+from njunmt.utils.configurable import update_infer_model_configs
+from njunmt.utils.configurable import deep_merge_dict
+from njunmt.utils.configurable import DEFAULT_INFER_CONFIGS
+from njunmt.utils.configurable import maybe_load_yaml
+from njunmt.utils.configurable import load_from_config_path
+from njunmt.nmt_experiment import ServingExperiment
+
+tf.flags.DEFINE_string("config_paths", "", """Path to a yaml configuration files defining FLAG
+                       values. Multiple files can be separated by commas.
+                       Files are merged recursively. Setting a key in these
+                       files is equivalent to setting the FLAG value with
+                       the same name.""")
+
+tf.flags.DEFINE_string("infer", "", "inference options")
+tf.flags.DEFINE_string("infer_data", "", "not used for serving")
+tf.flags.DEFINE_string("model_dir", "",
+                       """model directory""")
+tf.flags.DEFINE_string("host", "localhost", "the host name to bind, by default: localhost")
+tf.flags.DEFINE_integer("port", 8080, "the port to bind, by default: 8080")
+tf.flags.DEFINE_float("max_wait_time", 0.01,
+                      """the maximum seconds that a request waits for other
+                      requests to be batched with, by default: 0.01""")
+FLAGS = tf.flags.FLAGS
+
+
+def main(_argv):
+    model_configs = maybe_load_yaml(DEFAULT_INFER_CONFIGS)
+    # load flags from config file
+    model_configs = load_from_config_path(FLAGS.config_paths, model_configs)
+    # replace parameters in configs_file with tf FLAGS
+    model_configs = update_infer_model_configs(model_configs, FLAGS)
+    model_configs = deep_merge_dict(model_configs, ModelConfigs.load(FLAGS.model_dir))
+    model_configs = update_infer_model_configs(model_configs, FLAGS)
+    runner = ServingExperiment(model_configs=model_configs,
+                               host=FLAGS.host,
+                               port=FLAGS.port,
+                               max_wait_time=FLAGS.max_wait_time)
+    runner.run()
+
+
+if __name__ == "__main__":
+    tf.logging.set_verbosity(tf.logging.INFO)
+    tf.app.run()
@@ -11,21 +11,129 @@ Rico Sennrich, Barry Haddow and Alexandra Birch (2015). Neural Machine Translati
 Proceedings of the 54th Annual Meeting of the Association for Computational Linguistics (ACL 2016). Berlin, Germany.
 """
 from __future__ import unicode_literals, division
+import atexit
 import codecs
+import hashlib
+import heapq
+import os
+import pickle
 import re
+from collections import OrderedDict
+
+
+class BPECache(object):
+    """ A size-bounded LRU cache for BPE segmentations of words,
+    with hit/miss counters. It can be saved to and loaded from disk. """
+
+    def __init__(self, max_size=None, signature=None):
+        """
+        :param max_size: the maximum number of cached words, `None` for unbounded
+        :param signature: a string identifying the BPE codes/vocabulary; a cache
+          file with a different signature is ignored when loading
+        """
+        self._max_size = max_size
+        self._signature = signature
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """ returns the cached value of `key` and marks it as recently used,
+        or `None` if not cached """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while self._max_size is not None and len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def save(self, filename):
+        """ saves the cached items (at most `max_size` most recently used) """
+        with open(filename, "wb") as fw:
+            pickle.dump((self._signature, list(self._data.items())), fw, protocol=2)
+
+    def load(self, filename):
+        """ loads cached items from `filename` if it exists and was saved with
+        the same signature, returns the number of loaded items """
+        if not os.path.exists(filename):
+            return 0
+        with open(filename, "rb") as fp:
+            signature, items = pickle.load(fp)
+        if signature != self._signature:
+            return 0
+        for key, value in items:
+            self[key] = value
+        return len(items)
+
+
+# the segmentation caches to be saved at exit, keyed by cache file
+_CACHES_TO_SAVE = {}
+
+
+@atexit.register
+def _save_caches():
+    for cache_file, cache in _CACHES_TO_SAVE.items():
+        cache.save(cache_file)
 
 
 class BPE(object):
-    def __init__(self, codes=None, separator='@@', vocab=None, vocabulary_threshold=None):
+    def __init__(self, codes=None, separator='@@', vocab=None, vocabulary_threshold=None,
+                 cache_size=1000000, cache_file=None, heap_merge=False):
+        """
+        :param codes: the BPE codes file
+        :param separator: separator between non-final subword units
+        :param vocab: the vocabulary file, if provided, reverts any merge operations that produce an OOV
+        :param vocabulary_threshold: words with frequency < threshold in `vocab` are treated as OOV
+        :param cache_size: the maximum number of words in the segmentation cache (LRU),
+          `None` for unbounded
+        :param cache_file: if provided, the segmentation cache is loaded from it (if exists)
+          and saved to it at exit (the one of the last `BPE` with the same file),
+          so that other processes can start warm
+        :param heap_merge: whether to apply merges with a heap of merge ranks
+          (`apply_merges_heap`), which is faster for long words and gives the same output
+        """
         assert codes, "codes should be provided."
-        codes = codecs.open(codes, encoding='utf-8')
+        with open(codes, "rb") as fp:
+            codes_content = fp.read()
+        signature = None
+        if cache_file:
+            # identifies the BPE codes/vocabulary of the cache file
+            signature = hashlib.md5(codes_content)
+            signature.update(separator.encode("utf-8"))
+            if vocab:
+                with open(vocab, "rb") as fp:
+                    signature.update(fp.read())
+                signature.update(str(vocabulary_threshold).encode("utf-8"))
+            signature = signature.hexdigest()
+        self.cache = BPECache(max_size=cache_size, signature=signature)
+        self.cache_file = cache_file
+        self.heap_merge = heap_merge
+        if cache_file:
+            self.cache.load(cache_file)
+            _CACHES_TO_SAVE[os.path.abspath(cache_file)] = self.cache
+        codes = codes_content.decode("utf-8").splitlines(True)
         # check version information
-        firstline = codes.readline()
+        firstline = codes[0] if codes else ""
         if firstline.startswith('#version:'):
             self.version = tuple([int(x) for x in re.sub(r'(\.0+)*$', '', firstline.split()[-1]).split(".")])
+            codes = codes[1:]
         else:
             self.version = (0, 1)
-            codes.seek(0)
 
         self.bpe_codes = [tuple(item.split()) for item in codes]
 
@@ -53,7 +161,9 @@ class BPE(object):
                                               self.vocab,
                                               self.separator,
                                               self.version,
-                                              self.glossaries)]
+                                              self.glossaries,
+                                              self.cache,
+                                              self.heap_merge)]
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
@@ -87,6 +197,11 @@ class BPE(object):
             return " ".join(new_pred_tokens)
         return new_pred_tokens
 
+    def save_cache(self):
+        """ saves the segmentation cache to `cache_file` """
+        if self.cache_file:
+            self.cache.save(self.cache_file)
+
     def _isolate_glossaries(self, word):
         word_segments = [word]
         for gloss in self.glossaries:
@@ -108,29 +223,12 @@ def get_pairs(word):
     return pairs
 
 
-def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache={}):
-    """Encode word based on list of BPE merge operations, which are applied consecutively
+def apply_merges(word, bpe_codes):
+    """Apply BPE merge operations to the tuple of symbols `word`, the merge with
+    the lowest rank first, until no more merges can be applied.
     """
-
-    if orig in cache:
-        return cache[orig]
-
-    if orig in glossaries:
-        cache[orig] = (orig,)
-        return (orig,)
-
-    if version == (0, 1):
-        word = tuple(orig) + ('</w>',)
-    elif version == (0, 2):  # more consistent handling of word-final segments
-        word = tuple(orig[:-1]) + (orig[-1] + '</w>',)
-    else:
-        raise NotImplementedError
-
     pairs = get_pairs(word)
 
-    if not pairs:
-        return orig
-
     while True:
         bigram = min(pairs, key=lambda pair: bpe_codes.get(pair, float('inf')))
         if bigram not in bpe_codes:
@@ -159,6 +257,95 @@ def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, gl
             break
         else:
             pairs = get_pairs(word)
+    return word
+
+
+def apply_merges_heap(word, bpe_codes):
+    """Same as `apply_merges`, but keeps the symbols in a linked list and the
+    candidate merges in a heap of (rank, position), so each merge only updates
+    its neighbors instead of rebuilding the word and all its pairs.
+
+    All occurrences of the lowest-ranked pair are merged from left to right in
+    one pass (as `apply_merges` does), so the output is identical.
+    """
+    symbols = list(word)
+    nxt = list(range(1, len(symbols))) + [-1]
+    prv = list(range(-1, len(symbols) - 1))
+
+    heap = []
+    for i in range(len(symbols) - 1):
+        rank = bpe_codes.get((symbols[i], symbols[i + 1]))
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    while heap:
+        rank = heap[0][0]
+        positions = set()
+        while heap and heap[0][0] == rank:
+            positions.add(heapq.heappop(heap)[1])
+        first, second = None, None
+        for i in sorted(positions):
+            j = nxt[i]
+            if j == -1 or symbols[i] is None:
+                continue
+            if first is None:
+                # stale entries can not produce a valid pair with the same rank
+                if bpe_codes.get((symbols[i], symbols[j])) != rank:
+                    continue
+                first, second = symbols[i], symbols[j]
+            if symbols[i] != first or symbols[j] != second:
+                continue
+            # merge node j into node i
+            symbols[i] = first + second
+            symbols[j] = None
+            nxt[i] = nxt[j]
+            if nxt[j] != -1:
+                prv[nxt[j]] = i
+            if prv[i] != -1:
+                new_rank = bpe_codes.get((symbols[prv[i]], symbols[i]))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, prv[i]))
+            if nxt[i] != -1:
+                new_rank = bpe_codes.get((symbols[i], symbols[nxt[i]]))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, i))
+    return tuple(symbol for symbol in symbols if symbol is not None)
+
+
+def bpe_encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, glossaries=None, cache=None,
+               heap_merge=False):
+    """Encode word based on list of BPE merge operations, which are applied consecutively
+
+    `cache` is a `BPECache` (or a dict) owned by the caller, `None` for no caching.
+    If `heap_merge`, use `apply_merges_heap` instead of `apply_merges`.
+    """
+
+    if cache is None:
+        cache = dict()
+    cached = cache.get(orig)
+    if cached is not None:
+        return cached
+
+    if glossaries and orig in glossaries:
+        cache[orig] = (orig,)
+        return (orig,)
+
+    if version == (0, 1):
+        word = tuple(orig) + ('</w>',)
+    elif version == (0, 2):  # more consistent handling of word-final segments
+        word = tuple(orig[:-1]) + (orig[-1] + '</w>',)
+    else:
+        raise NotImplementedError
+
+    if len(word) < 2:
+        cache[orig] = (orig,)
+        return (orig,)
+
+    if heap_merge:
+        word = apply_merges_heap(word, bpe_codes)
+    else:
+        word = apply_merges(word, bpe_codes)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -0,0 +1,151 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Binary (compiled) corpus format.
+
+A text file is compiled once into two numpy arrays:
+  - "<prefix>.ids.npy": all token ids (including the trailing EOS of each
+    sentence) concatenated into one flat int32 array.
+  - "<prefix>.offsets.npy": an int64 array with `num_lines + 1` entries,
+    the ids of line `i` are `ids[offsets[i]:offsets[i+1]]`.
+A small "<prefix>.meta.json" records the vocabulary size used to compile.
+
+The arrays are opened with memory mapping, so reading a sentence is just
+slicing and no tokenization, BPE or string handling is needed any more.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import json
+
+import numpy
+from tensorflow import gfile
+
+from njunmt.utils.misc import open_file, close_file
+
+FEATURES_SUFFIX = ".features"
+LABELS_SUFFIX = ".labels"
+IDS_SUFFIX = ".ids.npy"
+OFFSETS_SUFFIX = ".offsets.npy"
+META_SUFFIX = ".meta.json"
+
+
+def compiled_corpus_exists(prefix):
+    """ Checks whether the compiled corpus files exist.
+
+    Args:
+        prefix: The prefix of the compiled corpus files.
+
+    Returns: True if all files exist, False otherwise.
+    """
+    return gfile.Exists(prefix + IDS_SUFFIX) \
+           and gfile.Exists(prefix + OFFSETS_SUFFIX) \
+           and gfile.Exists(prefix + META_SUFFIX)
+
+
+def compile_corpus(filename, vocab, prefix):
+    """ Encodes a text file into token ids and saves them in binary format.
+
+    Args:
+        filename: The path of the text file.
+        vocab: A `Vocab` object. BPE (if provided) and `reverse_seq`
+          are applied by `Vocab.convert_to_idlist`.
+        prefix: The prefix of the output files.
+
+    Returns: The number of compiled lines.
+    """
+    fp = open_file(filename, encoding="utf-8")
+    # typed arrays keep the memory usage at 4 (8) bytes per id (offset)
+    ids = array.array("i")
+    offsets = array.array("l" if array.array("l").itemsize == 8 else "q", [0])
+    for line in fp:
+        sentence_ids = vocab.convert_to_idlist(line.strip())
+        ids.extend(sentence_ids)
+        offsets.append(offsets[-1] + len(sentence_ids))
+    close_file(fp)
+    numpy.save(prefix + IDS_SUFFIX, numpy.array(ids, dtype=numpy.int32))
+    numpy.save(prefix + OFFSETS_SUFFIX, numpy.array(offsets, dtype=numpy.int64))
+    with open_file(prefix + META_SUFFIX, mode="w") as fw:
+        fw.write(json.dumps({"source_file": filename,
+                             "vocab_size": vocab.vocab_size,
+                             "num_lines": len(offsets) - 1}))
+    return len(offsets) - 1
+
+
+def compile_parallel_corpus(features_file, labels_file,
+                            vocab_source, vocab_target, prefix):
+    """ Compiles a pair of parallel files into
+    "<prefix>.features.*" and "<prefix>.labels.*".
+
+    Args:
+        features_file: The path of features file.
+        labels_file: The path of labels file.
+        vocab_source: A `Vocab` object for features.
+        vocab_target: A `Vocab` object for labels.
+        prefix: The prefix of the output files.
+
+    Returns: The number of compiled sentence pairs.
+
+    Raises:
+        ValueError: if the two files have different number of lines.
+    """
+    num_features = compile_corpus(features_file, vocab_source, prefix + FEATURES_SUFFIX)
+    num_labels = compile_corpus(labels_file, vocab_target, prefix + LABELS_SUFFIX)
+    if num_features != num_labels:
+        raise ValueError("{} has {} lines while {} has {} lines."
+                         .format(features_file, num_features, labels_file, num_labels))
+    return num_features
+
+
+class CompiledCorpus(object):
+    """ Memory-mapped reader for a compiled corpus. """
+
+    def __init__(self, prefix, vocab=None):
+        """ Opens the compiled corpus.
+
+        Args:
+            prefix: The prefix of the compiled corpus files.
+            vocab: A `Vocab` object. If provided, checks that the corpus
+              was compiled with a vocabulary of the same size.
+
+        Raises:
+            OSError: if the compiled corpus files do not exist.
+            ValueError: if the vocabulary size mismatches.
+        """
+        if not compiled_corpus_exists(prefix):
+            raise OSError("Compiled corpus: \"{}\" not exists.".format(prefix))
+        self._prefix = prefix
+        with open_file(prefix + META_SUFFIX) as fp:
+            self._meta = json.loads(fp.read())
+        if vocab is not None and vocab.vocab_size != self._meta["vocab_size"]:
+            raise ValueError("Compiled corpus {} has vocabulary size {}, "
+                             "but the given vocabulary has size {}."
+                             .format(prefix, self._meta["vocab_size"], vocab.vocab_size))
+        self._ids = numpy.load(prefix + IDS_SUFFIX, mmap_mode="r")
+        self._offsets = numpy.load(prefix + OFFSETS_SUFFIX, mmap_mode="r")
+        self._lengths = numpy.diff(self._offsets).astype(numpy.int32)
+
+    @property
+    def lengths(self):
+        """ Returns a 1-d numpy.ndarray of the number of ids of each line. """
+        return self._lengths
+
+    def __len__(self):
+        """ Returns the number of lines. """
+        return len(self._lengths)
+
+    def __getitem__(self, idx):
+        """ Returns the ids of line `idx` as a list of integers. """
+        return self._ids[self._offsets[idx]:self._offsets[idx + 1]].tolist()
@@ -0,0 +1,162 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define functions for building and loading the lexical shortlist,
+which maps each source token to its likely target tokens.
+
+The shortlist file is a text file, each line of which is a source
+token followed by a tab and its candidate target tokens (separated by
+spaces) in descending order of scores.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import Counter
+from collections import defaultdict
+
+import numpy
+from six.moves import zip
+
+from njunmt.utils.misc import open_file
+from njunmt.utils.misc import close_file
+
+
+def _encode_words(words, vocab):
+    """ Encodes each word (including BPE) into a list of token ids. """
+    return [vocab.convert_to_idlist([w])[:-1] for w in words]
+
+
+def build_lexical_shortlist(features_file,
+                            labels_file,
+                            vocab_source,
+                            vocab_target,
+                            num_candidates=100,
+                            alignments_file=None):
+    """ Counts the target candidates of each source token on a parallel corpus.
+
+    If `alignments_file` is provided, source and target tokens co-occur only if
+    the words they come from are aligned, and candidates are ranked by p(t|s).
+    Otherwise, all tokens of a sentence pair co-occur, and candidates are ranked
+    by the Dice coefficient, which does not favor frequent target tokens.
+
+    Args:
+        features_file: The source file.
+        labels_file: The target file.
+        vocab_source: A `Vocab` object of source side (including BPE).
+        vocab_target: A `Vocab` object of target side (including BPE).
+        num_candidates: The maximum number of candidates of each source token.
+        alignments_file: The word alignments file (e.g. from fast_align)
+          with "i-j" pairs, where i/j index the words of `features_file`
+          and `labels_file`.
+
+    Returns: A dict mapping each source token id to a list of target token ids.
+    """
+    features = open_file(features_file, encoding="utf-8")
+    labels = open_file(labels_file, encoding="utf-8")
+    alignments = open_file(alignments_file, encoding="utf-8") if alignments_file else None
+    source_counts = Counter()
+    target_counts = Counter()
+    cooccur_counts = defaultdict(Counter)
+    for lidx, (ss, tt) in enumerate(zip(features, labels)):
+        ss = _encode_words(ss.strip().split(), vocab_source)
+        tt = _encode_words(tt.strip().split(), vocab_target)
+        if alignments is None:
+            src_ids = set(i for w in ss for i in w)
+            trg_ids = set(i for w in tt for i in w)
+            pairs = [(s, t) for s in src_ids for t in trg_ids]
+        else:
+            pairs = set()
+            src_ids = set()
+            for link in alignments.readline().strip().split():
+                src_pos, trg_pos = [int(pos) for pos in link.split("-")]
+                if src_pos >= len(ss) or trg_pos >= len(tt):
+                    raise ValueError("Alignment {} out of range at line {}.".format(link, lidx + 1))
+                src_ids.update(ss[src_pos])
+                pairs.update((s, t) for s in ss[src_pos] for t in tt[trg_pos])
+            trg_ids = set(i for w in tt for i in w)
+        source_counts.update(src_ids)
+        target_counts.update(trg_ids)
+        for s, t in pairs:
+            cooccur_counts[s][t] += 1
+    close_file(features)
+    close_file(labels)
+    if alignments is not None:
+        close_file(alignments)
+
+    shortlist = dict()
+    for s, counts in cooccur_counts.items():
+        if alignments is None:
+            scores = {t: 2. * c / (source_counts[s] + target_counts[t]) for t, c in counts.items()}
+        else:
+            scores = {t: c / source_counts[s] for t, c in counts.items()}
+        shortlist[s] = sorted(scores, key=lambda t: (-scores[t], t))[:num_candidates]
+    return shortlist
+
+
+def save_lexical_shortlist(shortlist, filename, vocab_source, vocab_target):
+    """ Saves the shortlist returned by `build_lexical_shortlist()`.
+
+    Args:
+        shortlist: A dict mapping each source token id to a list of target token ids.
+        filename: The shortlist file name.
+        vocab_source: A `Vocab` object of source side.
+        vocab_target: A `Vocab` object of target side.
+    """
+    with open_file(filename, encoding="utf-8", mode="w") as fw:
+        for s in sorted(shortlist.keys()):
+            fw.write(vocab_source[s] + "\t"
+                     + " ".join([vocab_target[t] for t in shortlist[s]]) + "\n")
+
+
+def load_lexical_shortlist(filename,
+                           vocab_source,
+                           vocab_target,
+                           num_candidates=None,
+                           num_frequent_words=100):
+    """ Loads the shortlist as lookup tables.
+
+    Args:
+        filename: The shortlist file name.
+        vocab_source: A `Vocab` object of source side.
+        vocab_target: A `Vocab` object of target side.
+        num_candidates: The maximum number of candidates of each source token
+          to be loaded. If not provided, load all.
+        num_frequent_words: The number of the most frequent target tokens
+          (the first ones in the vocabulary) that are always candidates.
+
+    Returns: A tuple `(candidates, frequent_ids)`, where `candidates` is a
+      numpy.ndarray with shape [source_vocab_size, max_num_candidates], padded
+      with the target EOS id, and `frequent_ids` is a 1-d numpy.ndarray of
+      the target EOS id, the special token ids and the frequent token ids.
+    """
+    rows = dict()
+    with open_file(filename, encoding="utf-8") as fp:
+        for line in fp:
+            source_token, _, target_tokens = line.rstrip("\n").partition("\t")
+            if source_token not in vocab_source.vocab_dict:
+                continue
+            ids = [vocab_target.vocab_dict[t] for t in target_tokens.split()
+                   if t in vocab_target.vocab_dict]
+            if num_candidates is not None:
+                ids = ids[:num_candidates]
+            rows[vocab_source.vocab_dict[source_token]] = ids
+    max_num_candidates = max([1] + [len(ids) for ids in rows.values()])
+    candidates = numpy.full([vocab_source.vocab_size, max_num_candidates],
+                            vocab_target.eos_id, dtype=numpy.int32)
+    for s, ids in rows.items():
+        candidates[s, :len(ids)] = ids
+    # EOS is the first one
+    frequent_ids = [vocab_target.eos_id, vocab_target.sos_id, vocab_target.unk_id] \
+                   + list(range(min(num_frequent_words, vocab_target.vocab_size)))
+    return candidates, numpy.array(frequent_ids, dtype=numpy.int32)
@@ -16,16 +16,26 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import itertools
+import multiprocessing
+import sys
+import threading
+import time
 from abc import ABCMeta, abstractmethod
 
 import numpy
 import six
 import tensorflow as tf
+from six.moves import queue
 
+from njunmt.data.compiled_corpus import CompiledCorpus
+from njunmt.data.compiled_corpus import FEATURES_SUFFIX
+from njunmt.data.compiled_corpus import LABELS_SUFFIX
 from njunmt.utils.constants import Constants
 from njunmt.utils.constants import concat_name
 from njunmt.utils.misc import open_file, close_file
 from njunmt.utils.misc import shuffle_data
+from njunmt.utils.misc import shuffle_data_in_background
 from njunmt.utils.misc import padding_batch_data
 from njunmt.utils.expert_utils import repeat_n_times
 
@@ -55,6 +65,85 @@ def read_line_with_filter(
     return tokens
 
 
+def filter_by_length(tokens, filter_length=None):
+    """ Filters the encoded line by `filter_length`, the same
+    as `read_line_with_filter`.
+
+    Args:
+        tokens: A list.
+        filter_length: An integer, the maximum length of one line.
+
+    Returns: `tokens` or None if it is too long.
+    """
+    if filter_length and len(tokens) > filter_length:
+        return None
+    return tokens
+
+
+_ENCODING_VOCABS = None
+
+
+def _init_encoding_worker(vocabs):
+    """ Initializer of encoding processes, keeps `vocabs` in the process
+    so that they are transferred only once. """
+    global _ENCODING_VOCABS
+    _ENCODING_VOCABS = vocabs
+
+
+def _encode_chunk(args):
+    """ Encodes a chunk of lines with one of the `_ENCODING_VOCABS`.
+
+    Args:
+        args: A tuple `(vocab_index, lines)`.
+
+    Returns: A list of token id lists.
+    """
+    vocab_index, lines = args
+    vocab = _ENCODING_VOCABS[vocab_index]
+    return [vocab.convert_to_idlist(line) for line in lines]
+
+
+class MultiprocessingEncoder(object):
+    """ Encodes lines into token ids (`Vocab.convert_to_idlist`, including BPE)
+    with a process pool, keeping the order of lines. """
+
+    def __init__(self, vocabs, num_processes):
+        """ Initializes the process pool.
+
+        Args:
+            vocabs: A list of `Vocab` objects.
+            num_processes: The number of encoding processes.
+        """
+        self._num_processes = num_processes
+        self._pool = multiprocessing.Pool(
+            processes=num_processes,
+            initializer=_init_encoding_worker,
+            initargs=(vocabs,))
+
+    def encode(self, lines, vocab_index=0):
+        """ Encodes `lines` in parallel chunks.
+
+        Args:
+            lines: A list of strings.
+            vocab_index: The index of the vocabulary in `vocabs`
+              passed to the constructor.
+
+        Returns: A list of token id lists in the same order of `lines`.
+        """
+        if len(lines) == 0:
+            return []
+        chunk_size = max(1, (len(lines) - 1) // (self._num_processes * 4) + 1)
+        chunks = [(vocab_index, lines[idx: idx + chunk_size])
+                  for idx in range(0, len(lines), chunk_size)]
+        return [ids for encoded_chunk in self._pool.map(_encode_chunk, chunks)
+                for ids in encoded_chunk]
+
+    def close(self):
+        """ Terminates the process pool. """
+        self._pool.terminate()
+        self._pool.join()
+
+
 def do_bucketing(pivot, args):
     """ Sorts the `pivot` and args by length of `pivot`.
 
@@ -73,6 +162,103 @@ def do_bucketing(pivot, args):
     return _pivot, _args
 
 
+def make_length_bucketed_batches(features_lengths,
+                                  labels_lengths,
+                                  batch_size,
+                                  batch_tokens_size=None,
+                                  shuffle=True):
+    """ Groups sentence pairs of similar lengths over the whole corpus into batches.
+
+    Sentence pairs are sorted by the length of labels and then features
+    (ties are broken randomly if `shuffle`), and cut into consecutive batches.
+    With `batch_tokens_size`, each batch has at least `batch_size` pairs and
+    grows while its padded size, i.e. the maximum length of both sides times
+    the number of pairs, is within `batch_tokens_size`. Note that this differs
+    from the read-ahead bucketing of `ParallelTextInputter`, which bounds the
+    summed lengths of each side.
+
+    Args:
+        features_lengths: A 1-d numpy.ndarray, the lengths of features.
+        labels_lengths: A 1-d numpy.ndarray, the lengths of labels.
+        batch_size: An integer, the number of sentence pairs of each batch
+          (the minimum number if `batch_tokens_size` is provided).
+        batch_tokens_size: An integer, the maximum number of padded tokens
+          of each batch.
+        shuffle: Whether to break ties randomly and shuffle the order of batches.
+
+    Returns: A list of 1-d numpy.ndarray, the positions of sentence pairs of each batch.
+    """
+    num_samples = len(features_lengths)
+    if num_samples == 0:
+        return []
+    tie_breaker = numpy.random.random(num_samples) if shuffle else numpy.arange(num_samples)
+    sorted_idx = numpy.lexsort((tie_breaker, features_lengths, labels_lengths))
+    if batch_tokens_size is None:
+        boundaries = numpy.arange(batch_size, num_samples, batch_size)
+    else:
+        sorted_lengths = numpy.maximum(
+            numpy.asarray(features_lengths)[sorted_idx],
+            numpy.asarray(labels_lengths)[sorted_idx]).astype(numpy.int64)
+        boundaries = []
+        start = 0
+        while start < num_samples:
+            # a batch starting at `start` never has more pairs than this
+            max_num = max(batch_size, batch_tokens_size // max(sorted_lengths[start], 1))
+            # the padded sizes of the batch with 1, 2, ... pairs, non-decreasing
+            padded_sizes = numpy.maximum.accumulate(sorted_lengths[start: start + max_num]) \
+                * numpy.arange(1, min(max_num, num_samples - start) + 1)
+            num = max(batch_size, numpy.searchsorted(padded_sizes, batch_tokens_size, side="right"))
+            start += num
+            if start < num_samples:
+                boundaries.append(start)
+    batches = numpy.split(sorted_idx, boundaries)
+    if shuffle:
+        numpy.random.shuffle(batches)
+    return batches
+
+
+def make_inference_batches(lengths,
+                           batch_size,
+                           batch_tokens_size=None,
+                           sort_by_length=False):
+    """ Groups sentences into batches for inference.
+
+    Each batch has at most `batch_size` sentences and, if `batch_tokens_size`
+    is provided, at most `batch_tokens_size` padded tokens (but at least one
+    sentence). If `sort_by_length`, sentences of similar lengths are put into
+    the same batch, so that fewer paddings are decoded.
+
+    Args:
+        lengths: A 1-d numpy.ndarray, the lengths of sentences.
+        batch_size: An integer, the maximum number of sentences of each batch.
+        batch_tokens_size: An integer, the maximum number of padded tokens
+          of each batch.
+        sort_by_length: Whether to sort sentences by length before batching.
+
+    Returns: A list of 1-d numpy.ndarray, the line numbers of sentences of each batch.
+    """
+    num_samples = len(lengths)
+    if sort_by_length:
+        # the longest first, so that memory errors appear at the beginning
+        sorted_idx = numpy.argsort(-lengths, kind="mergesort")
+    else:
+        sorted_idx = numpy.arange(num_samples)
+    batches = []
+    start = 0
+    while start < num_samples:
+        end = start + 1
+        max_len = lengths[sorted_idx[start]]
+        while end < num_samples and end - start < batch_size:
+            if batch_tokens_size is not None and \
+                    max(max_len, lengths[sorted_idx[end]]) * (end - start + 1) > batch_tokens_size:
+                break
+            max_len = max(max_len, lengths[sorted_idx[end]])
+            end += 1
+        batches.append(sorted_idx[start:end])
+        start = end
+    return batches
+
+
 def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields):
     """
 
@@ -119,6 +305,111 @@ def pack_feed_dict(name_prefixs, origin_datas, paddings, input_fields):
     return data
 
 
+class PrefetchingIterator(object):
+    """ Wraps an iterator of feeding data (e.g. the one returned by
+    `ParallelTextInputter.make_feeding_data`) and prepares its outputs
+    ahead of time in a background thread, so that data reading, BPE,
+    bucketing and padding overlap with `tf.Session().run`.
+
+    The end of each epoch (StopIteration of the wrapped iterator) is
+    passed through, so this class can replace the wrapped iterator as is.
+    """
+
+    _END_OF_EPOCH = object()
+
+    def __init__(self, iterator, prefetch_depth):
+        """ Initializes and starts the producer thread.
+
+        Args:
+            iterator: An iterator that raises StopIteration at the end of
+              each epoch and restarts automatically, like `_BigParallelData`.
+            prefetch_depth: An integer, the maximum number of prepared
+              batches kept in the queue.
+
+        Raises:
+            ValueError: if `prefetch_depth` is not a positive integer.
+        """
+        if prefetch_depth is None or prefetch_depth <= 0:
+            raise ValueError("prefetch_depth should be a positive integer.")
+        self._iterator = iterator
+        self._queue = queue.Queue(maxsize=prefetch_depth)
+        self._stop_event = threading.Event()
+        self._wait_time = 0.
+        self._num_batches = 0
+        # the exc_info raised by the producer, raised again on later calls
+        self._error = None
+        self._thread = threading.Thread(target=self._produce, name="PrefetchingIterator")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """ Puts `item` into the queue unless the iterator is stopped. """
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=1.)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        """ The loop of the producer thread. """
+        while not self._stop_event.is_set():
+            try:
+                item = self._iterator.next()
+            except StopIteration:
+                item = self._END_OF_EPOCH
+            except Exception:  # pass the exception to the consumer
+                self._put(sys.exc_info())
+                return
+            if not self._put(item):
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """ capable for python3 """
+        return self.next()
+
+    def next(self):
+        if self._error is not None:
+            # the producer has exited, nothing more will be put into the queue
+            six.reraise(*self._error)
+        start_time = time.time()
+        item = self._queue.get()
+        self._wait_time += time.time() - start_time
+        if item is self._END_OF_EPOCH:
+            raise StopIteration
+        if isinstance(item, tuple):
+            self._error = item
+            six.reraise(*item)
+        self._num_batches += 1
+        return item
+
+    def pop_statistics(self):
+        """ Returns the statistics since last call and resets them.
+
+        Returns: A tuple `(wait_secs_per_batch, num_batches, queue_size)`,
+          where `wait_secs_per_batch` is the average time the consumer
+          is blocked waiting for a batch.
+        """
+        wait_secs_per_batch = self._wait_time / max(self._num_batches, 1)
+        num_batches = self._num_batches
+        self._wait_time = 0.
+        self._num_batches = 0
+        return wait_secs_per_batch, num_batches, self._queue.qsize()
+
+    def stop(self):
+        """ Stops the producer thread. """
+        self._stop_event.set()
+        self._thread.join()
+
+
+# the cache of in-memory feeding data, see `ParallelTextInputter._SmallParallelData`
+_IN_MEMORY_FEEDING_DATA = dict()
+
+
 @six.add_metaclass(ABCMeta)
 class TextInputter(object):
     """Base class for inputters. """
@@ -138,7 +429,11 @@ class TextLineInputter(TextInputter):
     def __init__(self,
                  dataset,
                  data_field_name,
-                 batch_size):
+                 batch_size,
+                 num_processes=1,
+                 batch_tokens_size=None,
+                 sort_by_length=False,
+                 sort_window_size=None):
         """ Initializes the parameters for this inputter.
 
         Args:
@@ -147,6 +442,17 @@ class TextLineInputter(TextInputter):
               access to a data file.
             batch_size: An integer value indicating the number of
               sentences passed into one step. Sentences will be padded by EOS.
+            num_processes: The number of processes for encoding lines
+              into token ids (including BPE).
+            batch_tokens_size: An integer value indicating the maximum number
+              of padded tokens passed into one step, if provided.
+            sort_by_length: Whether to sort all lines of a file by length
+              (after BPE is applied) before batching. The line numbers of each
+              batch are packed as "line_ids" to restore the order.
+            sort_window_size: If provided, the lines are sorted by length
+              within windows of this many lines instead of the whole file,
+              so that only one window of lines (and of hypothesis in
+              `infer()`) is buffered.
 
         Raises:
             ValueError: if `batch_size` is None, or if `dataset` has no
@@ -166,11 +472,15 @@ class TextLineInputter(TextInputter):
             raise ValueError("error type with for attribute \"{}\" of dataset, "
                              "which should be str or list".format(data_field_name))
         if "features" in data_field_name:
-            self._preprocessing_fn = lambda x: dataset.vocab_source.convert_to_idlist(x)
-            self._padding = dataset.vocab_source.pad_id
+            self._vocab = dataset.vocab_source
         else:
-            self._preprocessing_fn = lambda x: dataset.vocab_target.convert_to_idlist(x)
-            self._padding = dataset.vocab_target.pad_id
+            self._vocab = dataset.vocab_target
+        self._preprocessing_fn = lambda x: self._vocab.convert_to_idlist(x)
+        self._padding = self._vocab.pad_id
+        self._num_processes = num_processes
+        self._batch_tokens_size = batch_tokens_size
+        self._sort_by_length = sort_by_length
+        self._sort_window_size = sort_window_size
 
     def _make_feeding_data_from(self,
                                 filename,
@@ -178,6 +488,11 @@ class TextLineInputter(TextInputter):
                                 maximum_length=None):
         """ Processes the data file and return an iterable instance for loop.
 
+        The lines are read, encoded and batched window by window, so that
+        only one window of lines is kept in memory: the windows have
+        `sort_window_size` lines (the whole file if None) if `sort_by_length`,
+        or `batch_size` * 100 lines otherwise.
+
         Args:
             filename: A specific data file.
             input_fields: A dict of placeholders.
@@ -185,31 +500,49 @@ class TextLineInputter(TextInputter):
               after BPE is applied). If provided symbols of one sentence exceeding
               this value will be ignore.
 
-        Returns: An iterable instance that packs feeding dictionary
+        Returns: A generator that yields packed feeding dictionaries
                    for `tf.Session().run` according to the `filename`.
+                   Each element also has "line_ids", the line numbers of
+                   the sentences in the file.
         """
-        features = open_file(filename, encoding="utf-8")
-        ss_buf = []
-        encoded_ss = read_line_with_filter(features, maximum_length, self._preprocessing_fn)
-        while encoded_ss != "":
-            ss_buf.append(encoded_ss)
-            encoded_ss = read_line_with_filter(features, maximum_length, self._preprocessing_fn)
-        close_file(features)
-        data = []
-        batch_data_idx = 0
+        window_size = self._sort_window_size if self._sort_by_length \
+            else self._batch_size * 100
         name_prefix = Constants.FEATURE_NAME_PREFIX \
             if "features" in self._data_field_name else Constants.LABEL_NAME_PREFIX
+        features = open_file(filename, encoding="utf-8")
+        encoder = None
+        if self._num_processes > 1:
+            encoder = MultiprocessingEncoder([self._vocab], self._num_processes)
+        try:
+            window_start = 0
+            while True:
+                lines = [line.strip() for line in itertools.islice(features, window_size)]
+                if len(lines) == 0:
+                    break
+                if encoder is not None:
+                    ss_buf = [filter_by_length(ss, maximum_length) for ss in encoder.encode(lines)]
+                else:
+                    ss_buf = [filter_by_length(self._preprocessing_fn(line), maximum_length)
+                              for line in lines]
+                for line_ids in make_inference_batches(
+                        numpy.array([len(ss) for ss in ss_buf], dtype=numpy.int64),
+                        batch_size=self._batch_size,
+                        batch_tokens_size=self._batch_tokens_size,
+                        sort_by_length=self._sort_by_length):
+                    batch_data = pack_feed_dict(
+                        name_prefixs=name_prefix,
+                        origin_datas=[ss_buf[i] for i in line_ids],
+                        paddings=self._padding,
+                        input_fields=input_fields)
+                    batch_data["line_ids"] = (line_ids + window_start).tolist()
+                    yield batch_data
+                window_start += len(lines)
+        finally:
+            if encoder is not None:
+                encoder.close()
+            close_file(features)
 
-        while batch_data_idx < len(ss_buf):
-            data.append(pack_feed_dict(
-                name_prefixs=name_prefix,
-                origin_datas=ss_buf[batch_data_idx: batch_data_idx + self._batch_size],
-                paddings=self._padding,
-                input_fields=input_fields))
-            batch_data_idx += self._batch_size
-        return data
-
-    def make_feeding_data(self, input_fields, maximum_length=None):
+    def make_feeding_data(self, input_fields, maximum_length=None, in_memory=False):
         """ Processes the data file(s) and return an iterable
         instance for loop.
 
@@ -218,15 +551,21 @@ class TextLineInputter(TextInputter):
             maximum_length: The maximum length of symbols (especially
               after BPE is applied). If provided symbols of one sentence exceeding
               this value will be ignore.
+            in_memory: Whether to load all data into memory. If False, the
+              returned generator(s) read the file(s) lazily and can only be
+              iterated once.
 
         Returns: An iterable instance or a list of iterable
                    instances according to the `data_field_name`
                    in the constructor.
         """
+        def _make_feeding_data(filename):
+            data = self._make_feeding_data_from(filename, input_fields, maximum_length)
+            return list(data) if in_memory else data
+
         if isinstance(self._data_files, list):
-            return [self._make_feeding_data_from(filename, input_fields, maximum_length)
-                    for filename in self._data_files]
-        return self._make_feeding_data_from(self._data_files, input_fields, maximum_length)
+            return [_make_feeding_data(filename) for filename in self._data_files]
+        return _make_feeding_data(self._data_files)
 
 
 class ParallelTextInputter(TextInputter):
@@ -240,7 +579,10 @@ class ParallelTextInputter(TextInputter):
                  batch_tokens_size=None,
                  shuffle_every_epoch=None,
                  fill_full_batch=False,
-                 bucketing=True):
+                 bucketing=True,
+                 compiled_corpus=None,
+                 num_processes=1,
+                 global_bucketing=False):
         """ Initializes the parameters for this inputter.
 
         Args:
@@ -259,11 +601,24 @@ class ParallelTextInputter(TextInputter):
             fill_full_batch: Whether to ensure each batch of data has `batch_size`
               of datas.
             bucketing: Whether to sort the sentences by length of labels.
+            compiled_corpus: The prefix of the compiled corpus generated by
+              bin/compile_corpus.py. If provided, data is read from the
+              memory-mapped binary files instead of the text files, and
+              `shuffle_every_epoch` only means shuffling (no file is written).
+            num_processes: The number of processes for encoding lines
+              into token ids (including BPE). The processes are created
+              here, so the inputter should be created before the
+              `tf.Session` and closed by `close()` at the end.
+            global_bucketing: Whether to group sentence pairs into batches
+              by length over the whole corpus (instead of within `cache_size`
+              sentences), the batches are drawn in random order each epoch.
+              Only available with `compiled_corpus`, which provides the lengths.
 
         Raises:
             ValueError: if both `batch_size` and `batch_tokens_size` are
               not provided, or if `dataset` has no attribute name
-              `features_field_name` or `labels_field_name`.
+              `features_field_name` or `labels_field_name`, or if
+              `global_bucketing` is used without `compiled_corpus`.
 
         """
         super(ParallelTextInputter, self).__init__()
@@ -280,6 +635,10 @@ class ParallelTextInputter(TextInputter):
         self._features_file = getattr(dataset, features_field_name)
         self._labels_file = getattr(dataset, labels_field_name)
         self._bucketing = bucketing
+        self._compiled_corpus = compiled_corpus
+        self._global_bucketing = global_bucketing
+        if global_bucketing and not compiled_corpus:
+            raise ValueError("global_bucketing is only available with compiled_corpus.")
         if self._batch_size is None and self._batch_tokens_size is None:
             raise ValueError("Either batch_size or batch_tokens_size should be provided.")
         if (self._batch_size is not None) and (self._batch_tokens_size is not None):
@@ -295,6 +654,24 @@ class ParallelTextInputter(TextInputter):
         self._labels_preprocessing_fn = lambda x: dataset.vocab_target.convert_to_idlist(x)
         self._features_padding = dataset.vocab_source.pad_id
         self._labels_padding = dataset.vocab_target.pad_id
+        self._vocab_source = dataset.vocab_source
+        self._vocab_target = dataset.vocab_target
+        self._num_processes = num_processes
+        self._encoder = None
+        if self._num_processes > 1:
+            # fork the workers now, before any tf.Session or thread is created
+            self._encoder = MultiprocessingEncoder(
+                [self._vocab_source, self._vocab_target], self._num_processes)
+
+    def _get_encoder(self):
+        """ Returns the `MultiprocessingEncoder`, or None if `num_processes` <= 1. """
+        return self._encoder
+
+    def close(self):
+        """ Terminates the encoding processes, if any. """
+        if self._encoder is not None:
+            self._encoder.close()
+            self._encoder = None
 
     def make_feeding_data(self,
                           input_fields,
@@ -320,6 +697,14 @@ class ParallelTextInputter(TextInputter):
             raise ValueError(
                 "in_memory option with _SmallParallelData fn now only deal with evaluation data. "
                 "fill_full_batch for ParallelTextInputter is only for training data.")
+        if self._compiled_corpus and self._global_bucketing:
+            return self._GloballyBucketedParallelData(
+                self, self._compiled_corpus, input_fields,
+                maximum_features_length, maximum_labels_length)
+        if self._compiled_corpus:
+            return self._CompiledParallelData(
+                self, self._compiled_corpus, input_fields,
+                maximum_features_length, maximum_labels_length)
         if self._features_file is None or self._labels_file is None:
             raise ValueError("Both _features_file and _labels_file should be provided.")
         if isinstance(self._features_file, list):
@@ -358,7 +743,7 @@ class ParallelTextInputter(TextInputter):
         if features_file is None or labels_file is None:
             raise ValueError("Both features_file and labels_file should be provided.")
         if in_memory:
-            self._SmallParallelData(
+            return self._SmallParallelData(
                 features_file, labels_file, input_fields,
                 maximum_features_length, maximum_labels_length)
         return self._BigParallelData(
@@ -387,20 +772,46 @@ class ParallelTextInputter(TextInputter):
 
         Returns: A list of feeding data.
         """
+        # the feeding data is cached once per process, and reused by all
+        # evaluations with the same files, settings and placeholders
+        cache_key = (features_file,
+                     tuple(labels_file) if isinstance(labels_file, list) else labels_file,
+                     maximum_features_length, maximum_labels_length,
+                     self._batch_size, self._bucketing,
+                     self._vocab_source, self._vocab_target,
+                     tuple([v for inpf in input_fields
+                            for _, v in sorted(inpf.items(), key=lambda x: x[0])]))
+        if cache_key in _IN_MEMORY_FEEDING_DATA:
+            return _IN_MEMORY_FEEDING_DATA[cache_key]
         features = open_file(features_file, encoding="utf-8")
         labels = open_file(labels_file[0], encoding="utf-8")
 
         ss_buf = []
         tt_buf = []
-        while True:
-            ss = read_line_with_filter(features, maximum_features_length,
-                                       self._features_preprocessing_fn)
-            tt = read_line_with_filter(labels, maximum_labels_length,
-                                       self._labels_preprocessing_fn)
-            if ss == "" or tt == "":
-                break
-            ss_buf.append(ss)
-            tt_buf.append(tt)
+        encoder = self._get_encoder()
+        if encoder is not None:
+            raw_ss, raw_tt = [], []
+            for ss, tt in zip(features, labels):
+                raw_ss.append(ss.strip())
+                raw_tt.append(tt.strip())
+            for ss, tt in zip(encoder.encode(raw_ss, 0), encoder.encode(raw_tt, 1)):
+                if filter_by_length(ss, maximum_features_length) is None \
+                        or filter_by_length(tt, maximum_labels_length) is None:
+                    continue
+                ss_buf.append(ss)
+                tt_buf.append(tt)
+        else:
+            while True:
+                ss = read_line_with_filter(features, maximum_features_length,
+                                           self._features_preprocessing_fn)
+                tt = read_line_with_filter(labels, maximum_labels_length,
+                                           self._labels_preprocessing_fn)
+                if ss == "" or tt == "":
+                    break
+                if ss is None or tt is None:
+                    continue
+                ss_buf.append(ss)
+                tt_buf.append(tt)
         close_file(features)
         close_file(labels)
         if self._bucketing:
@@ -417,6 +828,11 @@ class ParallelTextInputter(TextInputter):
                     paddings=[self._features_padding, self._labels_padding],
                     input_fields=input_fields))
             batch_data_idx += self._batch_size
+        num_bytes = sum([v.nbytes for d in data for v in d["feed_dict"].values()
+                         if isinstance(v, numpy.ndarray)])
+        tf.logging.info("Caching {} sentence pairs of {} in memory: {} batches, {:.2f} MB of padded data."
+                        .format(len(ss_buf), features_file, len(data), num_bytes / 1024. / 1024.))
+        _IN_MEMORY_FEEDING_DATA[cache_key] = data
         return data
 
     class _BigParallelData(object):
@@ -449,7 +865,7 @@ class ParallelTextInputter(TextInputter):
                 else labels_file
             self._maximum_features_length = maximum_features_length
             self._maximum_labels_length = maximum_labels_length
-            self._features, self._labels = self._shuffle_and_reopen()
+            self._reset()
             self._features_buffer = []
             self._labels_buffer = []
             self._features_len_buffer = []
@@ -461,6 +877,7 @@ class ParallelTextInputter(TextInputter):
             return self
 
         def _reset(self):
+            """ Prepares for a new epoch. """
             self._features, self._labels = self._shuffle_and_reopen()
 
         def __next__(self):
@@ -475,19 +892,7 @@ class ParallelTextInputter(TextInputter):
 
             assert len(self._features_buffer) == len(self._labels_buffer), "Buffer size mismatch"
             if len(self._features_buffer) < self._parent._batch_size:
-                cnt = len(self._features_buffer)
-                while cnt < self._parent._cache_size:
-                    ss = read_line_with_filter(self._features, self._maximum_features_length,
-                                               self._parent._features_preprocessing_fn)
-                    tt = read_line_with_filter(self._labels, self._maximum_labels_length,
-                                               self._parent._labels_preprocessing_fn)
-                    if ss == "" or tt == "":
-                        break
-                    if ss is None or tt is None:
-                        continue
-                    cnt += 1
-                    self._features_buffer.append(ss)
-                    self._labels_buffer.append(tt)
+                self._fill_buffer()
                 if len(self._features_buffer) == 0 or len(self._labels_buffer) == 0:
                     self._end_of_data = False
                     self._reset()
@@ -542,27 +947,188 @@ class ParallelTextInputter(TextInputter):
                 ret_data["feed_dict"].pop("parallels")
             return ret_data
 
+        def _fill_buffer(self):
+            """ Reads and encodes lines until the buffer reaches
+            `cache_size` or the end of the files. """
+            encoder = self._parent._get_encoder()
+            if encoder is not None:
+                self._fill_buffer_with_encoder(encoder)
+                return
+            cnt = len(self._features_buffer)
+            while cnt < self._parent._cache_size:
+                ss = read_line_with_filter(self._features, self._maximum_features_length,
+                                           self._parent._features_preprocessing_fn)
+                tt = read_line_with_filter(self._labels, self._maximum_labels_length,
+                                           self._parent._labels_preprocessing_fn)
+                if ss == "" or tt == "":
+                    break
+                if ss is None or tt is None:
+                    continue
+                cnt += 1
+                self._features_buffer.append(ss)
+                self._labels_buffer.append(tt)
+
+        def _fill_buffer_with_encoder(self, encoder):
+            """ Reads lines until the buffer reaches `cache_size` or the end
+            of the files, and encodes them in parallel with `encoder`. """
+            end_of_file = False
+            while not end_of_file and len(self._features_buffer) < self._parent._cache_size:
+                raw_ss, raw_tt = [], []
+                while len(raw_ss) < self._parent._cache_size - len(self._features_buffer):
+                    ss = self._features.readline()
+                    tt = self._labels.readline()
+                    if ss == "" or tt == "":
+                        end_of_file = True
+                        break
+                    raw_ss.append(ss.strip())
+                    raw_tt.append(tt.strip())
+                for ss, tt in zip(encoder.encode(raw_ss, 0), encoder.encode(raw_tt, 1)):
+                    if filter_by_length(ss, self._maximum_features_length) is None \
+                            or filter_by_length(tt, self._maximum_labels_length) is None:
+                        continue
+                    self._features_buffer.append(ss)
+                    self._labels_buffer.append(tt)
+
         def _shuffle_and_reopen(self):
-            """ shuffle features & labels file. """
+            """ shuffle features & labels file.
+
+            Two shuffled copies are used alternately: while one is being read,
+            the other is shuffled from the original files in background for
+            the next epoch.
+            """
             if self._parent._shuffle_every_epoch:
-                if not hasattr(self, "_shuffled_features_file"):
-                    self._shuffled_features_file = self._features_file.strip().split("/")[-1] \
-                                                   + "." + self._parent._shuffle_every_epoch
-                    self._shuffled_labels_file = self._labels_file.strip().split("/")[-1] \
-                                                 + "." + self._parent._shuffle_every_epoch
-
-                tf.logging.info("shuffling data\n\t{} ==> {}\n\t{} ==> {}"
-                                .format(self._features_file, self._shuffled_features_file,
-                                        self._labels_file, self._shuffled_labels_file))
-                shuffle_data([self._features_file, self._labels_file],
-                             [self._shuffled_features_file, self._shuffled_labels_file])
-                self._features_file = self._shuffled_features_file
-                self._labels_file = self._shuffled_labels_file
+                if not hasattr(self, "_shuffled_files"):
+                    self._origin_files = [self._features_file, self._labels_file]
+                    self._shuffled_files = [
+                        [f.strip().split("/")[-1] + "." + self._parent._shuffle_every_epoch + postfix
+                         for f in self._origin_files] for postfix in ["", ".next"]]
+                    self._shuffling_thread = None
+                if self._shuffling_thread is None:
+                    tf.logging.info("shuffling data\n\t{} ==> {}\n\t{} ==> {}"
+                                    .format(self._origin_files[0], self._shuffled_files[0][0],
+                                            self._origin_files[1], self._shuffled_files[0][1]))
+                    shuffle_data(self._origin_files, self._shuffled_files[0])
+                else:
+                    self._shuffling_thread.wait()
+                self._features_file, self._labels_file = self._shuffled_files[0]
                 if hasattr(self, "_features"):
                     close_file(self._features)
                     close_file(self._labels)
+                # prepare the data for next epoch
+                self._shuffled_files = self._shuffled_files[::-1]
+                tf.logging.info("shuffling data in background\n\t{} ==> {}\n\t{} ==> {}"
+                                .format(self._origin_files[0], self._shuffled_files[0][0],
+                                        self._origin_files[1], self._shuffled_files[0][1]))
+                self._shuffling_thread = shuffle_data_in_background(
+                    self._origin_files, self._shuffled_files[0])
             elif hasattr(self, "_features"):
                 self._features.seek(0)
                 self._labels.seek(0)
                 return self._features, self._labels
             return open_file(self._features_file), open_file(self._labels_file)
+
+    class _CompiledParallelData(_BigParallelData):
+        """ An iterator class for reading compiled (memory-mapped) parallel data.
+
+        The data is produced by `compile_parallel_corpus` (see bin/compile_corpus.py),
+        so batching reduces to slicing of memory-mapped arrays. Shuffling is done
+        by permuting the sentence indices in memory instead of rewriting files.
+        """
+
+        def __init__(self,
+                     parent,
+                     prefix,
+                     input_fields,
+                     maximum_features_length=None,
+                     maximum_labels_length=None):
+            """ Initializes.
+
+            Args:
+                parent: A `ParallelTextInputter` object.
+                prefix: The prefix of the compiled corpus files.
+                input_fields: A dict of placeholders.
+                maximum_features_length: The maximum length of feature symbols (especially
+                  after BPE is applied) . If provided, the number of symbols of one sentence
+                  exceeding this value will be ignore.
+                maximum_labels_length: The maximum length of label symbols (especially
+                  after BPE is applied) . If provided, the number of symbols of one sentence
+                  exceeding this value will be ignore.
+
+            Raises:
+                ValueError: if the compiled features and labels have different
+                  number of lines.
+            """
+            self._features_corpus = CompiledCorpus(
+                prefix + FEATURES_SUFFIX, parent._vocab_source)
+            self._labels_corpus = CompiledCorpus(
+                prefix + LABELS_SUFFIX, parent._vocab_target)
+            if len(self._features_corpus) != len(self._labels_corpus):
+                raise ValueError("Compiled corpus {}: features has {} lines while labels has {} lines."
+                                 .format(prefix, len(self._features_corpus), len(self._labels_corpus)))
+            keep = numpy.ones(len(self._features_corpus), dtype=bool)
+            if maximum_features_length:
+                keep &= (self._features_corpus.lengths <= maximum_features_length)
+            if maximum_labels_length:
+                keep &= (self._labels_corpus.lengths <= maximum_labels_length)
+            self._indices = numpy.where(keep)[0]
+            self._cursor = 0
+            tf.logging.info("Reading compiled corpus {}: {} of {} sentence pairs are kept."
+                            .format(prefix, len(self._indices), len(keep)))
+            super(ParallelTextInputter._CompiledParallelData, self).__init__(
+                parent, prefix + FEATURES_SUFFIX, prefix + LABELS_SUFFIX,
+                input_fields, maximum_features_length, maximum_labels_length)
+
+        def _reset(self):
+            """ Prepares for a new epoch. """
+            self._cursor = 0
+            if self._parent._shuffle_every_epoch:
+                numpy.random.shuffle(self._indices)
+
+        def _fill_buffer(self):
+            """ Slices sentences until the buffer reaches
+            `cache_size` or the end of the corpus. """
+            end = min(len(self._indices),
+                      self._cursor + self._parent._cache_size - len(self._features_buffer))
+            for idx in self._indices[self._cursor:end]:
+                self._features_buffer.append(self._features_corpus[idx])
+                self._labels_buffer.append(self._labels_corpus[idx])
+            self._cursor = max(end, self._cursor)
+
+    class _GloballyBucketedParallelData(_CompiledParallelData):
+        """ An iterator class for reading compiled parallel data, which
+        draws batches of similar lengths over the whole corpus.
+        See `make_length_bucketed_batches`. """
+
+        def _reset(self):
+            """ Prepares the batches for a new epoch. """
+            features_lengths = self._features_corpus.lengths[self._indices]
+            labels_lengths = self._labels_corpus.lengths[self._indices]
+            self._batches = make_length_bucketed_batches(
+                features_lengths, labels_lengths,
+                self._parent._batch_size, self._parent._batch_tokens_size)
+            self._batch_cursor = 0
+            num_tokens = numpy.sum(features_lengths) + numpy.sum(labels_lengths)
+            num_padded_tokens = sum([len(b) * (numpy.max(features_lengths[b]) + numpy.max(labels_lengths[b]))
+                                     for b in self._batches])
+            tf.logging.info("Bucketing {} sentence pairs into {} batches, non-padding ratio: {:.4f}"
+                            .format(len(self._indices), len(self._batches),
+                                    num_tokens * 1. / max(num_padded_tokens, 1)))
+
+        def next(self):
+            if self._batch_cursor >= len(self._batches):
+                self._reset()
+                raise StopIteration
+            batch = self._indices[self._batches[self._batch_cursor]]
+            self._batch_cursor += 1
+            if self._parent._fill_full_batch and len(batch) < self._parent._batch_size:
+                return self.next()
+            features = [self._features_corpus[idx] for idx in batch]
+            labels = [self._labels_corpus[idx] for idx in batch]
+            ret_data = pack_feed_dict(
+                name_prefixs=[Constants.FEATURE_NAME_PREFIX, Constants.LABEL_NAME_PREFIX],
+                origin_datas=[features, labels],
+                paddings=[self._parent._features_padding, self._parent._labels_padding],
+                input_fields=self._input_fields)
+            if self._parent._fill_full_batch:
+                ret_data["feed_dict"].pop("parallels")
+            return ret_data
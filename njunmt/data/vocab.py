@@ -16,8 +16,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import atexit
 import six
 import collections
+import weakref
+import tensorflow as tf
 from tensorflow import gfile
 from njunmt.data.bpe_encdec import BPE
 from njunmt.utils.constants import Constants
@@ -76,6 +79,17 @@ def create_vocabulary_lookup_table_numpy(filename):
            special_vocab._fields
 
 
+# the vocabularies with BPE, whose cache statistics are logged at exit.
+#   They are weakly referenced, so they are not kept alive until exit
+_VOCABS_WITH_BPE = weakref.WeakSet()
+
+
+@atexit.register
+def _log_bpe_cache_statistics():
+    for vocab in list(_VOCABS_WITH_BPE):
+        vocab.log_bpe_cache_statistics()
+
+
 class Vocab(object):
     """ Class for vocabulary (feature map) """
 
@@ -103,6 +117,20 @@ class Vocab(object):
             if "vocab" not in bpe_codes:
                 bpe_codes["vocab"] = filename
             self._bpe = BPE(**bpe_codes)
+            _VOCABS_WITH_BPE.add(self)
+
+    @property
+    def bpe_cache(self):
+        """ Returns the `BPECache` of BPE segmentations, or None without BPE. """
+        return self._bpe.cache if self._bpe else None
+
+    def log_bpe_cache_statistics(self):
+        """ Logs the hit rate of the BPE segmentation cache. """
+        cache = self.bpe_cache
+        if cache is None or cache.hits + cache.misses == 0:
+            return
+        tf.logging.info("BPE cache: {} hits, {} misses, hit rate {:.2f}%, {} cached words."
+                        .format(cache.hits, cache.misses, cache.hit_rate() * 100., len(cache)))
 
     @property
     def sos_id(self):
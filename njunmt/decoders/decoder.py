@@ -22,10 +22,13 @@ import tensorflow as tf
 
 from njunmt.utils.constants import ModeKeys
 from njunmt.utils.configurable import Configurable
-from njunmt.utils.beam_search import stack_beam_size
+from njunmt.utils.beam_search import stack_cache_beam_size
 from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import backtrace_hypothesis
+from njunmt.utils.beam_search import scatter_live_rows
 from njunmt.utils.beam_search import BeamSearchStateSpec
 from njunmt.utils.expert_utils import DecoderOutputRemover
+from njunmt.utils.feedback import GreedyFeedback
 
 
 class Decoder(Configurable):
@@ -218,7 +221,15 @@ def dynamic_decode(decoder,
           to logits.
         parallel_iterations: Argument passed to `tf.while_loop`.
         swap_memory: Argument passed to `tf.while_loop`.
-        kwargs:
+        kwargs: The `beam_size` and, optionally, `shrink_finished_batch` for
+          decoder.mode=INFER. If `shrink_finished_batch` is True, a sentence
+          is removed from the decoder inputs and cache once all of its beams
+          are finished, so that the remaining steps only compute the live
+          sentences. If `early_termination` is True, a sentence is finished
+          once none of its alive beams can beat its best finished beam, and
+          the alive beams are returned as "pruned".
+          If `helper` is a `GreedyFeedback`, the decoding states are never
+          reordered and `early_termination` is ignored.
 
     Returns: A tuple `(decoder_output, decoder_status)` for
       decoder.mode=INFER.
@@ -244,10 +255,16 @@ def dynamic_decode(decoder,
 
     with tf.variable_scope(decoder.name):
         initial_cache = decoder.prepare(encoder_output, bridge, helper)  # prepare decoder
+        greedy = decoder.mode == ModeKeys.INFER and isinstance(helper, GreedyFeedback)
         if decoder.mode == ModeKeys.INFER:
             assert "beam_size" in kwargs
             beam_size = kwargs["beam_size"]
-            initial_cache = stack_beam_size(initial_cache, beam_size)
+            if not greedy:
+                initial_cache = stack_cache_beam_size(initial_cache, beam_size)
+    shrink_finished_batch = decoder.mode == ModeKeys.INFER \
+                            and kwargs.get("shrink_finished_batch", False)
+    early_termination = decoder.mode == ModeKeys.INFER and not greedy \
+                        and kwargs.get("early_termination", False)
 
     initial_outputs_ta = nest.map_structure(
         _create_ta, decoder_output_remover.apply(decoder.output_dtype))
@@ -256,50 +273,103 @@ def dynamic_decode(decoder,
                         finished, *args):
         """Internal while_loop body.
 
+        When `shrink_finished_batch` is True, `inputs` and `cache` only
+        contain the rows of the sentences having unfinished beams (the live
+        rows), while the beam search status is kept in full size.
+
         Args:
           time: scalar int32 Tensor.
           inputs: The inputs Tensor.
           cache: The decoder states.
           outputs_ta: structure of TensorArray.
           finished: A bool tensor (keeping track of what's finished).
-          args: The log_probs, lengths, infer_status for mode==INFER.
+          args: The log_probs, lengths, bs_stat_ta for mode==INFER,
+            the indices of live rows if `shrink_finished_batch`, and
+            the pruned flags of beams if `early_termination`.
         Returns:
           `(time + 1, next_inputs, next_cache, outputs_ta,
           next_finished, *args)`.
         """
         with tf.variable_scope(decoder.name):
             outputs, next_cache = decoder.step(inputs, cache)
+        outputs_to_write = decoder_output_remover.apply(outputs)
+        if shrink_finished_batch:
+            live_rows = args[3]
+            num_rows = tf.shape(finished)[0]
+            # the rows of finished sentences are filled with zeros
+            outputs_to_write = scatter_live_rows(live_rows, outputs_to_write, num_rows)
         outputs_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
-                                        outputs_ta, decoder_output_remover.apply(outputs))
+                                        outputs_ta, outputs_to_write)
         inner_loop_vars = [time + 1, None, None, outputs_ta, None]
-        sample_ids = None
         if decoder.mode == ModeKeys.INFER:
             log_probs, lengths = args[0], args[1]
             bs_stat_ta = args[2]
-            predicted_ids = args[3]
             with tf.variable_scope(decoder.name):
                 decoder_top_features = decoder.merge_top_features(outputs)
             logits = outputs_to_logits_fn(decoder_top_features)
             # sample next symbols
-            sample_ids, beam_ids, next_log_probs, next_lengths \
-                = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
-            predicted_ids = gather_states(tf.reshape(predicted_ids, [-1, time + 1]), beam_ids)
-
-            next_cache["decoding_states"] = gather_states(next_cache["decoding_states"], beam_ids)
+            if shrink_finished_batch:
+                live_sample_ids, live_beam_ids, live_log_probs, live_lengths = helper.sample_symbols(
+                    logits, tf.gather(log_probs, live_rows), tf.gather(finished, live_rows),
+                    tf.gather(lengths, live_rows), time=time,
+                    batch_size=tf.shape(live_rows)[0] // beam_size)
+                # the finished sentences keep their beams and generate EOS
+                sample_ids, beam_ids, next_log_probs, next_lengths = scatter_live_rows(
+                    live_rows,
+                    [live_sample_ids, tf.gather(live_rows, live_beam_ids), live_log_probs, live_lengths],
+                    num_rows,
+                    defaults=[tf.fill([num_rows], helper.vocab.eos_id), tf.range(num_rows),
+                              log_probs, lengths])
+                live_finished, next_input_symbols = helper.next_symbols(
+                    time=time, sample_ids=live_sample_ids)
+                next_finished = tf.cast(scatter_live_rows(
+                    live_rows, tf.to_int32(live_finished), num_rows), tf.bool)
+            else:
+                sample_ids, beam_ids, next_log_probs, next_lengths \
+                    = helper.sample_symbols(logits, log_probs, finished, lengths, time=time)
+                if not greedy:
+                    next_cache["decoding_states"] = gather_states(next_cache["decoding_states"], beam_ids)
+                next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=sample_ids)
+            next_finished = tf.logical_or(next_finished, finished)
+            if early_termination:
+                # the pruned flags follow their beams
+                next_pruned = tf.gather(args[-1], beam_ids)
+                next_finished, next_pruned = helper.terminate_hopeless_beams(
+                    next_log_probs, next_finished, next_lengths, next_pruned)
+            # the hypotheses are rebuilt from beam_ids and word_ids after decoding
             bs_stat = BeamSearchStateSpec(
                 log_probs=next_log_probs,
-                beam_ids=beam_ids)
+                beam_ids=beam_ids,
+                word_ids=sample_ids)
             bs_stat_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
                                             bs_stat_ta, bs_stat)
-            next_predicted_ids = tf.concat([predicted_ids, tf.expand_dims(sample_ids, axis=1)], axis=1)
-            next_predicted_ids = tf.reshape(next_predicted_ids, [-1])
-            next_predicted_ids.set_shape([None])
-            inner_loop_vars.extend([next_log_probs, next_lengths, bs_stat_ta, next_predicted_ids])
-
-        next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=sample_ids)
+            inner_loop_vars.extend([next_log_probs, next_lengths, bs_stat_ta])
+
+            if shrink_finished_batch:
+                # removes the sentences whose beams are all finished
+                live_sentences = tf.logical_not(tf.reduce_all(
+                    tf.reshape(tf.gather(next_finished, live_rows), [-1, beam_size]), axis=1))
+                keep_ids = tf.reshape(tf.where(tf.reshape(tf.tile(
+                    tf.expand_dims(live_sentences, 1), [1, beam_size]), [-1])), [-1])
+                keep_ids = tf.to_int32(keep_ids)
+                keep_sentence_ids = tf.to_int32(tf.reshape(tf.where(live_sentences), [-1]))
+                next_input_symbols = tf.gather(next_input_symbols, keep_ids)
+                # the timestep of the preallocated cache is shared by all rows
+                cache_keep_ids = {"decoding_states": tf.gather(live_beam_ids, keep_ids),
+                                  "beam_shared": keep_sentence_ids}
+                next_cache = {k: v if k == "preallocated"
+                              else gather_states(v, cache_keep_ids.get(k, keep_ids))
+                              for k, v in next_cache.items()}
+                next_live_rows = tf.gather(live_rows, keep_ids)
+                next_live_rows.set_shape([None])
+                inner_loop_vars.append(next_live_rows)
+            if early_termination:
+                inner_loop_vars.append(next_pruned)
+        else:
+            next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=None)
+            next_finished = tf.logical_or(next_finished, finished)
         next_inputs = target_to_embedding_fn(next_input_symbols, time + 1)
 
-        next_finished = tf.logical_or(next_finished, finished)
         inner_loop_vars[1] = next_inputs
         inner_loop_vars[2] = next_cache
         inner_loop_vars[4] = next_finished
@@ -312,10 +382,13 @@ def dynamic_decode(decoder,
         initial_log_probs = tf.zeros_like(initial_input_symbols, dtype=tf.float32)
         initial_lengths = tf.zeros_like(initial_input_symbols, dtype=tf.int32)
         initial_bs_stat_ta = nest.map_structure(_create_ta, BeamSearchStateSpec.dtypes())
-        # to process hypothesis
-        initial_input_symbols.set_shape([None])
-        loop_vars.extend([initial_log_probs, initial_lengths, initial_bs_stat_ta,
-                          initial_input_symbols])
+        loop_vars.extend([initial_log_probs, initial_lengths, initial_bs_stat_ta])
+        if shrink_finished_batch:
+            initial_live_rows = tf.range(tf.shape(initial_input_symbols)[0])
+            initial_live_rows.set_shape([None])
+            loop_vars.append(initial_live_rows)
+        if early_termination:
+            loop_vars.append(tf.fill(tf.shape(initial_finished), False))
 
     res = tf.while_loop(
         lambda *args: tf.logical_not(tf.reduce_all(args[4])),
@@ -328,13 +401,19 @@ def dynamic_decode(decoder,
     final_outputs = nest.map_structure(lambda ta: ta.stack(), final_outputs_ta)
 
     if decoder.mode == ModeKeys.INFER:
-        timesteps = res[0] + 1
-        log_probs, length, bs_stat, predicted_ids = res[-4:]
+        log_probs, length, bs_stat = res[5:8]
         final_bs_stat = nest.map_structure(lambda ta: ta.stack(), bs_stat)
-        return final_outputs, \
-               {"beam_ids": final_bs_stat.beam_ids,
-                "log_probs": final_bs_stat.log_probs,
-                "decoding_length": length,
-                "hypothesis": tf.reshape(predicted_ids, [-1, timesteps])[:, 1:]}
+        if greedy:
+            # each row keeps its own history, no need to backtrace
+            hypothesis = tf.transpose(final_bs_stat.word_ids)
+        else:
+            hypothesis = backtrace_hypothesis(final_bs_stat.word_ids, final_bs_stat.beam_ids)
+        decoding_result = {"beam_ids": final_bs_stat.beam_ids,
+                           "log_probs": final_bs_stat.log_probs,
+                           "decoding_length": length,
+                           "hypothesis": hypothesis}
+        if early_termination:
+            decoding_result["pruned"] = res[-1]
+        return final_outputs, decoding_result
 
     return final_outputs
@@ -17,6 +17,7 @@ from __future__ import division
 from __future__ import print_function
 
 import tensorflow as tf
+from tensorflow.python.ops import inplace_ops
 from tensorflow.python.util import nest
 from collections import namedtuple
 
@@ -30,6 +31,7 @@ from njunmt.layers.common_layers import layer_postprocessing
 from njunmt.layers.common_layers import transformer_ffn_layer
 from njunmt.layers.common_attention import MultiHeadAttention
 from njunmt.layers.common_attention import attention_bias_lower_triangle
+from njunmt.layers.common_attention import attention_bias_unwritten_slots
 
 
 class TransformerDecoder(Decoder):
@@ -81,7 +83,9 @@ class TransformerDecoder(Decoder):
             "dropout_relu_keep_prob": 0.9,
             "layer_preprocess_sequence": "n",
             "layer_postprocess_sequence": "da",
-            "layer_prepostprocess_dropout_keep_prob": 0.9
+            "layer_prepostprocess_dropout_keep_prob": 0.9,
+            "preallocate_cache": False,  # write self-attention keys/values into maximum_labels_length slots when INFER
+            "beam_shared_memory": False  # share encoder-side tensors by the beams of a sentence when INFER
         }
 
     @property
@@ -202,9 +206,15 @@ class TransformerDecoder(Decoder):
 
         Returns: A dict containing decoder RNN states, pre-projected attention
           keys, attention values and attention length, and will be passed
-          to `step()` function.
+          to `step()` function. If "beam_shared_memory" is set and mode=INFER,
+          the attention values, bias and pre-projected keys/values are put
+          under "beam_shared" and are not stacked by beam size. If
+          "preallocate_cache" is set and mode=INFER, the self-attention
+          keys/values of each layer have maximum_labels_length slots, which
+          are written in place at the timestep kept under "preallocated".
         """
         _ = bridge
+        beam_shared = self.mode == ModeKeys.INFER and self.params["beam_shared_memory"]
         attention_values = encoder_output.attention_values
         attention_length = encoder_output.attention_length
         if hasattr(encoder_output, "attention_bias"):
@@ -214,36 +224,65 @@ class TransformerDecoder(Decoder):
                 tf.shape(attention_values)[1], attention_length)
 
         # initialize cache
+        preallocated = None
         if self.mode == ModeKeys.INFER:
             decoding_states = {}
+            shared_encdec_states = {}
             batch_size = tf.shape(attention_values)[0]
             depth = self._self_attention_layers[0].attention_value_depth
             if depth < 0:
                 # TODO please check when code goes into this condition
                 depth = tf.shape(attention_values)[2]
-            # initialize decoder self attention keys/values
+            if self.params["preallocate_cache"]:
+                # the timestep is shared by all rows, so it is neither stacked nor gathered
+                preallocated = {"time": tf.constant(0, dtype=tf.int32)}
             for l in range(self.params["num_layers"]):
-                keys = tf.zeros([batch_size, 0, depth])
-                values = tf.zeros([batch_size, 0, depth])
-                # Ensure shape invariance for tf.while_loop.
-                keys.set_shape([None, None, depth])
-                values.set_shape([None, None, depth])
+                decoding_states["layer_{}".format(l)] = {}
+                if preallocated is not None:
+                    # initialize decoder self attention keys/values with fixed capacity.
+                    #   They are updated in place, so use the stateful `empty` that
+                    #   is never folded into a constant or shared by both
+                    shape = [batch_size, helper.maximum_labels_length, depth]
+                    decoding_states["layer_{}".format(l)]["self_attention"] = {
+                        "keys": inplace_ops.empty(shape, tf.float32, init=True),
+                        "values": inplace_ops.empty(shape, tf.float32, init=True)}
+                else:
+                    # initialize decoder self attention keys/values, growing from length 0.
+                    # Ensure shape invariance for tf.while_loop: the length is
+                    #   unknown even if the cache is not stacked by beam size
+                    keys = tf.placeholder_with_default(
+                        tf.zeros([batch_size, 0, depth]), shape=[None, None, depth])
+                    values = tf.placeholder_with_default(
+                        tf.zeros([batch_size, 0, depth]), shape=[None, None, depth])
+                    decoding_states["layer_{}".format(l)]["self_attention"] = {
+                        "keys": keys, "values": values}
                 with tf.variable_scope("layer_%d" % l):
                     with tf.variable_scope("encdec_attention"):
                         with tf.variable_scope(self._encdec_attention_layers[l].name):
                             preproj_keys, preproj_values = self._encdec_attention_layers[l] \
                                 .compute_kv(attention_values)
-                decoding_states["layer_{}".format(l)] = {
-                    "self_attention": {"keys": keys, "values": values},
-                    "encdec_attention": {"attention_keys": preproj_keys,
-                                         "attention_values": preproj_values}}
+                encdec_states = {"attention_keys": preproj_keys,
+                                 "attention_values": preproj_values}
+                if beam_shared:
+                    shared_encdec_states["layer_{}".format(l)] = encdec_states
+                else:
+                    decoding_states["layer_{}".format(l)]["encdec_attention"] = encdec_states
         else:
             decoding_states = None
 
-        init_cache = initialize_cache(
-            decoding_states=decoding_states,
-            memory=attention_values,
-            memory_bias=attention_bias)
+        if beam_shared:
+            init_cache = initialize_cache(decoding_states=decoding_states)
+            init_cache["beam_shared"] = {
+                "memory": attention_values,
+                "memory_bias": attention_bias,
+                "encdec_attention": shared_encdec_states}
+        else:
+            init_cache = initialize_cache(
+                decoding_states=decoding_states,
+                memory=attention_values,
+                memory_bias=attention_bias)
+        if preallocated is not None:
+            init_cache["preallocated"] = preallocated
         return init_cache
 
     def step(self, decoder_input, cache):
@@ -287,10 +326,13 @@ class TransformerDecoder(Decoder):
 
         Returns: A transformed Tensor.
         """
+        # the encoder-side tensors shared by the beams of each sentence
+        beam_shared = cache.get("beam_shared", None)
+        encdec_cache = cache if beam_shared is None else beam_shared
         # [batch_size, max_len_src, dim]
-        encdec_attention_values = cache["memory"]
+        encdec_attention_values = encdec_cache["memory"]
         # [batch_size, 1, 1, max_len_src]
-        encdec_attention_bias = cache["memory_bias"]
+        encdec_attention_bias = encdec_cache["memory_bias"]
 
         decoder_self_attention_scores = []
         encdec_attention_scores = []
@@ -298,6 +340,13 @@ class TransformerDecoder(Decoder):
         # decoder_self_attention_bias: [1, 1, max_len_trg, max_len_trg]
         decoder_self_attention_bias = attention_bias_lower_triangle(
             tf.shape(decoder_inputs)[1])
+        preallocated = cache.get("preallocated", None)
+        if preallocated is not None:
+            time = preallocated["time"]
+            # decoder_self_attention_bias: [1, 1, 1, maximum_labels_length]
+            decoder_self_attention_bias = attention_bias_unwritten_slots(
+                time, tf.shape(cache["decoding_states"]["layer_0"]["self_attention"]["keys"])[1])
+            preallocated["time"] = time + 1
         x = dropout_wrapper(decoder_inputs, self.params["layer_prepostprocess_dropout_keep_prob"])
         for layer in range(self.params["num_layers"]):
             layer_name = "layer_{}".format(layer)
@@ -305,8 +354,15 @@ class TransformerDecoder(Decoder):
                 else cache["decoding_states"][layer_name]
             selfatt_cache = None if layer_cache is None \
                 else layer_cache["self_attention"]
-            encdecatt_cache = None if layer_cache is None \
-                else layer_cache["encdec_attention"]
+            if preallocated is not None:
+                selfatt_cache = {"keys": selfatt_cache["keys"],
+                                 "values": selfatt_cache["values"],
+                                 "time": time}
+            if beam_shared is not None:
+                encdecatt_cache = beam_shared["encdec_attention"][layer_name]
+            else:
+                encdecatt_cache = None if layer_cache is None \
+                    else layer_cache["encdec_attention"]
             with tf.variable_scope("layer_%d" % layer):
                 with tf.variable_scope("self_attention"):
                     # self attention layer
@@ -317,6 +373,9 @@ class TransformerDecoder(Decoder):
                             dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"]),
                         memory_bias=decoder_self_attention_bias,
                         cache=selfatt_cache)
+                    if preallocated is not None:
+                        layer_cache["self_attention"]["keys"] = selfatt_cache["keys"]
+                        layer_cache["self_attention"]["values"] = selfatt_cache["values"]
                     # [batch_size, num_heads, length_q, length_k]
                     decoder_self_attention_scores.append(w_y)
                     # apply dropout, layer norm, residual
@@ -332,7 +391,8 @@ class TransformerDecoder(Decoder):
                             dropout_keep_prob=self.params["layer_prepostprocess_dropout_keep_prob"]),
                         memory=encdec_attention_values,
                         memory_bias=encdec_attention_bias,
-                        cache=encdecatt_cache)
+                        cache=encdecatt_cache,
+                        beam_shared_memory=beam_shared is not None)
                     # [batch_size, num_heads, length_q, length_k]
                     encdec_attention_scores.append(w_y)
                     # apply dropout, layer norm, residual
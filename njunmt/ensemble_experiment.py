@@ -42,6 +42,10 @@ class EnsembleExperiment(Experiment):
             model_dirs: A list of model directories (checkpoints).
             weight_scheme: A string, the ensemble weights. See
               `EnsembleModel.get_ensemble_weights()` for more details.
+
+        Raises:
+            ValueError: if the inference options are invalid, see
+              `InferExperiment.check_inference_options()`.
         """
         super(EnsembleExperiment, self).__init__()
         self._model_dirs = model_dirs
@@ -49,6 +53,7 @@ class EnsembleExperiment(Experiment):
         infer_options = parse_params(
             params=model_configs["infer"],
             default_params=self.default_inference_options())
+        InferExperiment.check_inference_options(infer_options)
         infer_data = []
         for item in model_configs["infer_data"]:
             infer_data.append(parse_params(
@@ -95,7 +100,11 @@ class EnsembleExperiment(Experiment):
         text_inputter = TextLineInputter(
             dataset=dataset,
             data_field_name="eval_features_file",
-            batch_size=self._model_configs["infer"]["batch_size"])
+            batch_size=self._model_configs["infer"]["batch_size"],
+            num_processes=self._model_configs["infer"]["num_encoding_processes"],
+            batch_tokens_size=self._model_configs["infer"]["batch_tokens_size"],
+            sort_by_length=self._model_configs["infer"]["sort_by_length"],
+            sort_window_size=self._model_configs["infer"]["sort_window_size"])
         sess.run(tf.global_variables_initializer())
         tf.logging.info("Start inference.")
         overall_start_time = time.time()
@@ -113,7 +122,12 @@ class EnsembleExperiment(Experiment):
                   delimiter=self._model_configs["infer"]["delimiter"],
                   output_attention=False,
                   tokenize_output=self._model_configs["infer"]["char_level"],
-                  verbose=True)
+                  verbose=True,
+                  n_best=self._model_configs["infer"]["n_best"],
+                  return_results=False,
+                  resume=self._model_configs["infer"]["resume"],
+                  flush_every=self._model_configs["infer"]["flush_every"],
+                  pipelined=self._model_configs["infer"]["pipelined"])
             tf.logging.info("FINISHED {}. Elapsed Time: {}."
                             .format(param["features_file"], str(time.time() - start_time)))
             if param["labels_file"] is not None:
@@ -112,73 +112,227 @@ def select_attention_sample_by_sample(attention_dict):
     return all_attentions
 
 
-def pack_batch_attention_dict(
-        base_index,
-        source_tokens,
-        candidate_tokens,
-        attentions):
-    """ Packs the attention information into a dictionary for visualization.
+def _crop_attentions(source_tokens, candidate_tokens, attention):
+    """ Crops the attention matrices of one sample to the lengths of
+    source and candidate (with EOS) for visualization.
 
     Args:
-        base_index: An integer.
-        source_tokens: A list of samples. Each sample is a list of string tokens.
-        candidate_tokens: A list of sample candidate. Each sample candidate is a list of string tokens.
-        attentions: A list of attentions.
+        source_tokens: A list of string tokens.
+        candidate_tokens: A list of string tokens.
+        attention: A dict of attention arrays of the sample, see
+          `select_attention_sample_by_sample()`.
 
-    Returns: A packed dictionary of attention information for visualization.
+    Returns: A list of dicts with keys "name", "type" and "value".
     """
-    ret_attentions = dict()
-    for idx, (src, hypo, attention) in enumerate(
-            zip(source_tokens, candidate_tokens, attentions)):
-        att = {"source": " ".join(src),
-               "translation": " ".join(hypo),
-               "attentions": []}
-        for key, val in attention.items():
-            if "encoder_self_attention" in key:
-                len_src = len(src) + 1
-                len_trg = len(src) + 1
-            elif "encoder_decoder_attention" in key:
-                len_src = len(src) + 1
-                len_trg = len(hypo) + 1
-            elif "decoder_self_attention" in key:
-                len_src = len(hypo) + 1
-                len_trg = len(hypo) + 1
-            else:
-                raise NotImplementedError
-            num_shapes = len(val.shape)
-            if num_shapes == 2:
-                # [n_timesteps_trg, n_timesteps_src]
-                att["attentions"].append({
+    attentions = []
+    for key, val in attention.items():
+        if "encoder_self_attention" in key:
+            len_src = len(source_tokens) + 1
+            len_trg = len(source_tokens) + 1
+        elif "encoder_decoder_attention" in key:
+            len_src = len(source_tokens) + 1
+            len_trg = len(candidate_tokens) + 1
+        elif "decoder_self_attention" in key:
+            len_src = len(candidate_tokens) + 1
+            len_trg = len(candidate_tokens) + 1
+        else:
+            raise NotImplementedError
+        num_shapes = len(val.shape)
+        if num_shapes == 2:
+            # [n_timesteps_trg, n_timesteps_src]
+            attentions.append({
+                "name": key,
+                "value": val[:len_trg, :len_src],
+                "type": "simple"})
+        elif num_shapes == 3:
+            if "decoder" in key:
+                # with shape [n_timesteps_trg, num_heads, n_timesteps_src]
+                #    transpose to [num_heads, n_timesteps_trg, n_timesteps_src]
+                attentions.append({
                     "name": key,
-                    "value": val[:len_trg, :len_src].tolist(),
-                    "type": "simple"})
-            elif num_shapes == 3:
-                if "decoder" in key:
-                    # with shape [n_timesteps_trg, num_heads, n_timesteps_src]
-                    #    transpose to [num_heads, n_timesteps_trg, n_timesteps_src]
-                    att["attentions"].append({
-                        "name": key,
-                        "value": (val[:len_trg, :, :len_src]).transpose([1, 0, 2]).tolist(),
-                        "type": "multihead"})
-                else:
-                    # with shape [num_heads, n_timesteps_trg, n_timesteps_src]
-                    att["attentions"].append({
-                        "name": key,
-                        "value": val[:, :len_trg, :len_src].tolist(),
-                        "type": "multihead"})
+                    "value": (val[:len_trg, :, :len_src]).transpose([1, 0, 2]),
+                    "type": "multihead"})
             else:
-                raise NotImplementedError
-        ret_attentions[base_index + idx] = att
-    return ret_attentions
+                # with shape [num_heads, n_timesteps_trg, n_timesteps_src]
+                attentions.append({
+                    "name": key,
+                    "value": val[:, :len_trg, :len_src],
+                    "type": "multihead"})
+        else:
+            raise NotImplementedError
+    return attentions
+
+
+class AttentionWriter(object):
+    """ Writes attention of each sample incrementally for visualization.
+
+    The attention matrices are saved as float16 arrays into `prefix`.attention
+    one after another, and `prefix`.attention.index has one json line for each
+    sample, recording the source, the translation and the shape and the byte
+    offset of each matrix, so that one sample can be read without loading the
+    whole file (see `AttentionReader`).
+    """
+
+    def __init__(self, output_filename_prefix, append=False):
+        """ Opens the attention files.
+
+        Args:
+            output_filename_prefix: A string.
+            append: Whether to append to the existing files, which
+              should be truncated by `truncate_attention()` first.
+        """
+        data_filename = output_filename_prefix + ".attention"
+        append = append and gfile.Exists(data_filename)
+        tf.logging.info("Saving attention information into {}.".format(data_filename))
+        self._offset = gfile.Stat(data_filename).length if append else 0
+        self._data_fw = gfile.GFile(data_filename, "ab" if append else "wb")
+        self._index_fw = gfile.GFile(data_filename + ".index", "a" if append else "w")
+
+    def write(self, sample_idx, source_tokens, candidate_tokens, attention):
+        """ Writes the attention of one sample.
+
+        Args:
+            sample_idx: An integer, the index of the sample.
+            source_tokens: A list of string tokens.
+            candidate_tokens: A list of string tokens.
+            attention: A dict of attention arrays of the sample, see
+              `select_attention_sample_by_sample()`.
+        """
+        self.write_packed(sample_idx, " ".join(source_tokens), " ".join(candidate_tokens),
+                          _crop_attentions(source_tokens, candidate_tokens, attention))
+
+    def write_packed(self, sample_idx, source, translation, attentions):
+        """ Writes the attention of one sample returned by `AttentionReader.read()`.
+
+        Args:
+            sample_idx: An integer, the index of the sample.
+            source: The source string.
+            translation: The translation string.
+            attentions: A list of dicts with keys "name", "type" and "value".
+        """
+        index = {"id": int(sample_idx), "source": source,
+                 "translation": translation, "attentions": []}
+        for att in attentions:
+            value = numpy.ascontiguousarray(att["value"], dtype=numpy.float16)
+            self._data_fw.write(value.tobytes())
+            index["attentions"].append({"name": att["name"], "type": att["type"],
+                                        "shape": list(value.shape), "offset": self._offset})
+            self._offset += value.nbytes
+        self._index_fw.write(json.dumps(index) + "\n")
 
+    def flush(self):
+        """ Flushes the files. """
+        self._data_fw.flush()
+        self._index_fw.flush()
 
-def dump_attentions(output_filename_prefix, attentions):
-    """ Dumps attention as json format.
+    def close(self):
+        """ Closes the files. """
+        self._data_fw.close()
+        self._index_fw.close()
+
+
+def truncate_attention(output_filename_prefix, num_samples):
+    """ Removes the incomplete samples (e.g. the process is killed while
+    writing) and the samples with indexes not less than `num_samples` from
+    the files saved by `AttentionWriter`, so that they can be appended.
+
+    The samples are expected to be written in ascending order of indexes.
+    The leading complete index lines with indexes less than `num_samples`
+    whose attention arrays are complete are kept, and `prefix`.attention is
+    truncated to the end of their arrays.
 
     Args:
         output_filename_prefix: A string.
-        attentions: A dict of attention arrays.
+        num_samples: An integer, the number of samples to keep at most.
+
+    Returns: The number of kept samples.
     """
-    tf.logging.info("Saving attention information into {}.attention.".format(output_filename_prefix))
-    with gfile.GFile(output_filename_prefix + ".attention", "wb") as f:
-        f.write(json.dumps(attentions).encode("utf-8"))
+    data_filename = output_filename_prefix + ".attention"
+    index_filename = data_filename + ".index"
+    if not (gfile.Exists(data_filename) and gfile.Exists(index_filename)):
+        return 0
+    data_length = gfile.Stat(data_filename).length
+    itemsize = numpy.dtype(numpy.float16).itemsize
+    num_kept = 0
+    end_offset = 0
+    with gfile.GFile(index_filename, "r") as fp, \
+            gfile.GFile(index_filename + ".tmp", "w") as fw:
+        for line in fp:
+            if not line.endswith("\n"):
+                break
+            index = json.loads(line)
+            if index["id"] >= num_samples:
+                break
+            sample_end_offset = max([end_offset] + [
+                att["offset"] + int(numpy.prod(att["shape"])) * itemsize
+                for att in index["attentions"]])
+            if sample_end_offset > data_length:
+                break
+            fw.write(line)
+            num_kept += 1
+            end_offset = sample_end_offset
+    gfile.Rename(index_filename + ".tmp", index_filename, overwrite=True)
+    with gfile.GFile(data_filename, "rb") as fp, \
+            gfile.GFile(data_filename + ".tmp", "wb") as fw:
+        num_bytes = end_offset
+        while num_bytes > 0:
+            chunk = fp.read(min(num_bytes, 1 << 26))
+            fw.write(chunk)
+            num_bytes -= len(chunk)
+    gfile.Rename(data_filename + ".tmp", data_filename, overwrite=True)
+    return num_kept
+
+
+class AttentionReader(object):
+    """ Reads the attention saved by `AttentionWriter`, one sample at a time. """
+
+    def __init__(self, output_filename_prefix):
+        """ Loads the index.
+
+        Args:
+            output_filename_prefix: A string.
+        """
+        data_filename = output_filename_prefix + ".attention"
+        self._index = dict()
+        with gfile.GFile(data_filename + ".index", "r") as fp:
+            for line in fp:
+                # ignores the incomplete last line, and the later one wins
+                # if a sample is written twice (e.g. resumed)
+                if not line.endswith("\n"):
+                    break
+                index = json.loads(line)
+                self._index[index["id"]] = index
+        self._data_fp = gfile.GFile(data_filename, "rb")
+
+    def __len__(self):
+        return len(self._index)
+
+    def sample_ids(self):
+        """ Returns the sorted indexes of samples. """
+        return sorted(self._index.keys())
+
+    def read(self, sample_idx):
+        """ Reads the attention of one sample.
+
+        Args:
+            sample_idx: An integer, the index of the sample.
+
+        Returns: A dict with keys "source", "translation" and "attentions",
+          where "attentions" is a list of dicts with keys "name", "type"
+          and "value" (a float16 numpy.ndarray).
+        """
+        index = self._index[sample_idx]
+        attentions = []
+        for att in index["attentions"]:
+            self._data_fp.seek(att["offset"])
+            num_bytes = int(numpy.prod(att["shape"])) * numpy.dtype(numpy.float16).itemsize
+            value = numpy.frombuffer(self._data_fp.read(num_bytes), dtype=numpy.float16)
+            attentions.append({"name": att["name"], "type": att["type"],
+                               "value": value.reshape(att["shape"])})
+        return {"source": index["source"],
+                "translation": index["translation"],
+                "attentions": attentions}
+
+    def close(self):
+        """ Closes the data file. """
+        self._data_fp.close()
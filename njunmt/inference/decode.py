@@ -16,15 +16,20 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import time
+from multiprocessing.pool import ThreadPool
+
 import numpy
 import tensorflow as tf
 from tensorflow import gfile
 
+from njunmt.data.text_inputter import pack_feed_dict
 from njunmt.inference.attention import postprocess_attention
 from njunmt.inference.attention import select_attention_sample_by_sample
-from njunmt.inference.attention import pack_batch_attention_dict
-from njunmt.inference.attention import dump_attentions
+from njunmt.inference.attention import AttentionWriter
+from njunmt.inference.attention import truncate_attention
 from njunmt.tools.tokenizeChinese import to_chinese_char
+from njunmt.utils.constants import Constants
 from njunmt.utils.expert_utils import repeat_n_times
 
 
@@ -94,7 +99,9 @@ def evaluate_with_attention(
     losses = 0.
     weights = 0.
     num_of_samples = 0
-    attentions = {}
+    attention_writer = None
+    if attention_op is not None:
+        attention_writer = AttentionWriter(output_filename_prefix)
     for data in eval_data:
         _n_samples = len(data["feature_ids"])
         parallels = data["feed_dict"].pop("parallels")
@@ -111,45 +118,40 @@ def evaluate_with_attention(
                        for tt in data["label_ids"]]
             _attentions = sum(repeat_n_times(avail, select_attention_sample_by_sample,
                                              atts), [])
-            attentions.update(pack_batch_attention_dict(
-                num_of_samples, ss_strs, tt_strs, _attentions))
+            for idx, (ss, tt, att) in enumerate(zip(ss_strs, tt_strs, _attentions)):
+                attention_writer.write(num_of_samples + idx, ss, tt, att)
         data["feed_dict"]["parallels"] = parallels
         losses += sum([_l[0] for _l in loss])
         weights += sum([_l[1] for _l in loss])
         num_of_samples += _n_samples
     loss = losses / weights
-    if attention_op is not None:
-        dump_attentions(output_filename_prefix, attentions)
+    if attention_writer is not None:
+        attention_writer.close()
     return loss
 
 
-def _infer(
+def _run_infer(
         sess,
         feed_dict,
         prediction_op,
-        batch_size,
         top_k=1,
         output_attention=False):
-    """ Infers a batch of samples with beam search.
+    """ Runs `prediction_op` on a batch of samples with beam search.
 
     Args:
         sess: `tf.Session`
         feed_dict: A dictionary of feeding data.
         prediction_op: Tensorflow operation for inference.
-        batch_size: The batch size.
         top_k: An integer, number of predicted sequences will be
           returned.
         output_attention: Whether to output attention.
 
-    Returns: A tuple `(predicted_sequences, attention_scores)`.
-      The `predicted_sequences` is a list of hypothesis with
-      approx [`top_k` * `batch_sze`, sequence_length].
-      The `attention_scores` is None if there is no attention
-      related information in `prediction_op`.
+    Returns: A tuple `(predict_out, avail)`, the results of `sess.run` and
+      the number of available parallels, which are passed to `_post_process_infer()`.
     """
     parallels = feed_dict.pop("parallels")
     avail = sum(numpy.array(parallels) > 0)
-    extract_keys = ["sorted_hypothesis"]
+    extract_keys = ["sorted_hypothesis", "sorted_scores"]
     if output_attention:
         assert top_k == 1
         extract_keys.extend(["sorted_argidx", "attentions", "beam_ids"])
@@ -161,11 +163,45 @@ def _infer(
             prediction_op[:avail])))
     predict_out = sess.run(brief_pred_op, feed_dict=feed_dict)
     feed_dict["parallels"] = parallels
+    return predict_out, avail
+
+
+def _post_process_infer(
+        predict_out,
+        avail,
+        batch_size,
+        top_k=1,
+        output_attention=False):
+    """ Selects the `top_k` hypothesis of each sample from the
+    results of `_run_infer()`.
+
+    Args:
+        predict_out: The results of `sess.run`.
+        avail: The number of available parallels.
+        batch_size: The batch size.
+        top_k: An integer, number of predicted sequences will be
+          returned.
+        output_attention: Whether to output attention.
+
+    Returns: A tuple `(predicted_sequences, attention_scores, scores)`.
+      The `predicted_sequences` is a list of hypothesis with
+      approx [`top_k` * `batch_sze`, sequence_length].
+      The `attention_scores` is None if there is no attention
+      related information in `prediction_op`.
+      The `scores` is a list of the (length normalized) scores
+      of `predicted_sequences`.
+
+    Raises:
+        ValueError: if `top_k` is larger than the beam size.
+    """
     total_samples = sum(
         repeat_n_times(avail,
                        lambda p: p.shape[0],
                        predict_out["sorted_hypothesis"]))
     beam_size = total_samples // batch_size
+    if top_k > beam_size:
+        raise ValueError("top_k ({}) should not be larger than beam_size ({})."
+                         .format(top_k, beam_size))
 
     def _post_process_hypo(pred, **kwargs):
         _num_samples = pred.shape[0]
@@ -179,19 +215,220 @@ def _infer(
                 beam_ids=kwargs["beam_ids"],
                 attention_dict=kwargs["attentions"],
                 gather_idx=kwargs["sorted_argidx"][batch_beam_pos])
-            return pred[batch_beam_pos, :].tolist(), atts
-        return pred[batch_beam_pos, :].tolist(), []
+            return pred[batch_beam_pos, :].tolist(), atts, \
+                   kwargs["sorted_scores"][batch_beam_pos].tolist()
+        return pred[batch_beam_pos, :].tolist(), [], \
+               kwargs["sorted_scores"][batch_beam_pos].tolist()
 
-    hypothesises, attentions = repeat_n_times(
+    hypothesises, attentions, scores = repeat_n_times(
         avail,
         _post_process_hypo,
         predict_out["sorted_hypothesis"],
+        sorted_scores=predict_out["sorted_scores"],
         beam_ids=predict_out.get("beam_ids", None),
         attentions=predict_out.get("attentions", None),
         sorted_argidx=predict_out.get("sorted_argidx", None))
     hypothesis = sum(hypothesises, [])
     attention = sum(attentions, [])
-    return hypothesis, attention
+    scores = sum(scores, [])
+    return hypothesis, attention, scores
+
+
+def _infer(
+        sess,
+        feed_dict,
+        prediction_op,
+        batch_size,
+        top_k=1,
+        output_attention=False):
+    """ Infers a batch of samples with beam search.
+
+    Args:
+        sess: `tf.Session`
+        feed_dict: A dictionary of feeding data.
+        prediction_op: Tensorflow operation for inference.
+        batch_size: The batch size.
+        top_k: An integer, number of predicted sequences will be
+          returned.
+        output_attention: Whether to output attention.
+
+    Returns: A tuple `(predicted_sequences, attention_scores, scores)`,
+      see `_post_process_infer()`.
+    """
+    predict_out, avail = _run_infer(sess, feed_dict, prediction_op,
+                                    top_k=top_k, output_attention=output_attention)
+    return _post_process_infer(predict_out, avail, batch_size,
+                               top_k=top_k, output_attention=output_attention)
+
+
+def _infer_with_cache(
+        sess,
+        feature_ids,
+        prediction_op,
+        input_fields,
+        padding,
+        translation_cache):
+    """ Infers a batch of samples, only running the samples that are
+    not in `translation_cache`.
+
+    Args:
+        sess: `tf.Session`
+        feature_ids: A list of source token id lists.
+        prediction_op: Tensorflow operation for inference.
+        input_fields: A list of dicts of placeholders.
+        padding: The padding id of source tokens.
+        translation_cache: A `TranslationCache` object.
+
+    Returns: A list of predicted sequences.
+    """
+    prediction = [translation_cache.get(ids) for ids in feature_ids]
+    # the first index of each missed source
+    missed_idx = dict()
+    for idx, ids in enumerate(feature_ids):
+        if prediction[idx] is None:
+            missed_idx.setdefault(tuple(ids), idx)
+    if len(missed_idx) > 0:
+        missed_idx = sorted(missed_idx.values())
+        data = pack_feed_dict(
+            name_prefixs=Constants.FEATURE_NAME_PREFIX,
+            origin_datas=[feature_ids[idx] for idx in missed_idx],
+            paddings=padding,
+            input_fields=input_fields)
+        missed_prediction, _, _ = _infer(sess, data["feed_dict"], prediction_op,
+                                         len(missed_idx), top_k=1)
+        missed_prediction = dict(zip([tuple(feature_ids[idx]) for idx in missed_idx],
+                                     missed_prediction))
+        for ids, pred in missed_prediction.items():
+            translation_cache.put(ids, pred)
+        prediction = [missed_prediction[tuple(ids)] if pred is None else pred
+                      for ids, pred in zip(feature_ids, prediction)]
+    return prediction
+
+
+class _DoneResult(object):
+    """ Holds the result of a function called synchronously, with the
+    same `get()` interface as `multiprocessing.pool.AsyncResult`. """
+
+    def __init__(self, value):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+
+def _submit(pool, fn, *args):
+    """ Calls `fn` with `args` in `pool`, or synchronously if `pool` is None.
+
+    Returns: An object whose `get()` method returns the result of `fn`.
+    """
+    if pool is None:
+        return _DoneResult(fn(*args))
+    return pool.apply_async(fn, args)
+
+
+def _format_nbest(line_ids, prediction, scores, top_k,
+                  vocab_target, delimiter, tokenize_output):
+    """ Formats the n-best hypotheses of a batch in the Moses format.
+
+    Args:
+        line_ids: The line ids of the batch.
+        prediction: A list of predicted sequences, `top_k` for each line.
+        scores: A list of scores of `prediction`.
+        top_k: The number of hypotheses of each line.
+        vocab_target: A `Vocab` instance for target side feature map.
+        delimiter: The delimiter of output token sequence.
+        tokenize_output: Whether to split words into characters
+          (only for Chinese).
+
+    Returns: A list of strings, the n-best lines of each line id.
+    """
+    hypothesis = [delimiter.join(vocab_target.convert_to_wordlist(pred))
+                  for pred in prediction]
+    if tokenize_output:
+        hypothesis = to_chinese_char(hypothesis)
+    nbest = ["" for _ in line_ids]
+    for idx, (hypo, score) in enumerate(zip(hypothesis, scores)):
+        nbest[idx // top_k] += "{} ||| {} ||| {:.6f}\n".format(line_ids[idx // top_k], hypo, score)
+    return nbest
+
+
+def _truncate_incomplete_lines(filename, max_line_id=None, max_num_lines=None):
+    """ Removes the incomplete last line of an output file (e.g. the
+    process is killed while writing), so that it can be resumed.
+
+    Args:
+        filename: The output file name.
+        max_line_id: If provided, `filename` is an n-best list and the
+          lines whose line ids are not less than it are removed.
+        max_num_lines: If provided, at most this many lines are kept.
+
+    Returns: The number of kept lines.
+    """
+    tmp_filename = filename + ".tmp"
+    num_lines = 0
+    with gfile.GFile(filename, "r") as fp, gfile.GFile(tmp_filename, "w") as fw:
+        for line in fp:
+            if not line.endswith("\n"):
+                break
+            if max_line_id is not None and int(line.split(" ||| ", 1)[0]) >= max_line_id:
+                break
+            if max_num_lines is not None and num_lines >= max_num_lines:
+                break
+            fw.write(line)
+            num_lines += 1
+    gfile.Rename(tmp_filename, filename, overwrite=True)
+    return num_lines
+
+
+class _OrderedWriter(object):
+    """ Writes the texts (and attention) of each line id to files in ascending
+    order of line ids, buffering the ones that come early (at most the lines
+    of one sort window of `TextLineInputter`). """
+
+    def __init__(self, fws, next_line_id=0, flush_every=1000, attention_writer=None):
+        """ Initializes the writer.
+
+        Args:
+            fws: A list of file objects (or None to skip).
+            next_line_id: The first line id to write, the texts of
+              smaller line ids are ignored.
+            flush_every: Flush the files every this many lines.
+            attention_writer: An `AttentionWriter` object, if provided.
+        """
+        self._fws = fws
+        self._attention_writer = attention_writer
+        self._next_line_id = next_line_id
+        self._flush_every = flush_every
+        self._pending = dict()
+        self._num_unflushed = 0
+
+    def write(self, line_id, texts, attention=None):
+        """ Writes `texts` (one for each file) and `attention`, a tuple of
+        the arguments of `AttentionWriter.write()` after the line id, once
+        all the smaller line ids are written. """
+        if line_id < self._next_line_id:
+            return
+        self._pending[line_id] = (texts, attention)
+        while self._next_line_id in self._pending:
+            texts, attention = self._pending.pop(self._next_line_id)
+            for fw, text in zip(self._fws, texts):
+                if fw is not None and text:
+                    fw.write(text)
+            if self._attention_writer is not None and attention is not None:
+                self._attention_writer.write(self._next_line_id, *attention)
+            self._next_line_id += 1
+            self._num_unflushed += 1
+        if self._num_unflushed >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        """ Flushes the files. """
+        for fw in self._fws:
+            if fw is not None:
+                fw.flush()
+        if self._attention_writer is not None:
+            self._attention_writer.flush()
+        self._num_unflushed = 0
 
 
 def infer(
@@ -204,58 +441,209 @@ def infer(
         delimiter=" ",
         output_attention=False,
         tokenize_output=False,
-        verbose=True):
-    """ Infers data and save the prediction results.
+        verbose=True,
+        translation_cache=None,
+        input_fields=None,
+        n_best=0,
+        return_results=True,
+        resume=False,
+        flush_every=1000,
+        pipelined=False):
+    """ Infers data and save the prediction results. The hypothesis
+    (and n-best lists and attention) are written to `output` batch by
+    batch in the order of line ids.
 
     Args:
         sess: `tf.Session`.
         prediction_op: Tensorflow operation for inference.
         infer_data: An iterable instance that each element
-          is a packed feeding dictionary for `sess`.
+          is a packed feeding dictionary for `sess`. If the element
+          has "line_ids", the hypothesis are restored to the order
+          of the line ids.
         output: Output file name, `str`.
         vocab_source: A `Vocab` instance for source side feature map.
         vocab_target: A `Vocab` instance for target side feature map.
-        alpha: A scalar number, length penalty rate. If not provided
-          or < 0, simply average each beam by length of predicted
-          sequence.
         delimiter: The delimiter of output token sequence.
         output_attention: Whether to output attention information.
         tokenize_output: Whether to split words into characters
           (only for Chinese).
         verbose: Print inference information if set True.
+        translation_cache: A `TranslationCache` object. If provided,
+          only the sentences not in the cache are decoded by `sess`
+          (not used if `output_attention`).
+        input_fields: A list of dicts of placeholders, must be provided
+          with `translation_cache` to pack the missed sentences.
+        n_best: If > 0, the best `n_best` hypotheses of each sentence
+          and their scores are also written to `output`.nbest in the
+          Moses format "line_id ||| hypothesis ||| score", where
+          `line_id` starts from 0 (not used with `translation_cache`).
+        return_results: Whether to keep all the sources and hypothesis
+          in memory and return them.
+        resume: If True and `output` exists, the lines already in
+          `output` are kept and only the batches with the following
+          lines are decoded.
+        flush_every: Flush the output files every this many lines.
+        pipelined: Whether to prepare the next batch and post-process the
+          previous batch in background threads while running the current one.
+          Otherwise, the stages run one after another. The seconds spent in
+          each stage are logged if `verbose`.
 
     Returns: A tuple `(sources, hypothesis)`, two lists of
-      strings.
+      strings, or `(None, None)` if not `return_results`.
+
+    Raises:
+        ValueError: if `translation_cache` is provided without `input_fields`,
+          or `n_best` > 0 without `output`, or `n_best` > 1 with
+          `output_attention`.
     """
-    attentions = dict()
-    hypothesis = []
-    sources = []
-    cnt = 0
-    for data in infer_data:
-        source_tokens = [vocab_source.convert_to_wordlist(x, bpe_decoding=False)
-                         for x in data["feature_ids"]]
-        x_str = [delimiter.join(x) for x in source_tokens]
-        prediction, att = _infer(sess, data["feed_dict"], prediction_op,
-                                 len(x_str), top_k=1, output_attention=output_attention)
-
-        sources.extend(x_str)
-        hypothesis.extend([delimiter.join(vocab_target.convert_to_wordlist(prediction[sample_idx]))
-                           for sample_idx in range(len(prediction))])
-        if output_attention and att is not None:
-            candidate_tokens = [vocab_target.convert_to_wordlist(
-                prediction[idx], bpe_decoding=False, reverse_seq=False)
-                                for idx in range(len(x_str))]
-
-            attentions.update(pack_batch_attention_dict(
-                cnt, source_tokens, candidate_tokens, att))
-        cnt += len(x_str)
+    if output_attention or n_best > 0:
+        translation_cache = None
+    if translation_cache is not None and input_fields is None:
+        raise ValueError("input_fields should be provided with translation_cache.")
+    if n_best > 0 and not output:
+        raise ValueError("output should be provided with n_best.")
+    if n_best > 1 and output_attention:
+        raise ValueError("n_best > 1 is not supported with output_attention.")
+    top_k = max(n_best, 1)
+    num_done = 0
+    if resume and output and gfile.Exists(output):
+        num_done = _truncate_incomplete_lines(output)
+        if output_attention:
+            # the attention may be behind the output (or vice versa)
+            num_attention_done = truncate_attention(output, num_done)
+            if num_attention_done < num_done:
+                num_done = _truncate_incomplete_lines(output, max_num_lines=num_attention_done)
+        if n_best > 0 and gfile.Exists(output + ".nbest"):
+            _truncate_incomplete_lines(output + ".nbest", max_line_id=num_done)
+        tf.logging.info("Resume from line {} of {}.".format(num_done, output))
+    mode = "a" if num_done > 0 else "w"
+    fws = [gfile.GFile(output, mode) if output else None,
+           gfile.GFile(output + ".nbest", mode) if n_best > 0 else None]
+    attention_writer = None
+    if output_attention and output:
+        attention_writer = AttentionWriter(output, append=num_done > 0)
+    writer = _OrderedWriter(fws, next_line_id=num_done, flush_every=flush_every,
+                            attention_writer=attention_writer)
+    hypothesis = dict()
+    sources = dict()
+    # the seconds spent in each stage
+    timings = {"prepare": 0., "run": 0., "post-process": 0.,
+               "wait for prepare": 0., "wait for post-process": 0.}
+    data_iter = iter(infer_data)
+    status = {"num_read": 0, "num_written": 0}
+
+    def _prepare():
+        """ Reads the next batch and converts the source ids to words.
+        Returns None at the end. """
+        start_time = time.time()
+        try:
+            data = next(data_iter)
+        except StopIteration:
+            return None
+        line_ids = [int(line_id) for line_id in data.get(
+            "line_ids", range(status["num_read"], status["num_read"] + len(data["feature_ids"])))]
+        status["num_read"] += len(line_ids)
+        batch = {"data": data, "line_ids": line_ids}
+        if all([line_id < num_done for line_id in line_ids]):
+            batch["data"] = None
+        else:
+            batch["source_tokens"] = [vocab_source.convert_to_wordlist(x, bpe_decoding=False)
+                                      for x in data["feature_ids"]]
+            batch["x_str"] = [delimiter.join(x) for x in batch["source_tokens"]]
+        timings["prepare"] += time.time() - start_time
+        return batch
+
+    def _post_process(batch, predict_out, prediction):
+        """ Converts the predictions of a batch to words and writes them. """
+        start_time = time.time()
+        line_ids, source_tokens, x_str = batch["line_ids"], batch["source_tokens"], batch["x_str"]
+        nbest = [None] * len(x_str)
+        att = None
+        if predict_out is not None:
+            prediction, att, scores = _post_process_infer(
+                predict_out[0], predict_out[1], len(x_str),
+                top_k=top_k, output_attention=output_attention)
+            if n_best > 0:
+                nbest = _format_nbest(line_ids, prediction, scores, top_k,
+                                      vocab_target, delimiter, tokenize_output)
+            prediction = prediction[::top_k]
+        batch_hypothesis = [delimiter.join(vocab_target.convert_to_wordlist(pred))
+                            for pred in prediction]
+        if tokenize_output:
+            batch_hypothesis = to_chinese_char(batch_hypothesis)
+        for sample_idx, line_id in enumerate(line_ids):
+            attention = None
+            if attention_writer is not None and att is not None and line_id >= num_done:
+                candidate_tokens = vocab_target.convert_to_wordlist(
+                    prediction[sample_idx], bpe_decoding=False, reverse_seq=False)
+                attention = (source_tokens[sample_idx], candidate_tokens, att[sample_idx])
+            writer.write(line_id, [batch_hypothesis[sample_idx] + "\n", nbest[sample_idx]],
+                         attention=attention)
+            if return_results:
+                sources[line_id] = x_str[sample_idx]
+                hypothesis[line_id] = batch_hypothesis[sample_idx]
+        status["num_written"] += len(line_ids)
+        timings["post-process"] += time.time() - start_time
         if verbose:
-            tf.logging.info(cnt)
-    if tokenize_output:
-        hypothesis = to_chinese_char(hypothesis)
-    if output:
-        with gfile.GFile(output, "w") as fw:
-            fw.write("\n".join(hypothesis) + "\n")
-    if output_attention:
-        dump_attentions(output, attentions)
+            tf.logging.info(status["num_written"])
+
+    # with `pipelined`, the next batch is prepared and the previous batch is
+    # post-processed by two threads while `sess.run` runs the current batch
+    prepare_pool = ThreadPool(1) if pipelined else None
+    post_process_pool = ThreadPool(1) if pipelined else None
+    overall_start_time = time.time()
+    next_batch = _submit(prepare_pool, _prepare)
+    last_post_process = None
+    try:
+        while True:
+            start_time = time.time()
+            batch = next_batch.get()
+            timings["wait for prepare"] += time.time() - start_time
+            if batch is None:
+                break
+            next_batch = _submit(prepare_pool, _prepare)
+            if batch["data"] is None:
+                continue
+            start_time = time.time()
+            predict_out, prediction = None, None
+            if translation_cache is None:
+                predict_out = _run_infer(sess, batch["data"]["feed_dict"], prediction_op,
+                                         top_k=top_k, output_attention=output_attention)
+            else:
+                prediction = _infer_with_cache(sess, batch["data"]["feature_ids"], prediction_op,
+                                               input_fields, vocab_source.pad_id, translation_cache)
+            timings["run"] += time.time() - start_time
+            start_time = time.time()
+            if last_post_process is not None:
+                # at most one batch is waiting for post-processing
+                last_post_process.get()
+            timings["wait for post-process"] += time.time() - start_time
+            last_post_process = _submit(post_process_pool, _post_process,
+                                        batch, predict_out, prediction)
+        start_time = time.time()
+        if last_post_process is not None:
+            last_post_process.get()
+        timings["wait for post-process"] += time.time() - start_time
+    finally:
+        for pool in [prepare_pool, post_process_pool]:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        # keeps the lines written so far for resuming
+        for fw in fws:
+            if fw is not None:
+                fw.close()
+        if attention_writer is not None:
+            attention_writer.close()
+    if verbose:
+        tf.logging.info("Inference time: total {:.2f}s, ".format(time.time() - overall_start_time)
+                        + ", ".join(["{} {:.2f}s".format(k, timings[k]) for k in
+                                     ["prepare", "run", "post-process",
+                                      "wait for prepare", "wait for post-process"]]))
+    if translation_cache is not None and verbose:
+        translation_cache.log_statistics()
+    if not return_results:
+        return None, None
+    sources = [sources[line_id] for line_id in sorted(sources.keys())]
+    hypothesis = [hypothesis[line_id] for line_id in sorted(hypothesis.keys())]
     return sources, hypothesis
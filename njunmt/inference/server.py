@@ -0,0 +1,299 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define a translation server that keeps a restored model in memory
+and decodes concurrent requests with dynamic batching. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+import numpy
+import six
+import tensorflow as tf
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from njunmt.data.text_inputter import make_inference_batches
+from njunmt.data.text_inputter import pack_feed_dict
+from njunmt.inference.decode import infer
+from njunmt.utils.constants import Constants
+
+
+class TranslationRequest(object):
+    """ Holds the source sentences of one request, its translations
+    and the timestamps for latency statistics. """
+
+    def __init__(self, feature_ids):
+        """ Initializes the request.
+
+        Args:
+            feature_ids: A list of token id lists.
+        """
+        self.feature_ids = feature_ids
+        self.hypothesis = [None] * len(feature_ids)
+        self.error = None
+        self.arrival_time = time.time()
+        self.start_decoding_time = None
+        self.finish_time = None
+        self._num_untranslated = len(feature_ids)
+        self._finished = threading.Event()
+        if self._num_untranslated == 0:
+            self.finish()
+
+    def fill(self, sample_idx, hypothesis):
+        """ Sets the translation of one sentence. """
+        self.hypothesis[sample_idx] = hypothesis
+        self._num_untranslated -= 1
+        if self._num_untranslated == 0:
+            self.finish()
+
+    def finish(self, error=None):
+        """ Marks the request as finished. """
+        self.error = error
+        self.finish_time = time.time()
+        if self.start_decoding_time is None:
+            self.start_decoding_time = self.finish_time
+        self._finished.set()
+
+    def wait(self):
+        """ Blocks until the request is finished. """
+        self._finished.wait()
+
+    @property
+    def queueing_time(self):
+        """ The seconds from arrival to the start of decoding. """
+        return self.start_decoding_time - self.arrival_time
+
+    @property
+    def decoding_time(self):
+        """ The seconds from the start of decoding to the end. """
+        return self.finish_time - self.start_decoding_time
+
+
+class TranslationServer(object):
+    """ Translates sentences with a warm `tf.Session`. Sentences of
+    concurrent requests are coalesced into length-sorted batches that
+    are decoded by a single background thread. """
+
+    def __init__(self,
+                 sess,
+                 prediction_op,
+                 input_fields,
+                 vocab_source,
+                 vocab_target,
+                 batch_size,
+                 batch_tokens_size=None,
+                 max_wait_time=0.01,
+                 delimiter=" ",
+                 tokenize_output=False,
+                 translation_cache=None):
+        """ Initializes the server and starts the decoding thread.
+
+        Args:
+            sess: `tf.Session` with the restored model.
+            prediction_op: Tensorflow operation for inference.
+            input_fields: A list of dicts of placeholders.
+            vocab_source: A `Vocab` instance for source side feature map.
+            vocab_target: A `Vocab` instance for target side feature map.
+            batch_size: The maximum number of sentences of each decoding batch.
+            batch_tokens_size: The maximum number of padded source tokens
+              of each decoding batch, if provided.
+            max_wait_time: The maximum seconds that the earliest pending
+              request waits for more sentences before decoding starts.
+            delimiter: The delimiter of output token sequence.
+            tokenize_output: Whether to split words into characters
+              (only for Chinese).
+            translation_cache: A `TranslationCache` object, if provided,
+              only the sentences not in the cache are decoded.
+        """
+        self._sess = sess
+        self._prediction_op = prediction_op
+        self._input_fields = input_fields
+        self._vocab_source = vocab_source
+        self._vocab_target = vocab_target
+        self._batch_size = batch_size
+        self._batch_tokens_size = batch_tokens_size
+        self._max_wait_time = max_wait_time
+        self._delimiter = delimiter
+        self._tokenize_output = tokenize_output
+        self._translation_cache = translation_cache
+        # a list of tuples (request, sample_idx)
+        self._pending = []
+        self._num_pending_tokens = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._decoding_loop, name="TranslationServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def translate(self, lines):
+        """ Translates source lines, blocking until finished. This
+        method is thread-safe.
+
+        Args:
+            lines: A list of source strings.
+
+        Returns: A finished `TranslationRequest`.
+        """
+        request = TranslationRequest(
+            [self._vocab_source.convert_to_idlist(line.strip()) for line in lines])
+        if len(lines) > 0:
+            with self._cond:
+                for sample_idx, ids in enumerate(request.feature_ids):
+                    self._pending.append((request, sample_idx))
+                    self._num_pending_tokens += len(ids)
+                self._cond.notify()
+        request.wait()
+        return request
+
+    def _is_batch_full(self):
+        """ Returns True if pending sentences fill a decoding batch. """
+        if len(self._pending) >= self._batch_size:
+            return True
+        return self._batch_tokens_size is not None \
+            and self._num_pending_tokens >= self._batch_tokens_size
+
+    def _wait_for_pending(self):
+        """ Waits for the pending sentences until a batch is full or
+        the earliest request has waited `max_wait_time`.
+
+        Returns: A list of tuples (request, sample_idx), or None if stopped.
+        """
+        with self._cond:
+            while len(self._pending) == 0 and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            deadline = self._pending[0][0].arrival_time + self._max_wait_time
+            while not self._is_batch_full() and not self._stopped:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            pending = self._pending
+            self._pending = []
+            self._num_pending_tokens = 0
+        return pending
+
+    def _decoding_loop(self):
+        """ Decodes the pending sentences batch by batch. """
+        while True:
+            pending = self._wait_for_pending()
+            if pending is None:
+                break
+            for line_ids in make_inference_batches(
+                    numpy.array([len(req.feature_ids[idx]) for req, idx in pending]),
+                    batch_size=self._batch_size,
+                    batch_tokens_size=self._batch_tokens_size,
+                    sort_by_length=True):
+                batch = [pending[i] for i in line_ids]
+                start_time = time.time()
+                for req, _ in batch:
+                    if req.start_decoding_time is None:
+                        req.start_decoding_time = start_time
+                data = pack_feed_dict(
+                    name_prefixs=Constants.FEATURE_NAME_PREFIX,
+                    origin_datas=[req.feature_ids[idx] for req, idx in batch],
+                    paddings=self._vocab_source.pad_id,
+                    input_fields=self._input_fields)
+                try:
+                    _, hypothesis = infer(
+                        sess=self._sess,
+                        prediction_op=self._prediction_op,
+                        infer_data=[data],
+                        output=None,
+                        vocab_source=self._vocab_source,
+                        vocab_target=self._vocab_target,
+                        delimiter=self._delimiter,
+                        tokenize_output=self._tokenize_output,
+                        verbose=False,
+                        translation_cache=self._translation_cache,
+                        input_fields=self._input_fields)
+                except Exception as e:
+                    tf.logging.info("Fail to decode a batch of {} sentences: {}".format(len(batch), e))
+                    for req, _ in batch:
+                        if req.error is None:
+                            req.finish(error=str(e))
+                    continue
+                for (req, idx), hypo in zip(batch, hypothesis):
+                    if req.error is None:
+                        req.fill(idx, hypo)
+
+    def stop(self):
+        """ Stops the decoding thread. """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Handles each HTTP request in a new thread. """
+    daemon_threads = True
+
+
+def make_http_server(translation_server, host, port):
+    """ Creates an HTTP server translating JSON requests.
+
+    A request is a POST to "/translate" with body {"sentences": [...]}.
+    The response is {"translations": [...], "queueing_time": float,
+    "decoding_time": float}, where the times are in seconds.
+
+    Args:
+        translation_server: A `TranslationServer` object.
+        host: The host name to bind.
+        port: The port to bind.
+
+    Returns: A `BaseHTTPServer.HTTPServer` object.
+    """
+
+    class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/translate":
+                self._reply(404, {"error": "unknown path {}".format(self.path)})
+                return
+            try:
+                content_length = int(self.headers.get("Content-Length", 0))
+                sentences = json.loads(self.rfile.read(content_length).decode("utf-8"))["sentences"]
+                if not (isinstance(sentences, list)
+                        and all(isinstance(s, six.string_types) for s in sentences)):
+                    raise ValueError("\"sentences\" should be a list of strings")
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": "bad request: {}".format(e)})
+                return
+            request = translation_server.translate(sentences)
+            if request.error is not None:
+                self._reply(500, {"error": request.error})
+                return
+            tf.logging.info("Translated {} sentences. Queueing Time: {:.4f}s, Decoding Time: {:.4f}s."
+                            .format(len(sentences), request.queueing_time, request.decoding_time))
+            self._reply(200, {"translations": request.hypothesis,
+                              "queueing_time": request.queueing_time,
+                              "decoding_time": request.decoding_time})
+
+        def log_message(self, *args):
+            pass
+
+    return _ThreadingHTTPServer((host, port), _Handler)
@@ -0,0 +1,112 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define functions for splitting an input file into contiguous shards
+and merging the inference results of the shards in the original order. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+
+from tensorflow import gfile
+
+from njunmt.inference.attention import AttentionReader
+from njunmt.inference.attention import AttentionWriter
+from njunmt.utils.misc import open_file
+
+
+def split_into_shards(filename, num_shards, shard_prefix):
+    """ Splits a file into at most `num_shards` contiguous shards of
+    (almost) the same number of lines. The file is streamed twice
+    (counting and writing) instead of being loaded into memory.
+
+    Args:
+        filename: The file name to split.
+        num_shards: The maximum number of shards.
+        shard_prefix: The prefix of shard file names, the i-th shard is
+          saved to `shard_prefix`.i
+
+    Returns: A list of tuples `(shard_filename, start_line)`, where
+      `start_line` is the index of the first line of the shard in `filename`.
+      Empty shards are not created.
+    """
+    with open_file(filename, encoding="utf-8") as fp:
+        num_lines = sum(1 for _ in fp)
+    shards = []
+    shard_size, remainder = divmod(num_lines, num_shards)
+    # the lines are streamed into the shards in a second pass
+    with open_file(filename, encoding="utf-8") as fp:
+        start = 0
+        for idx in range(num_shards):
+            end = start + shard_size + int(idx < remainder)
+            if end == start:
+                break
+            shard_filename = "{}.{}".format(shard_prefix, idx)
+            with open_file(shard_filename, encoding="utf-8", mode="w") as fw:
+                for line in itertools.islice(fp, end - start):
+                    fw.write(line)
+            shards.append((shard_filename, start))
+            start = end
+    return shards
+
+
+def merge_shard_outputs(shard_outputs, output):
+    """ Concatenates the translations of the shards.
+
+    Args:
+        shard_outputs: A list of output file names of the shards, in order.
+        output: The merged output file name.
+    """
+    with gfile.GFile(output, "w") as fw:
+        for shard_output in shard_outputs:
+            with gfile.GFile(shard_output, "r") as fp:
+                fw.write(fp.read())
+
+
+def merge_shard_nbest(shard_outputs, start_lines, output):
+    """ Concatenates the n-best lists of the shards, shifting the line ids
+    to the original file.
+
+    Args:
+        shard_outputs: A list of output file names of the shards, in order.
+        start_lines: A list of the first line indexes of the shards.
+        output: The merged output file name, the n-best lists are read
+          from `shard_output`.nbest and written to `output`.nbest.
+    """
+    with gfile.GFile(output + ".nbest", "w") as fw:
+        for shard_output, start_line in zip(shard_outputs, start_lines):
+            with gfile.GFile(shard_output + ".nbest", "r") as fp:
+                for line in fp:
+                    line_id, _, rest = line.partition(" ||| ")
+                    fw.write("{} ||| {}".format(int(line_id) + start_line, rest))
+
+
+def merge_shard_attentions(shard_outputs, start_lines, output):
+    """ Merges the attention of the shards saved by `AttentionWriter`,
+    shifting the sample indexes to the original file.
+
+    Args:
+        shard_outputs: A list of output file names of the shards, in order.
+        start_lines: A list of the first line indexes of the shards.
+        output: The merged output file name.
+    """
+    attention_writer = AttentionWriter(output)
+    for shard_output, start_line in zip(shard_outputs, start_lines):
+        attention_reader = AttentionReader(shard_output)
+        for sample_idx in attention_reader.sample_ids():
+            att = attention_reader.read(sample_idx)
+            attention_writer.write_packed(sample_idx + start_line, att["source"],
+                                          att["translation"], att["attentions"])
+        attention_reader.close()
+    attention_writer.close()
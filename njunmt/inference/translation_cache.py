@@ -0,0 +1,160 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define a cache of sentence-level translations for inference. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+import tensorflow as tf
+from tensorflow import gfile
+
+
+def _file_md5(filename):
+    """ Returns the md5 hex digest of a file's content, or None if
+    `filename` is not a file. """
+    if not (filename and gfile.Exists(filename)):
+        return None
+    with gfile.GFile(filename, "rb") as fp:
+        return hashlib.md5(fp.read()).hexdigest()
+
+
+def _bpecodes_signature(bpecodes):
+    """ Returns a dict of BPE options with the codes and vocabulary files
+    replaced by their md5 hex digests. """
+    return {k: _file_md5(v) if k in ("codes", "vocab") else v
+            for k, v in (bpecodes or {}).items()}
+
+
+def make_translation_signature(checkpoint_path, inference_options):
+    """ Makes a string identifying the model and the decoding settings,
+    so that translations are reused only if they would be the same.
+
+    Args:
+        checkpoint_path: The path of the checkpoint to be restored.
+        inference_options: A dict of inference options, see
+          `InferExperiment.default_inference_options()`.
+
+    Returns: A string.
+    """
+    index_file = checkpoint_path + ".index"
+    signature = {
+        "checkpoint": os.path.abspath(checkpoint_path),
+        "checkpoint_mtime": os.path.getmtime(index_file) if os.path.exists(index_file) else None,
+        "source_vocabulary": _file_md5(inference_options["source_words_vocabulary"]),
+        "source_bpecodes": _bpecodes_signature(inference_options["source_bpecodes"]),
+        "target_vocabulary": _file_md5(inference_options["target_words_vocabulary"]),
+        "target_bpecodes": _bpecodes_signature(inference_options["target_bpecodes"])}
+    if inference_options.get("shortlist_file"):
+        signature["shortlist"] = _file_md5(inference_options["shortlist_file"])
+    for name in ["beam_size", "length_penalty", "maximum_labels_length", "early_termination",
+                 "shortlist_num_candidates", "shortlist_num_frequent_words"]:
+        signature[name] = inference_options[name]
+    return hashlib.md5(json.dumps(signature, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TranslationCache(object):
+    """ A size-bounded LRU cache mapping source token ids to predicted
+    token ids, with hit/miss counters. It can be saved to and loaded from disk. """
+
+    def __init__(self, signature, max_size=None, filename=None):
+        """ Initializes the cache.
+
+        Args:
+            signature: A string returned by `make_translation_signature()`.
+              Translations with different signatures are never mixed.
+            max_size: The maximum number of cached sentences, None for unbounded.
+            filename: If provided, cached translations are loaded from it
+              (if exists) and saved to it by `save()`.
+        """
+        self._signature = signature
+        self._max_size = max_size
+        self._filename = filename
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filename:
+            self.load(filename)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _make_key(self, feature_ids):
+        return self._signature, tuple(feature_ids)
+
+    def get(self, feature_ids):
+        """ Returns the cached prediction of `feature_ids` and marks it as
+        recently used, or None if not cached. """
+        key = self._make_key(feature_ids)
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, feature_ids, prediction):
+        """ Caches the prediction of `feature_ids`. """
+        key = self._make_key(feature_ids)
+        self._data.pop(key, None)
+        self._data[key] = list(prediction)
+        while self._max_size is not None and len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def hit_rate(self):
+        """ Returns the ratio of hits of all lookups. """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def log_statistics(self):
+        """ Logs the hit rate. """
+        tf.logging.info("Translation cache: {} hits, {} misses, hit rate {:.2f}%, {} cached sentences."
+                        .format(self.hits, self.misses, self.hit_rate() * 100., len(self)))
+
+    def save(self, filename=None):
+        """ Saves the cached translations to `filename` or the file passed
+        to the constructor. """
+        filename = filename or self._filename
+        if not filename:
+            return
+        with gfile.GFile(filename, "wb") as fw:
+            fw.write(pickle.dumps(list(self._data.items()), protocol=2))
+
+    def load(self, filename):
+        """ Loads cached translations from `filename` if it exists.
+
+        Returns: The number of loaded translations. Translations with
+          a different signature are skipped.
+        """
+        if not gfile.Exists(filename):
+            return 0
+        with gfile.GFile(filename, "rb") as fp:
+            items = pickle.loads(fp.read())
+        num_loaded = 0
+        for key, value in items:
+            if key[0] != self._signature:
+                continue
+            self._data[key] = value
+            num_loaded += 1
+        while self._max_size is not None and len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+        tf.logging.info("Loaded {} cached translations from {}.".format(num_loaded, filename))
+        return num_loaded
@@ -19,6 +19,7 @@ from __future__ import print_function
 
 from abc import abstractmethod, abstractproperty
 import tensorflow as tf
+from tensorflow.python.ops import inplace_ops
 
 from njunmt.utils.misc import deprecated
 from njunmt.layers.common_layers import fflayer
@@ -256,6 +257,23 @@ def attention_bias_lower_triangle(length):
     return tf.reshape(ret, [1, 1, length, length])
 
 
+def attention_bias_unwritten_slots(time, capacity):
+    """ Create a bias tensor to be added to attention logits for
+    a preallocated cache of keys and values.
+
+      Allows a query to attend to the slots up to and including `time`.
+    Args:
+        time: A scalar, the slot to which the keys and values of current
+          query are written.
+        capacity: A scalar, the number of slots of the cache.
+
+    Returns: A float Tensor of shape [1, 1, 1, capacity], with -1e9 in
+      unwritten slots and 0 in written slots.
+    """
+    ret = FLOAT_MIN * tf.to_float(tf.greater(tf.range(capacity), time))
+    return tf.reshape(ret, [1, 1, 1, capacity])
+
+
 def dot_product_attention(q, k, bias=None, dropout_keep_prob=1.0):
     """ Computes attention weight according to query and key.
 
@@ -278,6 +296,30 @@ def dot_product_attention(q, k, bias=None, dropout_keep_prob=1.0):
         return weights
 
 
+def _write_cache_slot(cache, x, time):
+    """ Writes `x` to the slot at `time` of the preallocated `cache`
+    without copying the cache.
+
+    Args:
+        cache: A Tensor with shape [batch_size, capacity, depth]. Its
+          buffer is updated, so it must have no other consumers.
+        x: A Tensor with shape [batch_size, 1, depth].
+        time: A scalar, the slot to write.
+
+    Returns: A Tensor sharing the buffer of `cache`, with the same shape.
+    """
+    shape = tf.shape(cache)
+    # [batch_size, capacity, depth] ==> [batch_size * capacity, depth],
+    #   where the rows to write are time, capacity + time, ...
+    ret = inplace_ops.alias_inplace_update(
+        tf.reshape(cache, [-1, shape[2]]),
+        tf.range(shape[0]) * shape[1] + time,
+        tf.squeeze(x, axis=1))
+    ret = tf.reshape(ret, shape)
+    ret.set_shape(cache.get_shape())
+    return ret
+
+
 class MultiHeadAttention(BaseAttention):
     """ Class of multi-head scaled-dot-product attention with input/output
       transformations.
@@ -356,7 +398,8 @@ class MultiHeadAttention(BaseAttention):
               memory,
               memory_length=None,
               memory_bias=None,
-              cache=None):
+              cache=None,
+              beam_shared_memory=False):
         """ Builds attention context.
 
         Args:
@@ -366,6 +409,11 @@ class MultiHeadAttention(BaseAttention):
             memory_length: The number of attention values, [batch_size,].
             memory_bias: The bias tensor for attention values with shape [batch_size, 1, 1, timesteps].
             cache: A dictionary containing pre-projected keys and values.
+            beam_shared_memory: Whether the memory (and `cache`) is shared by the
+              beams of each sample. If True, `query` has shape
+              [batch_size * beam_size, 1, channels_query] while `memory` and
+              `memory_bias` are not stacked by beam_size, and the beams of a
+              sample are computed as `length_q`=beam_size queries.
 
         Returns: The result of the attention transformation. A tuple
         `(attention_scores, attention_context)`. The `attention_scores`
@@ -380,6 +428,9 @@ class MultiHeadAttention(BaseAttention):
                 query = tf.expand_dims(query, axis=1)
             # compute q, k, v
             q, k, v = self._compute_qkv(query, memory, cache)
+            if beam_shared_memory:
+                # [batch_size * beam_size, 1, depth] ==> [batch_size, beam_size, depth]
+                q = tf.reshape(q, [tf.shape(k)[0], -1, self._attention_key_depth])
 
             # after split_last_dimension: [batch_size, length, depth]
             #           ==> [batch_size, length, num_heads, depth/num_heads]
@@ -413,6 +464,14 @@ class MultiHeadAttention(BaseAttention):
             # linear transform
             attention_context = conv1d(attention_context, self._output_depth, kernel_size=1,
                                        name="output_transform")
+            if beam_shared_memory:
+                # [batch_size, beam_size, output_depth] ==> [batch_size * beam_size, 1, output_depth]
+                attention_context = tf.reshape(attention_context, [-1, 1, self._output_depth])
+                # [batch_size, num_heads, beam_size, length_k]
+                #   ==> [batch_size * beam_size, num_heads, 1, length_k]
+                attention_weight = tf.transpose(attention_weight, [0, 2, 1, 3])
+                attention_weight = tf.reshape(attention_weight, tf.concat(
+                    [[-1, self._num_heads, 1], tf.shape(attention_weight)[-1:]], axis=0))
             if query_is_2d:
                 # attention context: [batch_size, depth_value]
                 attention_context = tf.squeeze(attention_context, axis=1)
@@ -449,14 +508,22 @@ class MultiHeadAttention(BaseAttention):
               If None, it indicates self-attention.
             memory: Attention values tensor with shape
               [batch_size, length_m, channels_value]
-            cache: A dictionary containing pre-projected keys and values.
+            cache: A dictionary containing pre-projected keys and values. If
+              it has "time", the keys and values are preallocated with shape
+              [batch_size, capacity, depth], and the ones of current query
+              (length_m=1) are written in place to the slot at "time".
 
         Returns: A tuple `(query_transformed, key_transformed, memory_transformed)`.
         """
         if query is None:
             # indicates self-attention
             q, k, v = self.compute_qkv(memory)
-            if cache is not None:
+            if cache is not None and "time" in cache:
+                # for self-attention in transformer decoder when mode=INFER
+                #   with preallocated cache
+                cache["keys"] = k = _write_cache_slot(cache["keys"], k, cache["time"])
+                cache["values"] = v = _write_cache_slot(cache["values"], v, cache["time"])
+            elif cache is not None:
                 # for self-attention in transformer decoder when mode=INFER
                 k = tf.concat([cache["keys"], k], axis=1)
                 v = tf.concat([cache["values"], v], axis=1)
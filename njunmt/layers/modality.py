@@ -166,15 +166,20 @@ class Modality(Configurable):
         """ Returns the size of vocabulary. """
         return self._vocab_size
 
-    def top(self, top_features):
+    def top(self, top_features, shortlist_ids=None):
         """ Computes logits on the top layer.
 
         Args:
             top_features: A Tensor.
+            shortlist_ids: A 1-d int32 Tensor of target token ids. If provided,
+              only computes the logits of these tokens, for inference only.
 
-        Returns: A logits Tensor.
+        Returns: A logits Tensor, whose last dimension is the size of
+          vocabulary, or the size of `shortlist_ids` if provided.
         """
         feature_last_dim = top_features.get_shape().as_list()[-1]
+        if shortlist_ids is not None:
+            return self._shortlist_top(top_features, shortlist_ids)
         if self.params["share_embedding_and_softmax_weights"]:
             assert feature_last_dim == self._body_input_depth, \
                 "when shared_embedding_and_softmax_weights, dim_logits should be equal to input_depth"
@@ -192,6 +197,39 @@ class Modality(Configurable):
                          name=scope_name)
         return logits
 
+    def _shortlist_top(self, top_features, shortlist_ids):
+        """ Computes the logits of the tokens in `shortlist_ids` with
+        the slices of the softmax weights of `top()`.
+
+        Args:
+            top_features: A Tensor with shape [..., dim].
+            shortlist_ids: A 1-d int32 Tensor of target token ids.
+
+        Returns: A logits Tensor with shape [..., num_shortlist_ids].
+        """
+        feature_last_dim = top_features.get_shape().as_list()[-1]
+        if self.params["share_embedding_and_softmax_weights"]:
+            assert feature_last_dim == self._body_input_depth, \
+                "when shared_embedding_and_softmax_weights, dim_logits should be equal to input_depth"
+            scope_name = "shared"
+            with tf.variable_scope(scope_name, reuse=True):
+                # [num_shortlist_ids, dim]
+                weights = tf.gather(self._get_weight(feature_last_dim), shortlist_ids)
+            weights = tf.transpose(weights, [1, 0])
+        else:
+            scope_name = "softmax"
+            with tf.variable_scope(scope_name):
+                weights = tf.get_variable(
+                    name="W", shape=[feature_last_dim, self.top_dimension])
+            weights = tf.gather(weights, shortlist_ids, axis=1)
+        with tf.variable_scope(scope_name):
+            bias = tf.get_variable(
+                name="b", shape=[self.top_dimension],
+                initializer=tf.constant_initializer(0.0))
+        return tf.nn.bias_add(
+            tf.tensordot(top_features, weights, [[top_features.get_shape().ndims - 1], [0]]),
+            tf.gather(bias, shortlist_ids))
+
     def bottom_simple(self, x, name, reuse, time=None):
         """ Embeds the symbols.
 
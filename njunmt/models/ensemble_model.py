@@ -20,9 +20,10 @@ import os
 import tensorflow as tf
 from tensorflow.python.util import nest
 
-from njunmt.utils.beam_search import stack_beam_size
+from njunmt.utils.beam_search import stack_cache_beam_size
 from njunmt.utils.beam_search import BeamSearchStateSpec
 from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import backtrace_hypothesis
 from njunmt.utils.beam_search import process_beam_predictions
 from njunmt.utils.expert_utils import DecoderOutputRemover
 from njunmt.utils.expert_utils import repeat_n_times
@@ -91,7 +92,7 @@ def dynamic_ensemble_decode(
     def _create_cache(_decoder, _encoder_output, _bridge):
         with tf.variable_scope(_decoder.name):
             _init_cache = _decoder.prepare(_encoder_output, _bridge, helper)
-            _init_cache = stack_beam_size(_init_cache, beam_size)
+            _init_cache = stack_cache_beam_size(_init_cache, beam_size)
         return _init_cache
 
     initial_caches = repeat_n_times(
@@ -103,7 +104,7 @@ def dynamic_ensemble_decode(
                            for _decoder_output_remover, _decoder in zip(decoder_output_removers, decoders)]
 
     def body_infer(time, inputs, caches, outputs_tas, finished,
-                   log_probs, lengths, bs_stat_ta, predicted_ids):
+                   log_probs, lengths, bs_stat_ta):
         """Internal while_loop body.
 
         Args:
@@ -115,7 +116,6 @@ def dynamic_ensemble_decode(
           log_probs: The log probability Tensor.
           lengths: The decoding length Tensor.
           bs_stat_ta: structure of TensorArray.
-          predicted_ids: A Tensor.
 
         Returns:
           `(time + 1, next_inputs, next_caches, next_outputs_tas,
@@ -147,31 +147,25 @@ def dynamic_ensemble_decode(
 
         infer_status = BeamSearchStateSpec(
             log_probs=next_log_probs,
-            beam_ids=beam_ids)
+            beam_ids=beam_ids,
+            word_ids=sample_ids)
         bs_stat_ta = nest.map_structure(lambda ta, out: ta.write(time, out),
                                         bs_stat_ta, infer_status)
-        predicted_ids = gather_states(tf.reshape(predicted_ids, [-1, time + 1]), beam_ids)
-        next_predicted_ids = tf.concat([predicted_ids, tf.expand_dims(sample_ids, axis=1)], axis=1)
-        next_predicted_ids = tf.reshape(next_predicted_ids, [-1])
-        next_predicted_ids.set_shape([None])
         next_finished, next_input_symbols = helper.next_symbols(time=time, sample_ids=sample_ids)
         next_inputs = repeat_n_times(num_models, target_to_embedding_fns,
                                      next_input_symbols, time + 1)
         next_finished = tf.logical_or(next_finished, finished)
 
         return time + 1, next_inputs, next_caches, next_outputs_tas, \
-               next_finished, next_log_probs, next_lengths, bs_stat_ta, \
-               next_predicted_ids
+               next_finished, next_log_probs, next_lengths, bs_stat_ta
 
     initial_log_probs = tf.zeros_like(initial_input_symbols, dtype=tf.float32)
     initial_lengths = tf.zeros_like(initial_input_symbols, dtype=tf.int32)
     initial_bs_stat_ta = nest.map_structure(_create_ta, BeamSearchStateSpec.dtypes())
-    initial_input_symbols.set_shape([None])
     loop_vars = [initial_time, initial_inputs, initial_caches,
                  initial_outputs_tas, initial_finished,
                  # infer vars
-                 initial_log_probs, initial_lengths, initial_bs_stat_ta,
-                 initial_input_symbols]
+                 initial_log_probs, initial_lengths, initial_bs_stat_ta]
 
     res = tf.while_loop(
         lambda *args: tf.logical_not(tf.reduce_all(args[4])),
@@ -180,13 +174,12 @@ def dynamic_ensemble_decode(
         parallel_iterations=parallel_iterations,
         swap_memory=swap_memory)
 
-    timesteps = res[0] + 1
-    log_probs, length, bs_stat, predicted_ids = res[-4:]
+    log_probs, length, bs_stat = res[-3:]
     final_bs_stat = nest.map_structure(lambda ta: ta.stack(), bs_stat)
     return {"beam_ids": final_bs_stat.beam_ids,
             "log_probs": final_bs_stat.log_probs,
             "decoding_length": length,
-            "hypothesis": tf.reshape(predicted_ids, [-1, timesteps])[:, 1:]}
+            "hypothesis": backtrace_hypothesis(final_bs_stat.word_ids, final_bs_stat.beam_ids)}
 
 
 class EnsembleModel(object):
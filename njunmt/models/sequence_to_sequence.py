@@ -23,6 +23,7 @@ from abc import ABCMeta
 import tensorflow as tf
 
 import njunmt
+from njunmt.data.shortlist import load_lexical_shortlist
 from njunmt.layers.modality import Modality
 from njunmt.utils import bridges
 from njunmt.utils import feedback
@@ -31,6 +32,7 @@ from njunmt.utils.configurable import deep_merge_dict
 from njunmt.utils.constants import Constants
 from njunmt.utils.constants import ModeKeys
 from njunmt.utils.beam_search import process_beam_predictions
+from njunmt.utils.beam_search import process_greedy_predictions
 from njunmt.utils.misc import set_fflayers_layer_norm
 
 # import all bridges
@@ -77,6 +79,8 @@ class SequenceToSequence(Configurable):
         self._encoder = self._create_encoder()
         self._decoder = self._create_decoder()
         self._encoder_decoder_bridge = self._create_bridge()
+        # the target token ids that logits cover at inference, see `_decode()`
+        self._shortlist_ids = None
 
     @staticmethod
     def create_input_fields(mode):
@@ -153,6 +157,11 @@ class SequenceToSequence(Configurable):
             "inference.beam_size": 10,
             "inference.maximum_labels_length": 150,
             "inference.length_penalty": -1.0,
+            "inference.shrink_finished_batch": False,
+            "inference.early_termination": False,
+            "inference.shortlist_file": None,
+            "inference.shortlist_num_candidates": 50,
+            "inference.shortlist_num_frequent_words": 100,
             "initializer": "random_uniform"}
 
     def get_variable_initializer(self):
@@ -225,19 +234,75 @@ class SequenceToSequence(Configurable):
                 vocab=self._vocab_target, label_ids=label_ids, label_length=label_length)
 
         else:  # self.mode == tf.contrib.learn.ModeKeys.INFER
-            helper = feedback.BeamFeedback(
-                vocab=self._vocab_target,
-                batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
-                maximum_labels_length=self.params["inference.maximum_labels_length"],
-                beam_size=self.params["inference.beam_size"],
-                alpha=self.params["inference.length_penalty"])
+            if self.params["inference.shortlist_file"]:
+                self._shortlist_ids = self._make_shortlist_ids(
+                    input_fields[Constants.FEATURE_IDS_NAME],
+                    input_fields[Constants.FEATURE_LENGTH_NAME])
+            if self.params["inference.beam_size"] == 1:
+                # the length penalty does not change the argmax of each step
+                helper = feedback.GreedyFeedback(
+                    vocab=self._vocab_target,
+                    batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                    maximum_labels_length=self.params["inference.maximum_labels_length"],
+                    shortlist_ids=self._shortlist_ids)
+            else:
+                helper = feedback.BeamFeedback(
+                    vocab=self._vocab_target,
+                    batch_size=tf.shape(input_fields[Constants.FEATURE_IDS_NAME])[0],
+                    maximum_labels_length=self.params["inference.maximum_labels_length"],
+                    beam_size=self.params["inference.beam_size"],
+                    alpha=self.params["inference.length_penalty"],
+                    shortlist_ids=self._shortlist_ids)
         decoder_output, decoding_res = self._decoder.decode(
             encoder_output, self._encoder_decoder_bridge, helper,
             self._target_to_embedding_fn,
             self._outputs_to_logits_fn,
-            beam_size=self.params["inference.beam_size"])
+            beam_size=self.params["inference.beam_size"],
+            shrink_finished_batch=self.params["inference.shrink_finished_batch"],
+            early_termination=self.params["inference.early_termination"])
         return decoder_output, decoding_res
 
+    def _make_shortlist_ids(self, feature_ids, feature_length):
+        """ Collects the target candidates of the source tokens in this
+        batch from the lexical shortlist, together with the frequent words.
+
+        The candidates table is held by a local variable initialized
+        from a placeholder, so that it is not serialized into the graph.
+        Its initial value is added to collection
+        `Constants.LOCAL_INIT_FEED_COLLECTION_NAME` and must be fed
+        when running `tf.local_variables_initializer()`.
+
+        Args:
+            feature_ids: A Tensor with shape [batch_size, timesteps].
+            feature_length: A Tensor with shape [batch_size, ].
+
+        Returns: A 1-d int32 Tensor of unique target token ids.
+        """
+        candidates, frequent_ids = load_lexical_shortlist(
+            filename=self.params["inference.shortlist_file"],
+            vocab_source=self._vocab_source,
+            vocab_target=self._vocab_target,
+            num_candidates=self.params["inference.shortlist_num_candidates"],
+            num_frequent_words=self.params["inference.shortlist_num_frequent_words"])
+        if self.verbose:
+            tf.logging.info("Loaded lexical shortlist from {}: at most {} candidates per token, "
+                            "{} frequent words.".format(self.params["inference.shortlist_file"],
+                                                        candidates.shape[1], len(frequent_ids)))
+        candidates_init = tf.placeholder(tf.int32, shape=candidates.shape,
+                                         name="shortlist_candidates_init")
+        candidates_table = tf.Variable(candidates_init, trainable=False,
+                                       collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                       name="shortlist_candidates")
+        tf.add_to_collection(Constants.LOCAL_INIT_FEED_COLLECTION_NAME,
+                             (candidates_init, candidates))
+        # padding positions do not contribute candidates
+        nonpadding_ids = tf.boolean_mask(
+            feature_ids, tf.sequence_mask(feature_length, maxlen=tf.shape(feature_ids)[1]))
+        batch_candidates = tf.gather(candidates_table, nonpadding_ids)
+        shortlist_ids, _ = tf.unique(tf.concat(
+            [tf.constant(frequent_ids), tf.reshape(batch_candidates, [-1])], axis=0))
+        return shortlist_ids
+
     def _input_to_embedding_fn(self, x, time=None):
         """ Embeds the input symbols.
 
@@ -275,7 +340,7 @@ class SequenceToSequence(Configurable):
         Returns: A Tensor with shape [..., vocab_size]
         """
         with tf.variable_scope(self._target_modality.name):
-            logits = self._target_modality.top(outputs)
+            logits = self._target_modality.top(outputs, shortlist_ids=self._shortlist_ids)
         return logits
 
     def _encode(self, input_fields):
@@ -390,10 +455,15 @@ class SequenceToSequence(Configurable):
             return (loss_sum, weight_sum), attentions
 
         assert self.mode == ModeKeys.INFER
-        predict_out = process_beam_predictions(
-            decoding_result=decoding_result,
-            beam_size=self.params["inference.beam_size"],
-            alpha=self.params["inference.length_penalty"])
+        if self.params["inference.beam_size"] == 1:
+            predict_out = process_greedy_predictions(
+                decoding_result=decoding_result,
+                alpha=self.params["inference.length_penalty"])
+        else:
+            predict_out = process_beam_predictions(
+                decoding_result=decoding_result,
+                beam_size=self.params["inference.beam_size"],
+                alpha=self.params["inference.length_penalty"])
         predict_out["attentions"] = attentions
         predict_out["source"] = kwargs[Constants.FEATURE_IDS_NAME]
         return predict_out
@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """ Define base experiment class and basic experiment classes. """
+import copy
+import multiprocessing
+import os
+import shutil
+import tempfile
 import time
 from abc import ABCMeta, abstractmethod
 
@@ -20,18 +25,29 @@ import tensorflow as tf
 
 from njunmt.data.dataset import Dataset
 from njunmt.data.text_inputter import ParallelTextInputter
+from njunmt.data.text_inputter import PrefetchingIterator
 from njunmt.data.text_inputter import TextLineInputter
 from njunmt.data.vocab import Vocab
 from njunmt.inference.decode import evaluate_with_attention
 from njunmt.inference.decode import infer
+from njunmt.inference.server import TranslationServer
+from njunmt.inference.server import make_http_server
+from njunmt.inference.sharding import merge_shard_attentions
+from njunmt.inference.sharding import merge_shard_nbest
+from njunmt.inference.sharding import merge_shard_outputs
+from njunmt.inference.sharding import split_into_shards
+from njunmt.inference.translation_cache import TranslationCache
+from njunmt.inference.translation_cache import make_translation_signature
 from njunmt.models.model_builder import model_fn
 from njunmt.utils.configurable import ModelConfigs
 from njunmt.utils.configurable import parse_params
 from njunmt.utils.configurable import print_params
 from njunmt.utils.configurable import update_eval_metric
 from njunmt.utils.configurable import update_infer_params
+from njunmt.utils.constants import Constants
 from njunmt.utils.constants import ModeKeys
 from njunmt.utils.metrics import multi_bleu_score_from_file
+from njunmt.utils.summary_writer import SummaryWriter
 
 
 @six.add_metaclass(ABCMeta)
@@ -48,12 +64,19 @@ class Experiment:
         raise NotImplementedError
 
     @staticmethod
-    def _build_default_session():
-        """ Returns default tf.Session(). """
+    def _build_default_session(intra_op_parallelism_threads=None):
+        """ Returns default tf.Session().
+
+        Args:
+            intra_op_parallelism_threads: The number of threads for
+              running one op, if provided.
+        """
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
         config.log_device_placement = False
         config.allow_soft_placement = True
+        if intra_op_parallelism_threads:
+            config.intra_op_parallelism_threads = intra_op_parallelism_threads
         return tf.Session(config=config)
 
 
@@ -110,7 +133,11 @@ class TrainingExperiment(Experiment):
             "reverse_target": False,
             "maximum_features_length": None,
             "maximum_labels_length": None,
-            "shuffle_every_epoch": None
+            "shuffle_every_epoch": None,
+            "compiled_corpus": None,
+            "prefetch_depth": 0,
+            "num_encoding_processes": 1,
+            "global_bucketing": False
         }
 
     def run(self):
@@ -133,6 +160,19 @@ class TrainingExperiment(Experiment):
             eval_features_file=self._model_configs["data"]["eval_features_file"],
             eval_labels_file=self._model_configs["data"]["eval_labels_file"])
 
+        # the encoding processes are forked before the session is created
+        train_text_inputter = ParallelTextInputter(
+            dataset,
+            "train_features_file",
+            "train_labels_file",
+            self._model_configs["train"]["batch_size"],
+            self._model_configs["train"]["batch_tokens_size"],
+            self._model_configs["train"]["shuffle_every_epoch"],
+            fill_full_batch=True,
+            compiled_corpus=self._model_configs["train"]["compiled_corpus"],
+            num_processes=self._model_configs["train"]["num_encoding_processes"],
+            global_bucketing=self._model_configs["train"]["global_bucketing"])
+
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
         config.allow_soft_placement = True
@@ -151,21 +191,26 @@ class TrainingExperiment(Experiment):
                 config=config),
             hooks=hooks)
 
-        train_text_inputter = ParallelTextInputter(
-            dataset,
-            "train_features_file",
-            "train_labels_file",
-            self._model_configs["train"]["batch_size"],
-            self._model_configs["train"]["batch_tokens_size"],
-            self._model_configs["train"]["shuffle_every_epoch"],
-            fill_full_batch=True)
         train_data = train_text_inputter.make_feeding_data(
             input_fields=estimator_spec.input_fields,
             maximum_features_length=self._model_configs["train"]["maximum_features_length"],
             maximum_labels_length=self._model_configs["train"]["maximum_labels_length"])
+        if self._model_configs["train"]["prefetch_depth"] > 0:
+            train_data = PrefetchingIterator(
+                train_data, self._model_configs["train"]["prefetch_depth"])
+        global_step_tensor = tf.train.get_global_step()
 
         eidx = [0, 0]
         update_cycle = [self._model_configs["train"]["update_cycle"], 1]
+        local_step = [0]
+
+        def display_input_statistics(session):
+            wait_secs_per_batch, num_batches, queue_size = train_data.pop_statistics()
+            global_step = session.run(global_step_tensor)
+            tf.logging.info("Input pipeline: waiting %f secs/batch over %d batches, %d batches in queue"
+                            % (wait_secs_per_batch, num_batches, queue_size))
+            SummaryWriter(self._model_configs["model_dir"]).add_summary(
+                "input_pipeline/wait_secs_per_batch", wait_secs_per_batch, global_step)
 
         def step_fn(step_context):
             step_context.session.run(train_ops["zeros_op"])
@@ -177,16 +222,26 @@ class TrainingExperiment(Experiment):
                     update_cycle[1] += 1
                 data = train_data.next()
                 update_cycle[1] = 1
-                return step_context.run_with_hooks(
+                ret = step_context.run_with_hooks(
                     train_ops["train_op"], feed_dict=data["feed_dict"])
+                local_step[0] += 1
+                if isinstance(train_data, PrefetchingIterator) \
+                        and local_step[0] % self._model_configs["train"]["eval_steps"] == 0:
+                    display_input_statistics(step_context.session)
+                return ret
             except StopIteration:
                 eidx[1] += 1
 
-        while not sess.should_stop():
-            if eidx[0] != eidx[1]:
-                tf.logging.info("STARTUP Epoch {}".format(eidx[1]))
-                eidx[0] = eidx[1]
-            sess.run_step_fn(step_fn)
+        try:
+            while not sess.should_stop():
+                if eidx[0] != eidx[1]:
+                    tf.logging.info("STARTUP Epoch {}".format(eidx[1]))
+                    eidx[0] = eidx[1]
+                sess.run_step_fn(step_fn)
+        finally:
+            if isinstance(train_data, PrefetchingIterator):
+                train_data.stop()
+            train_text_inputter.close()
 
 
 class InferExperiment(Experiment):
@@ -197,11 +252,16 @@ class InferExperiment(Experiment):
 
         Args:
             model_configs: A dictionary of all configurations.
+
+        Raises:
+            ValueError: if the inference options are invalid, see
+              `check_inference_options()`.
         """
         super(InferExperiment, self).__init__()
         infer_options = parse_params(
             params=model_configs["infer"],
             default_params=self.default_inference_options())
+        self.check_inference_options(infer_options)
         infer_data = []
         for item in model_configs["infer_data"]:
             infer_data.append(parse_params(
@@ -213,6 +273,25 @@ class InferExperiment(Experiment):
         print_params("Inference parameters: ", self._model_configs["infer"])
         print_params("Inference datasets: ", self._model_configs["infer_data"])
 
+    @staticmethod
+    def check_inference_options(infer_options):
+        """ Checks the inference options before building any model.
+
+        Args:
+            infer_options: A dictionary of inference options.
+
+        Raises:
+            ValueError: if "n_best" is larger than "beam_size" (a single
+              hypothesis is decoded for each sentence if beam_size=1), or
+              if "resume" is set with "num_shards" > 1.
+        """
+        if infer_options["n_best"] > infer_options["beam_size"]:
+            raise ValueError("n_best ({}) should not be larger than beam_size ({})."
+                             .format(infer_options["n_best"], infer_options["beam_size"]))
+        if infer_options.get("resume", False) and infer_options.get("num_shards", 1) > 1:
+            raise ValueError("resume is not supported with num_shards ({}) > 1."
+                             .format(infer_options["num_shards"]))
+
     @staticmethod
     def default_inference_options():
         """ Returns a dictionary of default inference options. """
@@ -226,7 +305,24 @@ class InferExperiment(Experiment):
             "length_penalty": -1.0,
             "maximum_labels_length": 150,
             "delimiter": " ",
-            "char_level": False}
+            "char_level": False,
+            "num_encoding_processes": 1,
+            "shrink_finished_batch": False,
+            "early_termination": False,
+            "batch_tokens_size": None,
+            "sort_by_length": False,
+            "sort_window_size": 10000,
+            "translation_cache_size": 0,
+            "translation_cache_file": None,
+            "shortlist_file": None,
+            "shortlist_num_candidates": 50,
+            "shortlist_num_frequent_words": 100,
+            "n_best": 0,
+            "num_shards": 1,
+            "intra_op_parallelism_threads": None,
+            "resume": False,
+            "flush_every": 1000,
+            "pipelined": False}
 
     @staticmethod
     def default_inferdata_params():
@@ -237,9 +333,63 @@ class InferExperiment(Experiment):
             "labels_file": None,
             "output_attention": False}
 
-    def run(self):
-        """Infers data files. """
-        # build datasets
+    def _build_and_restore_model(self, dataset):
+        """ Builds the inference model and restores its parameters
+        from the latest checkpoint.
+
+        Args:
+            dataset: A `Dataset` object.
+
+        Returns: A tuple `(sess, estimator_spec)`.
+
+        Raises:
+            OSError: if no checkpoint is found in model_dir.
+        """
+        self._model_configs = update_infer_params(
+            self._model_configs,
+            beam_size=self._model_configs["infer"]["beam_size"],
+            maximum_labels_length=self._model_configs["infer"]["maximum_labels_length"],
+            length_penalty=self._model_configs["infer"]["length_penalty"],
+            shrink_finished_batch=self._model_configs["infer"]["shrink_finished_batch"],
+            early_termination=self._model_configs["infer"]["early_termination"],
+            shortlist_file=self._model_configs["infer"]["shortlist_file"],
+            shortlist_num_candidates=self._model_configs["infer"]["shortlist_num_candidates"],
+            shortlist_num_frequent_words=self._model_configs["infer"]["shortlist_num_frequent_words"])
+        # build model
+        estimator_spec = model_fn(model_configs=self._model_configs,
+                                  mode=ModeKeys.INFER,
+                                  dataset=dataset,
+                                  name=self._model_configs["problem_name"])
+        sess = self._build_default_session(
+            self._model_configs["infer"]["intra_op_parallelism_threads"])
+        # reload
+        checkpoint_path = tf.train.latest_checkpoint(self._model_configs["model_dir"])
+        if checkpoint_path:
+            tf.logging.info("reloading models...")
+            saver = tf.train.Saver()
+            saver.restore(sess, checkpoint_path)
+        else:
+            raise OSError("File NOT Found. Fail to find checkpoint file from: {}"
+                          .format(self._model_configs["model_dir"]))
+        # local variables (e.g. the lexical shortlist) are not in the checkpoint
+        sess.run(tf.local_variables_initializer(),
+                 feed_dict=dict(tf.get_collection(Constants.LOCAL_INIT_FEED_COLLECTION_NAME)))
+        self._checkpoint_path = checkpoint_path
+        return sess, estimator_spec
+
+    def _build_translation_cache(self):
+        """ Returns a `TranslationCache` object if "translation_cache_size" > 0,
+        otherwise None. Must be called after the model is restored. """
+        if self._model_configs["infer"]["translation_cache_size"] <= 0:
+            return None
+        return TranslationCache(
+            signature=make_translation_signature(
+                self._checkpoint_path, self._model_configs["infer"]),
+            max_size=self._model_configs["infer"]["translation_cache_size"],
+            filename=self._model_configs["infer"]["translation_cache_file"])
+
+    def _build_vocabs(self):
+        """ Builds the source and target vocabularies. """
         self._vocab_source = Vocab(
             filename=self._model_configs["infer"]["source_words_vocabulary"],
             bpe_codes=self._model_configs["infer"]["source_bpecodes"],
@@ -248,6 +398,14 @@ class InferExperiment(Experiment):
             filename=self._model_configs["infer"]["target_words_vocabulary"],
             bpe_codes=self._model_configs["infer"]["target_bpecodes"],
             reverse_seq=self._model_configs["train"]["reverse_target"])
+
+    def run(self):
+        """Infers data files. """
+        if self._model_configs["infer"]["num_shards"] > 1:
+            self._run_sharded()
+            return
+        # build datasets
+        self._build_vocabs()
         # build dataset
         dataset = Dataset(
             self._vocab_source,
@@ -255,33 +413,18 @@ class InferExperiment(Experiment):
             eval_features_file=[p["features_file"] for p
                                 in self._model_configs["infer_data"]])
 
-        self._model_configs = update_infer_params(
-            self._model_configs,
-            beam_size=self._model_configs["infer"]["beam_size"],
-            maximum_labels_length=self._model_configs["infer"]["maximum_labels_length"],
-            length_penalty=self._model_configs["infer"]["length_penalty"])
-        # build model
-        estimator_spec = model_fn(model_configs=self._model_configs,
-                                  mode=ModeKeys.INFER,
-                                  dataset=dataset,
-                                  name=self._model_configs["problem_name"])
+        sess, estimator_spec = self._build_and_restore_model(dataset)
         predict_op = estimator_spec.predictions
 
-        sess = self._build_default_session()
-
         text_inputter = TextLineInputter(
             dataset=dataset,
             data_field_name="eval_features_file",
-            batch_size=self._model_configs["infer"]["batch_size"])
-        # reload
-        checkpoint_path = tf.train.latest_checkpoint(self._model_configs["model_dir"])
-        if checkpoint_path:
-            tf.logging.info("reloading models...")
-            saver = tf.train.Saver()
-            saver.restore(sess, checkpoint_path)
-        else:
-            raise OSError("File NOT Found. Fail to find checkpoint file from: {}"
-                          .format(self._model_configs["model_dir"]))
+            batch_size=self._model_configs["infer"]["batch_size"],
+            num_processes=self._model_configs["infer"]["num_encoding_processes"],
+            batch_tokens_size=self._model_configs["infer"]["batch_tokens_size"],
+            sort_by_length=self._model_configs["infer"]["sort_by_length"],
+            sort_window_size=self._model_configs["infer"]["sort_window_size"])
+        translation_cache = self._build_translation_cache()
 
         tf.logging.info("Start inference.")
         overall_start_time = time.time()
@@ -300,7 +443,14 @@ class InferExperiment(Experiment):
                   delimiter=self._model_configs["infer"]["delimiter"],
                   output_attention=param["output_attention"],
                   tokenize_output=self._model_configs["infer"]["char_level"],
-                  verbose=True)
+                  verbose=True,
+                  translation_cache=translation_cache,
+                  input_fields=estimator_spec.input_fields,
+                  n_best=self._model_configs["infer"]["n_best"],
+                  return_results=False,
+                  resume=self._model_configs["infer"]["resume"],
+                  flush_every=self._model_configs["infer"]["flush_every"],
+                  pipelined=self._model_configs["infer"]["pipelined"])
             tf.logging.info("FINISHED {}. Elapsed Time: {}."
                             .format(param["features_file"], str(time.time() - start_time)))
             if param["labels_file"] is not None:
@@ -311,6 +461,115 @@ class InferExperiment(Experiment):
                 tf.logging.info("BLEU score (%s): %.2f"
                                 % (param["features_file"], bleu_score))
         tf.logging.info("Total Elapsed Time: %s" % str(time.time() - overall_start_time))
+        if translation_cache is not None:
+            translation_cache.save()
+
+    def _run_sharded(self):
+        """ Splits each data file into "num_shards" contiguous shards, infers
+        the i-th shards of all files in the i-th worker process with its own
+        session, and merges the results in the original order. """
+        num_shards = self._model_configs["infer"]["num_shards"]
+        shard_dir = tempfile.mkdtemp(prefix="njunmt_shards.")
+        tf.logging.info("Start inference with {} shards in {}.".format(num_shards, shard_dir))
+        overall_start_time = time.time()
+        # the shards of each data file: a list of tuples (shard_filename, start_line)
+        data_shards = [split_into_shards(param["features_file"], num_shards,
+                                         os.path.join(shard_dir, "source{}".format(data_idx)))
+                       for data_idx, param in enumerate(self._model_configs["infer_data"])]
+        workers = []
+        for shard_idx in range(max([len(shards) for shards in data_shards])):
+            shard_configs = copy.deepcopy(self._model_configs)
+            shard_configs["infer"]["num_shards"] = 1
+            shard_configs["infer"]["intra_op_parallelism_threads"] = \
+                self._model_configs["infer"]["intra_op_parallelism_threads"] \
+                or max(1, multiprocessing.cpu_count() // num_shards)
+            # the workers should not write the same cache file
+            shard_configs["infer"]["translation_cache_file"] = None
+            shard_configs["infer_data"] = [
+                {"features_file": shards[shard_idx][0],
+                 "output_file": "{}.output{}".format(shards[shard_idx][0], shard_idx),
+                 "labels_file": None,
+                 "output_attention": param["output_attention"]}
+                for shards, param in zip(data_shards, self._model_configs["infer_data"])
+                if shard_idx < len(shards)]
+            worker = multiprocessing.Process(target=_infer_shard, args=(shard_configs,))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        try:
+            failed = [idx for idx, worker in enumerate(workers) if worker.exitcode != 0]
+            if failed:
+                raise RuntimeError("Fail to infer shards: {}".format(failed))
+            for shards, param in zip(data_shards, self._model_configs["infer_data"]):
+                shard_outputs = ["{}.output{}".format(shard_filename, shard_idx)
+                                 for shard_idx, (shard_filename, _) in enumerate(shards)]
+                start_lines = [start_line for _, start_line in shards]
+                merge_shard_outputs(shard_outputs, param["output_file"])
+                if self._model_configs["infer"]["n_best"] > 0:
+                    merge_shard_nbest(shard_outputs, start_lines, param["output_file"])
+                if param["output_attention"]:
+                    merge_shard_attentions(shard_outputs, start_lines, param["output_file"])
+                if param["labels_file"] is not None:
+                    bleu_score = multi_bleu_score_from_file(
+                        hypothesis_file=param["output_file"],
+                        references_files=param["labels_file"],
+                        char_level=self._model_configs["infer"]["char_level"])
+                    tf.logging.info("BLEU score (%s): %.2f"
+                                    % (param["features_file"], bleu_score))
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        tf.logging.info("Total Elapsed Time: %s" % str(time.time() - overall_start_time))
+
+
+class ServingExperiment(InferExperiment):
+    """ Define an experiment that serves translation requests over HTTP. """
+
+    def __init__(self, model_configs, host="localhost", port=8080, max_wait_time=0.01):
+        """ Initializes the serving experiment.
+
+        Args:
+            model_configs: A dictionary of all configurations.
+            host: The host name to bind.
+            port: The port to bind.
+            max_wait_time: The maximum seconds that a request waits for
+              other requests to be batched with.
+        """
+        super(ServingExperiment, self).__init__(model_configs)
+        self._host = host
+        self._port = port
+        self._max_wait_time = max_wait_time
+
+    def run(self):
+        """ Serves translation requests until interrupted. """
+        self._build_vocabs()
+        dataset = Dataset(self._vocab_source, self._vocab_target)
+        sess, estimator_spec = self._build_and_restore_model(dataset)
+        translation_cache = self._build_translation_cache()
+        translation_server = TranslationServer(
+            sess=sess,
+            prediction_op=estimator_spec.predictions,
+            input_fields=estimator_spec.input_fields,
+            vocab_source=self._vocab_source,
+            vocab_target=self._vocab_target,
+            batch_size=self._model_configs["infer"]["batch_size"],
+            batch_tokens_size=self._model_configs["infer"]["batch_tokens_size"],
+            max_wait_time=self._max_wait_time,
+            delimiter=self._model_configs["infer"]["delimiter"],
+            tokenize_output=self._model_configs["infer"]["char_level"],
+            translation_cache=translation_cache)
+        http_server = make_http_server(translation_server, self._host, self._port)
+        tf.logging.info("Serving translation on http://{}:{}/translate".format(self._host, self._port))
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
+            translation_server.stop()
+            if translation_cache is not None:
+                translation_cache.log_statistics()
+                translation_cache.save()
 
 
 class EvalExperiment(Experiment):
@@ -427,3 +686,14 @@ class EvalExperiment(Experiment):
             tf.logging.info("Evaluation Score ({} on {}): {}"
                             .format(metric_str, param["features_file"], result))
         tf.logging.info("Total Elapsed Time: %s" % str(time.time() - overall_start_time))
+
+
+def _infer_shard(model_configs):
+    """ Infers the shards of data files on CPU in a worker process.
+
+    Args:
+        model_configs: A dictionary of all configurations, with the shard
+          files as "infer_data".
+    """
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    InferExperiment(model_configs).run()
@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy
+import tensorflow as tf
+
+from njunmt.inference.attention import AttentionReader
+from njunmt.inference.attention import AttentionWriter
+from njunmt.inference.attention import truncate_attention
+
+
+def _random_sample_attention(len_src, len_trg, num_heads=2, seed=1234):
+    """ Returns random (padded) attention of one sample. """
+    rand = numpy.random.RandomState(seed)
+    return {"encoder_decoder_attention": rand.rand(len_trg + 3, len_src + 4).astype(numpy.float32),
+            "decoder_self_attention": rand.rand(len_trg + 3, num_heads, len_trg + 3).astype(numpy.float32)}
+
+
+class AttentionStoreTest(tf.test.TestCase):
+    def testWriteAndReadLazily(self):
+        prefix = os.path.join(self.get_temp_dir(), "trans")
+        source_tokens = [["a", "b", "c"], ["d", "e"]]
+        candidate_tokens = [["x", "y"], ["z", "w", "v", "u"]]
+        attentions = [_random_sample_attention(len(ss), len(tt), seed=idx)
+                      for idx, (ss, tt) in enumerate(zip(source_tokens, candidate_tokens))]
+        writer = AttentionWriter(prefix)
+        # the samples may be written out of order
+        for idx in [1, 0]:
+            writer.write(idx, source_tokens[idx], candidate_tokens[idx], attentions[idx])
+        writer.close()
+
+        reader = AttentionReader(prefix)
+        self.assertEqual([0, 1], reader.sample_ids())
+        for idx in [1, 0]:
+            att = reader.read(idx)
+            len_src = len(source_tokens[idx]) + 1
+            len_trg = len(candidate_tokens[idx]) + 1
+            self.assertEqual(" ".join(source_tokens[idx]), att["source"])
+            self.assertEqual(" ".join(candidate_tokens[idx]), att["translation"])
+            values = {a["name"]: a["value"] for a in att["attentions"]}
+            self.assertAllClose(
+                attentions[idx]["encoder_decoder_attention"][:len_trg, :len_src],
+                values["encoder_decoder_attention"], atol=1e-3)
+            self.assertAllClose(
+                attentions[idx]["decoder_self_attention"][:len_trg, :, :len_trg].transpose([1, 0, 2]),
+                values["decoder_self_attention"], atol=1e-3)
+        reader.close()
+
+    def _write_samples(self, prefix, sample_ids, append=False):
+        writer = AttentionWriter(prefix, append=append)
+        for idx in sample_ids:
+            writer.write(idx, ["a"] * (idx + 1), ["b"] * (idx + 2),
+                         _random_sample_attention(idx + 1, idx + 2, seed=idx))
+        writer.close()
+
+    def _read_samples(self, prefix):
+        reader = AttentionReader(prefix)
+        samples = dict((idx, reader.read(idx)) for idx in reader.sample_ids())
+        reader.close()
+        return samples
+
+    def _assertSameSamples(self, expected, samples):
+        self.assertEqual(sorted(expected.keys()), sorted(samples.keys()))
+        for idx, att in expected.items():
+            self.assertEqual(att["source"], samples[idx]["source"])
+            self.assertEqual(att["translation"], samples[idx]["translation"])
+            for a, b in zip(att["attentions"], samples[idx]["attentions"]):
+                self.assertEqual(a["name"], b["name"])
+                self.assertAllEqual(a["value"], b["value"])
+
+    def testResume(self):
+        expected_prefix = os.path.join(self.get_temp_dir(), "expected")
+        self._write_samples(expected_prefix, range(6))
+        expected = self._read_samples(expected_prefix)
+
+        prefix = os.path.join(self.get_temp_dir(), "resumed")
+        self._write_samples(prefix, range(5))
+        # killed while writing sample 5
+        with open(prefix + ".attention", "ab") as fw:
+            fw.write(b"\x00" * 7)
+        with open(prefix + ".attention.index", "a") as fw:
+            fw.write('{"id": 5, "sour')
+        # the output file has 3 complete lines
+        self.assertEqual(3, truncate_attention(prefix, 3))
+        self._assertSameSamples(dict((idx, expected[idx]) for idx in range(3)),
+                                self._read_samples(prefix))
+        self.assertEqual(os.path.getsize(expected_prefix + ".attention") - sum(
+            [a["value"].nbytes for idx in range(3, 6) for a in expected[idx]["attentions"]]),
+            os.path.getsize(prefix + ".attention"))
+        self._write_samples(prefix, range(3, 6), append=True)
+        self._assertSameSamples(expected, self._read_samples(prefix))
+
+    def testResumeWithIncompleteArrays(self):
+        expected_prefix = os.path.join(self.get_temp_dir(), "expected")
+        self._write_samples(expected_prefix, range(4))
+        expected = self._read_samples(expected_prefix)
+
+        prefix = os.path.join(self.get_temp_dir(), "resumed")
+        self._write_samples(prefix, range(4))
+        # the index of sample 3 is flushed before its arrays
+        data_length = os.path.getsize(prefix + ".attention")
+        with open(prefix + ".attention", "rb+") as fw:
+            fw.truncate(data_length - 1)
+        self.assertEqual(3, truncate_attention(prefix, 10))
+        self._write_samples(prefix, [3], append=True)
+        self._assertSameSamples(expected, self._read_samples(prefix))
+        self.assertEqual(data_length, os.path.getsize(prefix + ".attention"))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,179 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import types
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.dataset import Dataset
+from njunmt.data.text_inputter import TextLineInputter
+from njunmt.data.text_inputter import make_inference_batches
+from njunmt.data.text_inputter import make_length_bucketed_batches
+from njunmt.data.vocab import Vocab
+from njunmt.utils.constants import Constants
+from njunmt.utils.misc import open_file, close_file
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+eval_src_file = "testdata/toy.zh"
+
+# the feeding data is keyed by these names instead of placeholders
+_INPUT_FIELDS = [{name: name for name in [Constants.FEATURE_IDS_NAME,
+                                          Constants.FEATURE_LENGTH_NAME]}]
+
+
+def _random_lengths(num_samples, seed=1234):
+    """ Returns random lengths of features and labels. """
+    rand = numpy.random.RandomState(seed)
+    return rand.randint(1, 80, size=num_samples), rand.randint(1, 80, size=num_samples)
+
+
+def _padded_size(batch, features_lengths, labels_lengths):
+    """ Returns the padded size of a batch, as bounded by `batch_tokens_size`. """
+    return len(batch) * max(features_lengths[batch].max(), labels_lengths[batch].max())
+
+
+class LengthBucketedBatchesTest(tf.test.TestCase):
+    def testBatchSize(self):
+        features_lengths, labels_lengths = _random_lengths(1000)
+        batches = make_length_bucketed_batches(
+            features_lengths, labels_lengths, batch_size=32, shuffle=False)
+        self.assertEqual([32] * 31 + [8], [len(b) for b in batches])
+        self.assertAllEqual(numpy.arange(1000), numpy.sort(numpy.concatenate(batches)))
+        self.assertEqual([], make_length_bucketed_batches(
+            numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64),
+            batch_size=32, batch_tokens_size=100))
+
+    def testBatchBounds(self):
+        features_lengths, labels_lengths = _random_lengths(3000)
+        batch_size = 8
+        batch_tokens_size = 1024
+        batches = make_length_bucketed_batches(
+            features_lengths, labels_lengths, batch_size=batch_size,
+            batch_tokens_size=batch_tokens_size, shuffle=False)
+        self.assertAllEqual(numpy.arange(3000), numpy.sort(numpy.concatenate(batches)))
+        for idx, batch in enumerate(batches):
+            padded_size = _padded_size(batch, features_lengths, labels_lengths)
+            if idx < len(batches) - 1:
+                self.assertGreaterEqual(len(batch), batch_size)
+                # the batch is as large as possible
+                self.assertGreater(_padded_size(numpy.append(batch, batches[idx + 1][0]),
+                                                features_lengths, labels_lengths),
+                                   batch_tokens_size)
+            if len(batch) > batch_size:
+                self.assertLessEqual(padded_size, batch_tokens_size)
+
+    def testShuffle(self):
+        features_lengths, labels_lengths = _random_lengths(3000)
+        batches = make_length_bucketed_batches(
+            features_lengths, labels_lengths, batch_size=8,
+            batch_tokens_size=1024, shuffle=True)
+        self.assertAllEqual(numpy.arange(3000), numpy.sort(numpy.concatenate(batches)))
+        self.assertLessEqual(len([b for b in batches if len(b) < 8]), 1)
+        for batch in batches:
+            if len(batch) > 8:
+                self.assertLessEqual(
+                    _padded_size(batch, features_lengths, labels_lengths), 1024)
+
+    def testPaddingRatio(self):
+        features_lengths, labels_lengths = _random_lengths(5000)
+        num_tokens = float(numpy.sum(features_lengths) + numpy.sum(labels_lengths))
+
+        def padding_ratio(batches):
+            return sum([len(b) * (features_lengths[b].max() + labels_lengths[b].max())
+                        for b in batches]) / num_tokens
+
+        bucketed_ratio = padding_ratio(make_length_bucketed_batches(
+            features_lengths, labels_lengths, batch_size=16, batch_tokens_size=2048))
+        random_ratio = padding_ratio(numpy.array_split(
+            numpy.random.RandomState(1234).permutation(5000), 5000 // 32))
+        self.assertLess(bucketed_ratio, 1.5)
+        self.assertLess(bucketed_ratio, random_ratio)
+
+
+class InferenceBatchesTest(tf.test.TestCase):
+    def testBatchSize(self):
+        lengths, _ = _random_lengths(100)
+        batches = make_inference_batches(lengths, batch_size=32)
+        self.assertEqual([32, 32, 32, 4], [len(b) for b in batches])
+        # in the original order
+        self.assertAllEqual(numpy.arange(100), numpy.concatenate(batches))
+        self.assertEqual([], make_inference_batches(
+            numpy.array([], dtype=numpy.int64), batch_size=32))
+
+    def testBatchTokensSize(self):
+        lengths, _ = _random_lengths(1000)
+        batch_size = 16
+        batch_tokens_size = 256
+        for sort_by_length in [False, True]:
+            batches = make_inference_batches(
+                lengths, batch_size=batch_size, batch_tokens_size=batch_tokens_size,
+                sort_by_length=sort_by_length)
+            self.assertAllEqual(numpy.arange(1000), numpy.sort(numpy.concatenate(batches)))
+            for idx, batch in enumerate(batches):
+                self.assertLessEqual(len(batch), batch_size)
+                if len(batch) > 1:
+                    self.assertLessEqual(len(batch) * lengths[batch].max(), batch_tokens_size)
+                if idx < len(batches) - 1 and len(batch) < batch_size:
+                    # the batch is as large as possible
+                    next_batch = numpy.append(batch, batches[idx + 1][0])
+                    self.assertGreater(len(next_batch) * lengths[next_batch].max(),
+                                       batch_tokens_size)
+
+    def testSortByLength(self):
+        lengths = numpy.array([3, 7, 1, 7, 5, 3, 9], dtype=numpy.int64)
+        batches = make_inference_batches(lengths, batch_size=2, sort_by_length=True)
+        # the longest first, the sentences of the same length in the original order
+        self.assertEqual([[6, 1], [3, 4], [0, 5], [2]], [b.tolist() for b in batches])
+
+
+class SortWindowTest(tf.test.TestCase):
+    def _read_batches(self, sort_window_size, in_memory=True):
+        vocab_src = Vocab(vocab_src_file)
+        vocab_trg = Vocab(vocab_trg_file)
+        dataset = Dataset(vocab_src, vocab_trg, eval_features_file=eval_src_file)
+        inputter = TextLineInputter(
+            dataset, "eval_features_file", batch_size=8,
+            sort_by_length=True, sort_window_size=sort_window_size)
+        return inputter.make_feeding_data(_INPUT_FIELDS, in_memory=in_memory)
+
+    def testSortWindow(self):
+        fp = open_file(eval_src_file)
+        num_lines = len(fp.readlines())
+        close_file(fp)
+        window_size = 50
+        self.assertGreater(num_lines, window_size)
+        windowed_batches = self._read_batches(window_size)
+        line_ids = [line_id for data in windowed_batches for line_id in data["line_ids"]]
+        self.assertEqual(list(range(num_lines)), sorted(line_ids))
+        window_line_ids = {}
+        for data in windowed_batches:
+            # a batch does not span windows
+            self.assertEqual(1, len(set([line_id // window_size for line_id in data["line_ids"]])))
+            window_line_ids.setdefault(data["line_ids"][0] // window_size, []).extend(
+                zip(data["line_ids"], data[Constants.FEATURE_IDS_NAME]))
+        for ids in window_line_ids.values():
+            # sorted by length within each window
+            lengths = [len(x) for _, x in ids]
+            self.assertEqual(sorted(lengths, reverse=True), lengths)
+        # the same sentences as sorting the whole file
+        whole_file_ids = dict(
+            (line_id, x) for data in self._read_batches(None)
+            for line_id, x in zip(data["line_ids"], data[Constants.FEATURE_IDS_NAME]))
+        for ids in window_line_ids.values():
+            for line_id, x in ids:
+                self.assertEqual(whole_file_ids[line_id], x)
+
+    def testStreaming(self):
+        batches = self._read_batches(50, in_memory=False)
+        self.assertIsInstance(batches, types.GeneratorType)
+        # the first window is batched before the following lines are read
+        self.assertLess(max(next(batches)["line_ids"]), 50)
+        self.assertEqual([data["line_ids"] for data in self._read_batches(50)][1:],
+                         [data["line_ids"] for data in batches])
+
+
+if __name__ == "__main__":
+    tf.test.main()
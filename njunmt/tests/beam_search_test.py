@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy
+import tensorflow as tf
+
+from njunmt.utils.beam_search import backtrace_hypothesis
+from njunmt.utils.beam_search import gather_states
+from njunmt.utils.beam_search import scatter_live_rows
+
+
+def _random_beam_search_states(timesteps, batch_size, beam_size, vocab_size=100, seed=1234):
+    """ Returns random word ids and beam ids, each beam is from a beam
+    of the same sentence at the previous timestep. """
+    rand = numpy.random.RandomState(seed)
+    word_ids = rand.randint(vocab_size, size=[timesteps, batch_size * beam_size])
+    beam_base_pos = numpy.repeat(numpy.arange(batch_size) * beam_size, beam_size)
+    beam_ids = rand.randint(beam_size, size=[timesteps, batch_size * beam_size]) + beam_base_pos
+    return word_ids.astype(numpy.int32), beam_ids.astype(numpy.int32)
+
+
+def _regather_hypothesis(word_ids, beam_ids):
+    """ Builds the hypothesis by gathering the whole history at each
+    timestep, as the decoding loop did before back pointers. """
+    timesteps = tf.shape(word_ids)[0]
+    initial_predicted_ids = tf.zeros([tf.shape(word_ids)[1]], dtype=tf.int32)
+    initial_predicted_ids.set_shape([None])
+
+    def _body(t, predicted_ids):
+        predicted_ids = gather_states(tf.reshape(predicted_ids, [-1, t + 1]), beam_ids[t])
+        next_predicted_ids = tf.concat([predicted_ids, tf.expand_dims(word_ids[t], axis=1)], axis=1)
+        next_predicted_ids = tf.reshape(next_predicted_ids, [-1])
+        next_predicted_ids.set_shape([None])
+        return t + 1, next_predicted_ids
+
+    _, predicted_ids = tf.while_loop(
+        lambda t, _: t < timesteps, _body,
+        loop_vars=[tf.constant(0, dtype=tf.int32), initial_predicted_ids])
+    return tf.reshape(predicted_ids, [-1, timesteps + 1])[:, 1:]
+
+
+class BeamSearchTest(tf.test.TestCase):
+    def testBacktraceHypothesis(self):
+        word_ids, beam_ids = _random_beam_search_states(20, 3, 4)
+        with self.test_session() as sess:
+            hypothesis, expected_hypothesis = sess.run(
+                [backtrace_hypothesis(word_ids, beam_ids),
+                 _regather_hypothesis(word_ids, beam_ids)])
+        self.assertAllEqual(expected_hypothesis, hypothesis)
+
+    def testScatterLiveRows(self):
+        live_rows = tf.constant([1, 3], dtype=tf.int32)
+        scattered_ids = scatter_live_rows(
+            live_rows, tf.constant([10, 30]), num_rows=4,
+            defaults=tf.constant([0, 1, 2, 3]))
+        scattered_states = scatter_live_rows(
+            live_rows, tf.constant([[1., 2.], [3., 4.]]), num_rows=4)
+        with self.test_session() as sess:
+            ids, states = sess.run([scattered_ids, scattered_states])
+        self.assertAllEqual([0, 10, 2, 30], ids)
+        self.assertAllEqual([[0., 0.], [1., 2.], [0., 0.], [3., 4.]], states)
+
+
+class BacktraceBenchmark(tf.test.Benchmark):
+    def benchmarkBacktraceHypothesis(self):
+        maximum_labels_length = 150
+        word_ids, beam_ids = _random_beam_search_states(maximum_labels_length, 32, 10)
+        word_ids_ph = tf.placeholder(tf.int32, [None, None])
+        beam_ids_ph = tf.placeholder(tf.int32, [None, None])
+        feed_dict = {word_ids_ph: word_ids, beam_ids_ph: beam_ids}
+        with tf.Session() as sess:
+            for name, fn in [("regather", _regather_hypothesis),
+                             ("backtrace", backtrace_hypothesis)]:
+                hypothesis = fn(word_ids_ph, beam_ids_ph)
+                sess.run(hypothesis, feed_dict=feed_dict)  # warm up
+                num_iters = 20
+                start_time = time.time()
+                for _ in range(num_iters):
+                    sess.run(hypothesis, feed_dict=feed_dict)
+                self.report_benchmark(
+                    name="{}_maxlen{}".format(name, maximum_labels_length),
+                    iters=num_iters, wall_time=(time.time() - start_time) / num_iters)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,147 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import gc
+import os
+import random
+import time
+import weakref
+
+import tensorflow as tf
+
+from njunmt.data import bpe_encdec
+from njunmt.data.bpe_encdec import BPE
+from njunmt.data.bpe_encdec import BPECache
+from njunmt.data.bpe_encdec import apply_merges
+from njunmt.data.bpe_encdec import apply_merges_heap
+from njunmt.data.vocab import Vocab
+from njunmt.tools import learn_bpe
+
+train_trg_file = "testdata/toy.en0"
+vocab_trg_file = "testdata/vocab.en"
+
+
+def _learn_codes(codes_file, num_symbols=500):
+    with codecs.open(train_trg_file, encoding="utf-8") as fp, \
+            codecs.open(codes_file, "w", encoding="utf-8") as fw:
+        learn_bpe.main(fp, fw, num_symbols)
+
+
+def _random_words(alphabet, num_words, maximum_length, seed=1234):
+    rand = random.Random(seed)
+    return ["".join(rand.choice(alphabet) for _ in range(rand.randint(1, maximum_length)))
+            for _ in range(num_words)]
+
+
+def _to_symbols(word):
+    return tuple(word[:-1]) + (word[-1] + "</w>",)
+
+
+class BPEEncodeTest(tf.test.TestCase):
+    def testHeapMergeIdentical(self):
+        codes_file = os.path.join(self.get_temp_dir(), "codes")
+        _learn_codes(codes_file)
+        bpe = BPE(codes_file)
+        heap_bpe = BPE(codes_file, heap_merge=True)
+        with codecs.open(train_trg_file, encoding="utf-8") as fp:
+            for line in fp:
+                self.assertEqual(bpe.encode(line), heap_bpe.encode(line))
+        # long words and repeated symbols, e.g. "a a a" with merge "a a"
+        for word in _random_words("etaoin", 1000, 200) + _random_words("ee", 1000, 50):
+            if len(word) < 2:
+                continue
+            self.assertEqual(apply_merges(_to_symbols(word), bpe.bpe_codes),
+                             apply_merges_heap(_to_symbols(word), bpe.bpe_codes))
+
+
+class BPECacheTest(tf.test.TestCase):
+    def testLRUEviction(self):
+        cache = BPECache(max_size=2)
+        cache["a"] = ("a",)
+        cache["b"] = ("b",)
+        # "a" becomes the most recently used one
+        self.assertEqual(("a",), cache.get("a"))
+        cache["c"] = ("c",)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(("a",), cache.get("a"))
+        self.assertEqual(("c",), cache.get("c"))
+        self.assertEqual(3, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertAllClose(0.75, cache.hit_rate())
+
+    def testSaveAndLoadSignature(self):
+        cache_file = os.path.join(self.get_temp_dir(), "bpe_cache")
+        cache = BPECache(signature="codes1")
+        cache["a"] = ("a",)
+        cache["bc"] = ("b", "c")
+        cache.save(cache_file)
+        same_cache = BPECache(signature="codes1")
+        self.assertEqual(2, same_cache.load(cache_file))
+        self.assertEqual(("b", "c"), same_cache.get("bc"))
+        # the cache saved with other BPE codes is ignored
+        other_cache = BPECache(signature="codes2")
+        self.assertEqual(0, other_cache.load(cache_file))
+        self.assertEqual(0, len(other_cache))
+
+    def testBPECacheFile(self):
+        codes_file = os.path.join(self.get_temp_dir(), "codes")
+        cache_file = os.path.join(self.get_temp_dir(), "codes_cache")
+        _learn_codes(codes_file)
+        bpe = BPE(codes_file, cache_file=cache_file)
+        with codecs.open(train_trg_file, encoding="utf-8") as fp:
+            lines = fp.readlines()[:50]
+        outputs = [bpe.encode(line) for line in lines]
+        bpe.save_cache()
+        warm_bpe = BPE(codes_file, cache_file=cache_file)
+        self.assertEqual(outputs, [warm_bpe.encode(line) for line in lines])
+        self.assertEqual(0, warm_bpe.cache.misses)
+
+    def testSaveCacheAtExit(self):
+        codes_file = os.path.join(self.get_temp_dir(), "codes")
+        cache_file = os.path.join(self.get_temp_dir(), "exit_cache")
+        _learn_codes(codes_file)
+        with codecs.open(train_trg_file, encoding="utf-8") as fp:
+            lines = fp.readlines()[:20]
+        for _ in range(3):
+            bpe = BPE(codes_file, cache_file=cache_file)
+        # only the cache of the last BPE with the same file is saved
+        self.assertIs(bpe.cache, bpe_encdec._CACHES_TO_SAVE[os.path.abspath(cache_file)])
+        outputs = [bpe.encode(line) for line in lines]
+        bpe_encdec._save_caches()
+        warm_bpe = BPE(codes_file, cache_file=cache_file)
+        self.assertEqual(outputs, [warm_bpe.encode(line) for line in lines])
+        self.assertEqual(0, warm_bpe.cache.misses)
+
+    def testVocabNotKeptAlive(self):
+        codes_file = os.path.join(self.get_temp_dir(), "codes")
+        _learn_codes(codes_file)
+        vocab = Vocab(vocab_trg_file, bpe_codes={"codes": codes_file})
+        vocab_ref = weakref.ref(vocab)
+        del vocab
+        gc.collect()
+        self.assertIsNone(vocab_ref())
+
+
+class BPEEncodeBenchmark(tf.test.Benchmark):
+    def benchmarkApplyMerges(self):
+        codes_file = os.path.join(tf.test.get_temp_dir(), "codes")
+        _learn_codes(codes_file)
+        bpe = BPE(codes_file)
+        for maximum_length in [10, 50, 200]:
+            words = [_to_symbols(w) for w in _random_words(
+                "etaoinshrdlu", 200, maximum_length) if len(w) > 1]
+            for name, merge_fn in [("linear", apply_merges), ("heap", apply_merges_heap)]:
+                start_time = time.time()
+                for word in words:
+                    merge_fn(word, bpe.bpe_codes)
+                wall_time = (time.time() - start_time) / len(words)
+                self.report_benchmark(
+                    name="apply_merges_{}_maxlen{}".format(name, maximum_length),
+                    iters=len(words), wall_time=wall_time)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy
+import tensorflow as tf
+
+from tensorflow.python.ops import inplace_ops
+
+from njunmt.layers.common_attention import MultiHeadAttention
+from njunmt.layers.common_attention import attention_bias_unwritten_slots
+from njunmt.tests.memory_stats import run_with_memory_stats
+from njunmt.utils.beam_search import stack_beam_size
+from njunmt.utils.constants import ModeKeys
+
+num_heads = 8
+num_units = 512
+
+
+def _build_encdec_attention(query, memory, memory_length, beam_size, beam_shared_memory):
+    """ Builds the encoder-decoder attention of one decoding step,
+    with memory shared by beams or stacked by beam size. """
+    query = tf.convert_to_tensor(query)
+    memory = tf.convert_to_tensor(memory)
+    attention = MultiHeadAttention(
+        params={"num_heads": num_heads, "num_units": num_units},
+        mode=ModeKeys.INFER)
+    memory_bias = MultiHeadAttention.attention_length_to_bias(
+        tf.shape(memory)[1], memory_length)
+    with tf.variable_scope("encdec_attention", reuse=tf.AUTO_REUSE):
+        with tf.variable_scope(attention.name):
+            attention_keys, attention_values = attention.compute_kv(memory)
+        cache = {"attention_keys": attention_keys,
+                 "attention_values": attention_values}
+        if not beam_shared_memory:
+            memory, memory_bias, cache = stack_beam_size(
+                [memory, memory_bias, cache], beam_size)
+        return attention.build(
+            query=query, memory=memory, memory_bias=memory_bias,
+            cache=cache, beam_shared_memory=beam_shared_memory)
+
+
+def _random_inputs(batch_size, beam_size, memory_maxlen, seed=1234):
+    rand = numpy.random.RandomState(seed)
+    query = rand.rand(batch_size * beam_size, 1, num_units).astype(numpy.float32)
+    memory = rand.rand(batch_size, memory_maxlen, num_units).astype(numpy.float32)
+    memory_length = rand.randint(1, memory_maxlen + 1, size=[batch_size]).astype(numpy.int32)
+    return query, memory, memory_length
+
+
+class BeamSharedMemoryTest(tf.test.TestCase):
+    def testBeamSharedMemory(self):
+        query, memory, memory_length = _random_inputs(3, 4, 7)
+        stacked_weight, stacked_context = _build_encdec_attention(
+            query, memory, memory_length, 4, beam_shared_memory=False)
+        shared_weight, shared_context = _build_encdec_attention(
+            query, memory, memory_length, 4, beam_shared_memory=True)
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            outputs = sess.run([stacked_weight, stacked_context,
+                                shared_weight, shared_context])
+        self.assertAllClose(outputs[0], outputs[2])
+        self.assertAllClose(outputs[1], outputs[3])
+
+
+class PreallocatedCacheTest(tf.test.TestCase):
+    def testSameAsGrowingCache(self):
+        batch_size = 3
+        capacity = 6
+        num_steps = 4
+        inputs = numpy.random.rand(num_steps, batch_size, 1, num_units).astype("float32")
+        attention = MultiHeadAttention(
+            params={"num_heads": num_heads, "num_units": num_units},
+            mode=ModeKeys.INFER)
+        growing_cache = {"keys": tf.zeros([batch_size, 0, num_units]),
+                         "values": tf.zeros([batch_size, 0, num_units])}
+        preallocated_cache = {
+            "keys": inplace_ops.empty([batch_size, capacity, num_units], tf.float32, init=True),
+            "values": inplace_ops.empty([batch_size, capacity, num_units], tf.float32, init=True)}
+        growing_outputs = []
+        preallocated_outputs = []
+        with tf.variable_scope("self_attention", reuse=tf.AUTO_REUSE):
+            for step in range(num_steps):
+                growing_outputs.append(attention.build(
+                    query=None, memory=inputs[step], memory_bias=None,
+                    cache=growing_cache)[1])
+                preallocated_cache["time"] = step
+                preallocated_outputs.append(attention.build(
+                    query=None, memory=inputs[step],
+                    memory_bias=attention_bias_unwritten_slots(step, capacity),
+                    cache=preallocated_cache)[1])
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            # run twice, the initial cache is not changed by the in-place updates
+            for _ in range(2):
+                growing, preallocated, keys = sess.run(
+                    [growing_outputs, preallocated_outputs, preallocated_cache["keys"]])
+                self.assertAllClose(growing, preallocated, atol=1e-5)
+                self.assertFalse(numpy.any(keys[:, num_steps:]))
+
+
+class BeamSharedMemoryBenchmark(tf.test.Benchmark):
+    def benchmarkBeamSharedMemory(self):
+        batch_size = 32
+        memory_maxlen = 100
+        for beam_size in [4, 10, 20]:
+            query, memory, memory_length = _random_inputs(batch_size, beam_size, memory_maxlen)
+            for beam_shared_memory in [False, True]:
+                with tf.Graph().as_default():
+                    outputs = _build_encdec_attention(
+                        query, memory, memory_length, beam_size, beam_shared_memory)
+                    with tf.Session() as sess:
+                        sess.run(tf.global_variables_initializer())
+                        sess.run(outputs)  # warm up
+                        num_iters = 20
+                        start_time = time.time()
+                        for _ in range(num_iters):
+                            sess.run(outputs)
+                        wall_time = (time.time() - start_time) / num_iters
+                        # memory, attention keys and values of one layer
+                        _, memory_stats = run_with_memory_stats(sess, outputs)
+                self.report_benchmark(
+                    name="encdec_attention_{}_beam{}".format(
+                        "shared" if beam_shared_memory else "stacked", beam_size),
+                    iters=num_iters, wall_time=wall_time, extras=memory_stats)
+
+
+if __name__ == "__main__":
+    tf.test.main()
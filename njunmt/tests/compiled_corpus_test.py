@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from njunmt.data.compiled_corpus import CompiledCorpus
+from njunmt.data.compiled_corpus import FEATURES_SUFFIX
+from njunmt.data.compiled_corpus import LABELS_SUFFIX
+from njunmt.data.compiled_corpus import compile_parallel_corpus
+from njunmt.data.vocab import Vocab
+from njunmt.utils.misc import open_file, close_file
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+train_src_file = "testdata/toy.zh"
+train_trg_file = "testdata/toy.en0"
+
+
+class CompiledCorpusTest(tf.test.TestCase):
+    def testCompileAndRead(self):
+        vocab_src = Vocab(vocab_src_file)
+        vocab_trg = Vocab(vocab_trg_file)
+        prefix = os.path.join(self.get_temp_dir(), "toy")
+        num_lines = compile_parallel_corpus(
+            train_src_file, train_trg_file,
+            vocab_src, vocab_trg, prefix)
+        features = CompiledCorpus(prefix + FEATURES_SUFFIX, vocab_src)
+        labels = CompiledCorpus(prefix + LABELS_SUFFIX, vocab_trg)
+        self.assertEqual(num_lines, len(features))
+        self.assertEqual(num_lines, len(labels))
+
+        fp_src = open_file(train_src_file)
+        fp_trg = open_file(train_trg_file)
+        for idx, (ss, tt) in enumerate(zip(fp_src, fp_trg)):
+            ss = vocab_src.convert_to_idlist(ss.strip())
+            tt = vocab_trg.convert_to_idlist(tt.strip())
+            self.assertAllEqual(ss, features[idx])
+            self.assertAllEqual(tt, labels[idx])
+            self.assertEqual(len(ss), features.lengths[idx])
+            self.assertEqual(len(tt), labels.lengths[idx])
+        close_file(fp_src)
+        close_file(fp_trg)
+
+    def testVocabularyMismatch(self):
+        vocab_src = Vocab(vocab_src_file)
+        vocab_trg = Vocab(vocab_trg_file)
+        prefix = os.path.join(self.get_temp_dir(), "toy")
+        compile_parallel_corpus(
+            train_src_file, train_trg_file,
+            vocab_src, vocab_trg, prefix)
+        with self.assertRaises(ValueError):
+            CompiledCorpus(prefix + FEATURES_SUFFIX, vocab_trg)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,296 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import os
+import tempfile
+import time
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.dataset import Dataset
+from njunmt.data.shortlist import build_lexical_shortlist
+from njunmt.data.shortlist import save_lexical_shortlist
+from njunmt.data.vocab import Vocab
+from njunmt.models.model_builder import model_fn
+from njunmt.utils.configurable import load_from_config_path
+from njunmt.utils.constants import Constants
+from njunmt.utils.constants import ModeKeys
+from njunmt.utils.misc import open_file, close_file
+from njunmt.utils.misc import padding_batch_data
+from njunmt.tests.memory_stats import run_with_memory_stats
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+train_src_file = "testdata/toy.zh"
+train_trg_file = "testdata/toy.en0"
+seq2seq_config_file = "njunmt/example_configs/toy_seq2seq.yml"
+transformer_config_file = "njunmt/example_configs/toy_transformer.yml"
+
+
+def _make_small_vocab(vocab_file, num_words, output_dir):
+    """ Writes the first `num_words` words of `vocab_file`, so that a
+    randomly initialized model generates EOS at various steps. """
+    small_vocab_file = os.path.join(output_dir, "vocab.small")
+    with open_file(vocab_file) as fp, open_file(small_vocab_file, mode="w") as fw:
+        for _ in range(num_words):
+            fw.write(fp.readline())
+    return small_vocab_file
+
+
+def _build_toy_model(config_file, inference_params_list, output_dir,
+                     decoder_params=None, num_sentences=20):
+    """ Builds the toy model for each of `inference_params_list` with shared
+    variables in the default graph, to decode the first lines of the toy corpus.
+
+    Args:
+        config_file: The model configuration file.
+        inference_params_list: A list of dicts of "inference.*" model parameters.
+          A dict value (e.g. of "decoder.params") updates the model parameter.
+        output_dir: A directory for the small target vocabulary.
+        decoder_params: A dict to update "decoder.params".
+        num_sentences: The number of lines to decode.
+
+    Returns: A tuple `(eos_id, prediction_ops, feed_dict)`, where
+      `prediction_ops` is a list of prediction dicts, one for each of
+      `inference_params_list`.
+    """
+    vocab_source = Vocab(vocab_src_file)
+    vocab_target = Vocab(_make_small_vocab(vocab_trg_file, 6, output_dir))
+    dataset = Dataset(vocab_source, vocab_target)
+    fp = open_file(train_src_file)
+    features = [vocab_source.convert_to_idlist(fp.readline().strip())
+                for _ in range(num_sentences)]
+    close_file(fp)
+    feature_ids, feature_length = padding_batch_data(features, vocab_source.pad_id)
+
+    model_configs = load_from_config_path([config_file])
+    prediction_ops = []
+    feed_dict = {}
+    for idx, inference_params in enumerate(inference_params_list):
+        configs = copy.deepcopy(model_configs)
+        configs["model_params"]["inference.maximum_labels_length"] = 30
+        for key, value in inference_params.items():
+            if isinstance(value, dict):
+                configs["model_params"][key].update(value)
+            else:
+                configs["model_params"][key] = value
+        if decoder_params:
+            configs["model_params"]["decoder.params"].update(decoder_params)
+        estimator_spec = model_fn(configs, ModeKeys.INFER, dataset, name="toy",
+                                  reuse=True if idx > 0 else None, verbose=False)
+        input_fields = estimator_spec.input_fields[0]
+        feed_dict[input_fields[Constants.FEATURE_IDS_NAME]] = feature_ids
+        feed_dict[input_fields[Constants.FEATURE_LENGTH_NAME]] = feature_length
+        prediction_ops.append(
+            {k: v for k, v in estimator_spec.predictions[0].items()
+             if k in ["sorted_hypothesis", "sorted_scores", "sorted_argidx",
+                      "decoding_length", "pruned"]})
+    return vocab_target.eos_id, prediction_ops, feed_dict
+
+
+def _decode_toy_model(config_file, inference_params_list, output_dir,
+                      decoder_params=None, num_sentences=20):
+    """ Decodes the first lines of the toy corpus with the (randomly initialized)
+    toy model built by `_build_toy_model()`.
+
+    Returns: A tuple `(eos_id, predictions)`, where `predictions` is a list of
+      prediction dicts, one for each of `inference_params_list`.
+    """
+    with tf.Graph().as_default():
+        tf.set_random_seed(1234)
+        eos_id, prediction_ops, feed_dict = _build_toy_model(
+            config_file, inference_params_list, output_dir,
+            decoder_params=decoder_params, num_sentences=num_sentences)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return eos_id, sess.run(prediction_ops, feed_dict=feed_dict)
+
+
+def _trim_hypothesis(hypothesis, eos_id):
+    """ Removes the symbols after the first EOS of each hypothesis. """
+    ret = []
+    for hypo in hypothesis:
+        hypo = list(hypo)
+        ret.append(hypo[:hypo.index(eos_id) + 1] if eos_id in hypo else hypo)
+    return ret
+
+
+class ShrinkFinishedBatchTest(tf.test.TestCase):
+    def _assertSameDecoding(self, config_file, decoder_params=None):
+        eos_id, (full, shrunk) = _decode_toy_model(
+            config_file,
+            [{"inference.shrink_finished_batch": False},
+             {"inference.shrink_finished_batch": True}],
+            self.get_temp_dir(), decoder_params=decoder_params)
+        # the sentences finish at different steps
+        self.assertGreater(len(set(full["decoding_length"].tolist())), 1)
+        self.assertAllClose(full["sorted_scores"], shrunk["sorted_scores"], atol=1e-5)
+        self.assertEqual(_trim_hypothesis(full["sorted_hypothesis"], eos_id),
+                         _trim_hypothesis(shrunk["sorted_hypothesis"], eos_id))
+        self.assertAllEqual(full["decoding_length"], shrunk["decoding_length"])
+
+    def testRNNDecoder(self):
+        self._assertSameDecoding(seq2seq_config_file)
+
+    def testTransformerDecoder(self):
+        self._assertSameDecoding(transformer_config_file)
+
+    def testTransformerDecoderBeamSharedMemory(self):
+        # the encoder-side cache is compacted by sentence instead of by beam
+        self._assertSameDecoding(transformer_config_file,
+                                 decoder_params={"beam_shared_memory": True})
+
+
+class EarlyTerminationTest(tf.test.TestCase):
+    def _assertSameBestHypothesis(self, config_file, length_penalty, shrink_finished_batch=False):
+        beam_size = 4
+        inference_params = {"inference.beam_size": beam_size,
+                            "inference.length_penalty": length_penalty,
+                            "inference.shrink_finished_batch": shrink_finished_batch}
+        early_inference_params = copy.deepcopy(inference_params)
+        early_inference_params["inference.early_termination"] = True
+        eos_id, (full, early) = _decode_toy_model(
+            config_file, [inference_params, early_inference_params], self.get_temp_dir())
+        self.assertAllClose(full["sorted_scores"][::beam_size],
+                            early["sorted_scores"][::beam_size], atol=1e-5)
+        self.assertEqual(_trim_hypothesis(full["sorted_hypothesis"][::beam_size], eos_id),
+                         _trim_hypothesis(early["sorted_hypothesis"][::beam_size], eos_id))
+        # the pruned beams are ranked after the finished ones
+        sorted_pruned = numpy.reshape(early["pruned"][early["sorted_argidx"]], [-1, beam_size])
+        for pruned in sorted_pruned:
+            self.assertAllEqual(numpy.sort(pruned), pruned)
+        self.assertFalse(numpy.any(sorted_pruned[:, 0]))
+        self.assertNotIn("pruned", full)
+
+    def testRNNDecoder(self):
+        self._assertSameBestHypothesis(seq2seq_config_file, length_penalty=-1.0)
+        self._assertSameBestHypothesis(seq2seq_config_file, length_penalty=0.6)
+
+    def testTransformerDecoder(self):
+        self._assertSameBestHypothesis(transformer_config_file, length_penalty=0.6)
+        self._assertSameBestHypothesis(transformer_config_file, length_penalty=0.6,
+                                       shrink_finished_batch=True)
+
+
+class GreedyDecodingTest(tf.test.TestCase):
+    def _assertDecodes(self, config_file):
+        _, (greedy,) = _decode_toy_model(
+            config_file, [{"inference.beam_size": 1}], self.get_temp_dir())
+        self.assertEqual((20,), greedy["sorted_scores"].shape)
+        self.assertEqual(20, greedy["sorted_hypothesis"].shape[0])
+
+    def testRNNDecoder(self):
+        self._assertDecodes(seq2seq_config_file)
+
+    def testTransformerDecoder(self):
+        # the self-attention cache grows from length 0 without beam stacking
+        self._assertDecodes(transformer_config_file)
+
+
+class PreallocatedCacheTest(tf.test.TestCase):
+    def _assertSameDecoding(self, inference_params=None, decoder_params=None):
+        inference_params = inference_params or {}
+        preallocated_params = copy.deepcopy(inference_params)
+        preallocated_params["decoder.params"] = {"preallocate_cache": True}
+        eos_id, (growing, preallocated) = _decode_toy_model(
+            transformer_config_file, [inference_params, preallocated_params],
+            self.get_temp_dir(), decoder_params=decoder_params)
+        self.assertAllClose(growing["sorted_scores"], preallocated["sorted_scores"], atol=1e-5)
+        self.assertEqual(_trim_hypothesis(growing["sorted_hypothesis"], eos_id),
+                         _trim_hypothesis(preallocated["sorted_hypothesis"], eos_id))
+        self.assertAllEqual(growing["decoding_length"], preallocated["decoding_length"])
+
+    def testBeamSearch(self):
+        self._assertSameDecoding({"inference.beam_size": 4})
+
+    def testGreedy(self):
+        self._assertSameDecoding({"inference.beam_size": 1})
+
+    def testShrinkFinishedBatch(self):
+        # the rows written at each timestep are compacted
+        self._assertSameDecoding({"inference.beam_size": 4,
+                                  "inference.shrink_finished_batch": True})
+
+    def testBeamSharedMemory(self):
+        self._assertSameDecoding({"inference.beam_size": 4,
+                                  "inference.shrink_finished_batch": True},
+                                 decoder_params={"beam_shared_memory": True})
+
+
+class ShortlistTest(tf.test.TestCase):
+    def testDecodeWithShortlist(self):
+        output_dir = self.get_temp_dir()
+        vocab_source = Vocab(vocab_src_file)
+        vocab_target = Vocab(_make_small_vocab(vocab_trg_file, 6, output_dir))
+        shortlist_file = os.path.join(output_dir, "shortlist")
+        save_lexical_shortlist(
+            build_lexical_shortlist(train_src_file, train_trg_file,
+                                    vocab_source, vocab_target, num_candidates=2),
+            shortlist_file, vocab_source, vocab_target)
+        with tf.Graph().as_default():
+            tf.set_random_seed(1234)
+            eos_id, (prediction_op,), feed_dict = _build_toy_model(
+                transformer_config_file,
+                [{"inference.beam_size": 4,
+                  "inference.shortlist_file": shortlist_file,
+                  "inference.shortlist_num_candidates": 2,
+                  "inference.shortlist_num_frequent_words": 1}],
+                output_dir)
+            init_feed = dict(tf.get_collection(Constants.LOCAL_INIT_FEED_COLLECTION_NAME))
+            self.assertEqual(1, len(init_feed))
+            candidates = list(init_feed.values())[0]
+            self.assertEqual((vocab_source.vocab_size, 2), candidates.shape)
+            # the candidates table is not serialized into the graph
+            const_shapes = [[d.size for d in node.attr["value"].tensor.tensor_shape.dim]
+                            for node in tf.get_default_graph().as_graph_def().node
+                            if node.op == "Const"]
+            self.assertNotIn(list(candidates.shape), const_shapes)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                sess.run(tf.local_variables_initializer(), feed_dict=init_feed)
+                prediction = sess.run(prediction_op, feed_dict=feed_dict)
+        fp = open_file(train_src_file)
+        feature_ids = sum([vocab_source.convert_to_idlist(fp.readline().strip())
+                           for _ in range(20)], [])
+        close_file(fp)
+        allowed_ids = set(candidates[feature_ids].flatten().tolist()) | {eos_id}
+        for hypo in _trim_hypothesis(prediction["sorted_hypothesis"], eos_id):
+            self.assertTrue(set(hypo) <= allowed_ids)
+
+
+class PreallocatedCacheBenchmark(tf.test.Benchmark):
+    def benchmarkPreallocatedCache(self):
+        output_dir = tempfile.mkdtemp()
+        for beam_size in [4, 10]:
+            for preallocate_cache in [False, True]:
+                with tf.Graph().as_default():
+                    _, (prediction_op,), feed_dict = _build_toy_model(
+                        transformer_config_file,
+                        [{"inference.beam_size": beam_size,
+                          "decoder.params": {"preallocate_cache": preallocate_cache}}],
+                        output_dir, num_sentences=32)
+                    with tf.Session() as sess:
+                        sess.run(tf.global_variables_initializer())
+                        sess.run(prediction_op, feed_dict=feed_dict)  # warm up
+                        num_iters = 10
+                        num_steps = 0
+                        start_time = time.time()
+                        for _ in range(num_iters):
+                            num_steps += sess.run(prediction_op, feed_dict=feed_dict)[
+                                "decoding_length"].max()
+                        wall_time = (time.time() - start_time) / num_iters
+                        _, memory_stats = run_with_memory_stats(
+                            sess, prediction_op, feed_dict=feed_dict)
+                extras = {"step_time": wall_time * num_iters / num_steps}
+                extras.update(memory_stats)
+                self.report_benchmark(
+                    name="transformer_decoding_{}_beam{}".format(
+                        "preallocated" if preallocate_cache else "growing", beam_size),
+                    iters=num_iters, wall_time=wall_time, extras=extras)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+from njunmt.utils.feedback import BeamFeedback
+from njunmt.utils.feedback import GreedyFeedback
+
+vocab_trg_file = "testdata/vocab.en"
+
+
+def _random_step_inputs(batch_size, vocab_size, seed=1234):
+    """ Returns random logits, accumulated log probs, finished flags and lengths. """
+    rand = numpy.random.RandomState(seed)
+    logits = rand.randn(batch_size, vocab_size).astype(numpy.float32) * 3.
+    log_probs = -rand.rand(batch_size).astype(numpy.float32) * 5.
+    finished = rand.rand(batch_size) < 0.3
+    lengths = rand.randint(1, 10, size=[batch_size]).astype(numpy.int32)
+    return logits, log_probs, finished, lengths
+
+
+class GreedyFeedbackTest(tf.test.TestCase):
+    def testSameAsBeamSizeOne(self):
+        vocab = Vocab(vocab_trg_file)
+        batch_size = 16
+        logits, log_probs, finished, lengths = _random_step_inputs(batch_size, vocab.vocab_size)
+        greedy = GreedyFeedback(vocab, maximum_labels_length=20, batch_size=batch_size)
+        beam = BeamFeedback(vocab, maximum_labels_length=20, batch_size=batch_size,
+                            beam_size=1, alpha=0.6)
+        with self.test_session() as sess:
+            greedy_out, beam_out = sess.run(
+                [greedy.sample_symbols(logits, log_probs, finished, lengths, time=3),
+                 beam.sample_symbols(logits, log_probs, finished, lengths, time=3)])
+        self.assertAllEqual(beam_out[0], greedy_out[0])
+        self.assertAllEqual(numpy.arange(batch_size), greedy_out[1])
+        self.assertAllClose(beam_out[2], greedy_out[2], atol=1e-4)
+        self.assertAllEqual(beam_out[3], greedy_out[3])
+        self.assertAllEqual(numpy.where(finished, vocab.eos_id, greedy_out[0]), greedy_out[0])
+
+
+class BeamFeedbackTest(tf.test.TestCase):
+    def testTerminateHopelessBeams(self):
+        vocab = Vocab(vocab_trg_file)
+        beam = BeamFeedback(vocab, maximum_labels_length=20, batch_size=3,
+                            beam_size=2, alpha=None)
+        # sentence 0: the alive beam is bounded by -30 / 20 < -2 / 2
+        # sentence 1: the alive beam is bounded by -3 / 20 > -10 / 2
+        # sentence 2: the pruned beam is not in the finished set
+        log_probs = numpy.array([-2., -30., -10., -3., -1., -3.], dtype=numpy.float32)
+        finished = numpy.array([True, False, True, False, True, False])
+        lengths = numpy.array([2, 5, 2, 5, 3, 5], dtype=numpy.int32)
+        pruned = numpy.array([False, False, False, False, True, False])
+        with self.test_session() as sess:
+            next_finished, next_pruned = sess.run(beam.terminate_hopeless_beams(
+                log_probs, finished, lengths, pruned))
+        self.assertAllEqual([True, True, True, False, True, False], next_finished)
+        self.assertAllEqual([False, True, False, False, True, False], next_pruned)
+
+
+class GreedyFeedbackBenchmark(tf.test.Benchmark):
+    def benchmarkSampleSymbols(self):
+        vocab = Vocab(vocab_trg_file)
+        batch_size = 32
+        logits, log_probs, finished, lengths = _random_step_inputs(batch_size, vocab.vocab_size)
+        with tf.Session() as sess:
+            for name, helper in [
+                ("beam1", BeamFeedback(vocab, maximum_labels_length=20, batch_size=batch_size,
+                                       beam_size=1, alpha=0.6)),
+                ("greedy", GreedyFeedback(vocab, maximum_labels_length=20, batch_size=batch_size))]:
+                sample_op = helper.sample_symbols(logits, log_probs, finished, lengths, time=3)
+                sess.run(sample_op)  # warm up
+                num_iters = 100
+                start_time = time.time()
+                for _ in range(num_iters):
+                    sess.run(sample_op)
+                self.report_benchmark(
+                    name="{}_batch{}".format(name, batch_size),
+                    iters=num_iters, wall_time=(time.time() - start_time) / num_iters)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import io
+import os
+import subprocess
+import sys
+
+import tensorflow as tf
+
+# lines with multi-byte characters and tokens of the same frequency
+_LINES = [u"的 中国 。 The cat", u"中国 的 发展 , 很 快 。", u"", u"the Cat 的 的",
+          u"发展 中国 ; 快 快 很", u"ünïcödé 中国 the"] * 7
+
+
+def _baseline_vocab(lines, delimiter=" ", max_vocab_size=None):
+    """ Counts the lines serially as the original script does. """
+    if sys.version_info[0] < 3:
+        # Python 2 reads and counts raw bytes
+        lines = [line.encode("utf-8") for line in lines]
+    cnt = collections.Counter()
+    for line in lines:
+        tokens = list(line.strip()) if delimiter == "" else line.strip().split(delimiter)
+        cnt.update([_ for _ in tokens if len(_) > 0])
+    word_with_counts = sorted(cnt.most_common(), key=lambda x: (x[1], x[0]), reverse=True)
+    if max_vocab_size is not None:
+        word_with_counts = word_with_counts[:max_vocab_size]
+    output = "".join("{}\t{}\n".format(w, c) for w, c in word_with_counts)
+    return output if isinstance(output, bytes) else output.encode("utf-8")
+
+
+def _generate_vocab(args, stdin=None):
+    """ Runs bin.generate_vocab and returns the output bytes. """
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    process = subprocess.Popen([sys.executable, "-m", "bin.generate_vocab"] + args,
+                               stdin=subprocess.PIPE if stdin is not None else None,
+                               stdout=subprocess.PIPE, env=env)
+    output, _ = process.communicate(stdin)
+    if process.returncode != 0:
+        raise RuntimeError("bin.generate_vocab exits with {}".format(process.returncode))
+    return output
+
+
+class GenerateVocabTest(tf.test.TestCase):
+    def setUp(self):
+        self._filename = os.path.join(self.get_temp_dir(), "vocab_input.txt")
+        with io.open(self._filename, "w", encoding="utf-8") as fw:
+            fw.write(u"".join(line + u"\n" for line in _LINES))
+        with open(self._filename, "rb") as fp:
+            self._content = fp.read()
+
+    def _assertBoundaryInsideLine(self, num_processes):
+        size = len(self._content)
+        bounds = [size * i // num_processes for i in range(1, num_processes)]
+        # a byte range starts in the middle of a line and of a multi-byte character
+        self.assertTrue(any(self._content[b - 1:b] != b"\n" for b in bounds))
+        self.assertTrue(any(bytearray(self._content[b:b + 1])[0] & 0xC0 == 0x80 for b in bounds))
+
+    def testSameAsBaseline(self):
+        for delimiter, max_vocab_size in [(" ", None), (" ", 5), ("", None), ("", 4)]:
+            expected = _baseline_vocab(_LINES, delimiter, max_vocab_size)
+            args = ["--delimiter", delimiter]
+            if max_vocab_size is not None:
+                args += ["--max_vocab_size", str(max_vocab_size)]
+            self.assertEqual(expected, _generate_vocab(args, stdin=self._content))
+            for num_processes in [1, 5]:
+                if num_processes > 1:
+                    self._assertBoundaryInsideLine(num_processes)
+                self.assertEqual(expected, _generate_vocab(
+                    args + [self._filename, "--num_processes", str(num_processes)]))
+
+    def testMultipleFiles(self):
+        expected = _baseline_vocab(_LINES + _LINES)
+        self.assertEqual(expected, _generate_vocab(
+            [self._filename, self._filename, "--num_processes", "3"]))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy
+import tensorflow as tf
+
+from njunmt.data.dataset import Dataset
+from njunmt.data.text_inputter import TextLineInputter
+from njunmt.data.vocab import Vocab
+from njunmt.inference.decode import infer
+from njunmt.utils.constants import Constants
+from njunmt.utils.misc import open_file, close_file
+
+vocab_src_file = "testdata/vocab.zh"
+infer_src_file = "testdata/toy.zh"
+
+# the feeding data is keyed by these names instead of placeholders
+_INPUT_FIELDS = [{name: name for name in [Constants.FEATURE_IDS_NAME,
+                                          Constants.FEATURE_LENGTH_NAME]}]
+# the prediction op is keyed by names instead of tensors
+_PREDICTION_OP = [{"sorted_hypothesis": "sorted_hypothesis",
+                   "sorted_scores": "sorted_scores"}]
+
+
+class _CopyingSession(object):
+    """ A stub of `tf.Session` for the prediction op of one model, which
+    "translates" each source sentence into itself with `beam_size`
+    hypotheses, scored by the negative hypothesis rank. """
+
+    def __init__(self, eos_id, beam_size=1, fail_at_run=None):
+        self._eos_id = eos_id
+        self._beam_size = beam_size
+        self._fail_at_run = fail_at_run
+        self._num_runs = 0
+
+    def run(self, fetches, feed_dict):
+        self._num_runs += 1
+        if self._num_runs == self._fail_at_run:
+            raise RuntimeError("session failed")
+        feature_ids = feed_dict[Constants.FEATURE_IDS_NAME]
+        feature_length = feed_dict[Constants.FEATURE_LENGTH_NAME]
+        hypothesis = numpy.full([feature_ids.shape[0], feature_ids.shape[1] + 1],
+                                self._eos_id, dtype=numpy.int32)
+        for idx, length in enumerate(feature_length):
+            hypothesis[idx, :length] = feature_ids[idx, :length]
+        results = {"sorted_hypothesis": numpy.repeat(hypothesis, self._beam_size, axis=0),
+                   "sorted_scores": numpy.tile(-numpy.arange(self._beam_size, dtype=numpy.float32),
+                                               feature_ids.shape[0])}
+        return dict((k, [results[v] for v in fetch]) for k, fetch in fetches.items())
+
+
+def _read_lines(filename):
+    fp = open_file(filename)
+    lines = [line.strip() for line in fp]
+    close_file(fp)
+    return lines
+
+
+class InferTest(tf.test.TestCase):
+    def _infer(self, output, sort_by_length=False, **kwargs):
+        vocab_source = Vocab(vocab_src_file)
+        dataset = Dataset(vocab_source, vocab_source, eval_features_file=infer_src_file)
+        inputter = TextLineInputter(
+            dataset, "eval_features_file", batch_size=13, batch_tokens_size=200,
+            sort_by_length=sort_by_length, sort_window_size=kwargs.pop("sort_window_size", None))
+        sess = _CopyingSession(vocab_source.eos_id, kwargs.pop("beam_size", 1),
+                               fail_at_run=kwargs.pop("fail_at_run", None))
+        return infer(sess=sess,
+                     prediction_op=_PREDICTION_OP,
+                     infer_data=inputter.make_feeding_data(_INPUT_FIELDS),
+                     output=output, vocab_source=vocab_source, vocab_target=vocab_source,
+                     verbose=False, **kwargs)
+
+    def testSortByLengthKeepsLineOrder(self):
+        vocab_source = Vocab(vocab_src_file)
+        expected = [" ".join(vocab_source.convert_to_wordlist(vocab_source.convert_to_idlist(line)))
+                    for line in _read_lines(infer_src_file)]
+        for sort_window_size in [None, 100]:
+            output = os.path.join(self.get_temp_dir(), "sorted.trans")
+            _, hypothesis = self._infer(output, sort_by_length=True,
+                                        sort_window_size=sort_window_size)
+            self.assertEqual(expected, hypothesis)
+            self.assertEqual(expected, _read_lines(output))
+
+    def testPipelinedSameAsSequential(self):
+        for n_best in [0, 3]:
+            outputs = []
+            for pipelined in [False, True]:
+                output = os.path.join(self.get_temp_dir(), "pipelined{}.trans".format(pipelined))
+                results = self._infer(output, sort_by_length=True, sort_window_size=100,
+                                      beam_size=4, n_best=n_best, pipelined=pipelined)
+                outputs.append((results, _read_lines(output),
+                                _read_lines(output + ".nbest") if n_best > 0 else None))
+            self.assertEqual(outputs[0], outputs[1])
+            if n_best > 0:
+                self.assertEqual(n_best * len(outputs[0][1]), len(outputs[0][2]))
+
+    def testOutputClosedOnError(self):
+        vocab_source = Vocab(vocab_src_file)
+        expected = [" ".join(vocab_source.convert_to_wordlist(vocab_source.convert_to_idlist(line)))
+                    for line in _read_lines(infer_src_file)]
+        for pipelined in [False, True]:
+            output = os.path.join(self.get_temp_dir(), "failed.trans")
+            lines = None
+            try:
+                self._infer(output, pipelined=pipelined, fail_at_run=4)
+            except RuntimeError:
+                # the lines of the finished batches are flushed, even though
+                #   the traceback still refers to the files
+                lines = _read_lines(output)
+            self.assertGreater(len(lines), 0)
+            self.assertEqual(expected[:len(lines)], lines)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,50 @@
+# Copyright 2017 Natural Language Processing Group, Nanjing University, zhaocq.nlp@gmail.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Define functions for measuring memory in benchmarks. """
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+def run_with_memory_stats(sess, fetches, feed_dict=None):
+    """ Runs `fetches` with full tracing and collects the allocator
+    statistics of the run.
+
+    Args:
+        sess: A `tf.Session`.
+        fetches: The fetches passed to `sess.run()`.
+        feed_dict: The feed dict passed to `sess.run()`.
+
+    Returns: A tuple `(results, memory_stats)`, where `memory_stats` is a dict
+      of "allocated_bytes", the total bytes allocated by the operations, and
+      "peak_bytes", the sum of the peak bytes in use of each allocator (only
+      measured by allocators collecting statistics, e.g. the GPU allocator).
+    """
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    run_metadata = tf.RunMetadata()
+    results = sess.run(fetches, feed_dict=feed_dict,
+                       options=run_options, run_metadata=run_metadata)
+    allocated_bytes = 0
+    peak_bytes = {}
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                allocated_bytes += memory.total_bytes
+                peak_bytes[memory.allocator_name] = max(
+                    peak_bytes.get(memory.allocator_name, 0),
+                    memory.allocator_bytes_in_use)
+    return results, {"allocated_bytes": allocated_bytes,
+                     "peak_bytes": sum(peak_bytes.values())}
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from njunmt.data.dataset import Dataset
+from njunmt.data.text_inputter import MultiprocessingEncoder
+from njunmt.data.text_inputter import ParallelTextInputter
+from njunmt.data.text_inputter import TextLineInputter
+from njunmt.data.vocab import Vocab
+from njunmt.utils.constants import Constants
+from njunmt.utils.misc import open_file, close_file
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+train_src_file = "testdata/toy.zh"
+train_trg_file = "testdata/toy.en0"
+
+# the feeding data is keyed by these names instead of placeholders
+_INPUT_FIELDS = [{name: name for name in [Constants.FEATURE_IDS_NAME,
+                                          Constants.FEATURE_LENGTH_NAME,
+                                          Constants.LABEL_IDS_NAME,
+                                          Constants.LABEL_LENGTH_NAME]}]
+
+
+def _read_epoch(num_processes):
+    """ Reads one epoch of the toy corpus with a `ParallelTextInputter`. """
+    vocab_src = Vocab(vocab_src_file)
+    vocab_trg = Vocab(vocab_trg_file)
+    dataset = Dataset(vocab_src, vocab_trg,
+                      train_features_file=train_src_file,
+                      train_labels_file=train_trg_file)
+    inputter = ParallelTextInputter(
+        dataset, "train_features_file", "train_labels_file",
+        batch_size=7, num_processes=num_processes)
+    # several buffer refills in one epoch
+    inputter._cache_size = 50
+    batches = []
+    try:
+        for data in inputter.make_feeding_data(
+                _INPUT_FIELDS, maximum_features_length=30, maximum_labels_length=30):
+            batches.append(data["feed_dict"])
+    finally:
+        inputter.close()
+    return batches
+
+
+def _read_lines(num_processes):
+    """ Reads the source side of the toy corpus with a `TextLineInputter`. """
+    vocab_src = Vocab(vocab_src_file)
+    vocab_trg = Vocab(vocab_trg_file)
+    dataset = Dataset(vocab_src, vocab_trg, eval_features_file=train_src_file)
+    inputter = TextLineInputter(
+        dataset, "eval_features_file", batch_size=7, num_processes=num_processes,
+        sort_by_length=True, sort_window_size=100)
+    return [(data["line_ids"], data[Constants.FEATURE_IDS_NAME])
+            for data in inputter.make_feeding_data(_INPUT_FIELDS)]
+
+
+class MultiprocessingEncoderTest(tf.test.TestCase):
+    def testSameAsSerialEncoding(self):
+        vocab_src = Vocab(vocab_src_file)
+        vocab_trg = Vocab(vocab_trg_file)
+        fp_src = open_file(train_src_file)
+        fp_trg = open_file(train_trg_file)
+        src_lines = [line.strip() for line in fp_src]
+        trg_lines = [line.strip() for line in fp_trg]
+        close_file(fp_src)
+        close_file(fp_trg)
+        encoder = MultiprocessingEncoder([vocab_src, vocab_trg], num_processes=3)
+        try:
+            self.assertEqual([vocab_src.convert_to_idlist(line) for line in src_lines],
+                             encoder.encode(src_lines, 0))
+            self.assertEqual([vocab_trg.convert_to_idlist(line) for line in trg_lines],
+                             encoder.encode(trg_lines, 1))
+            self.assertEqual([], encoder.encode([], 0))
+        finally:
+            encoder.close()
+
+    def testPooledInputterSameAsSerial(self):
+        serial_batches = _read_epoch(num_processes=1)
+        pooled_batches = _read_epoch(num_processes=2)
+        self.assertGreater(len(serial_batches), 1)
+        self.assertEqual(len(serial_batches), len(pooled_batches))
+        for serial, pooled in zip(serial_batches, pooled_batches):
+            self.assertEqual(sorted(serial.keys()), sorted(pooled.keys()))
+            for name in _INPUT_FIELDS[0]:
+                self.assertAllEqual(serial[name], pooled[name])
+
+    def testPooledTextLineInputterSameAsSerial(self):
+        # the pool is closed once the generator is exhausted
+        self.assertEqual(_read_lines(num_processes=1), _read_lines(num_processes=2))
+
+
+if __name__ == "__main__":
+    tf.test.main()
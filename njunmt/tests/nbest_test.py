@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from njunmt.data.vocab import Vocab
+from njunmt.ensemble_experiment import EnsembleExperiment
+from njunmt.inference.decode import _format_nbest
+from njunmt.nmt_experiment import InferExperiment
+
+vocab_trg_file = "testdata/vocab.en"
+
+
+class NBestTest(tf.test.TestCase):
+    def testFormatNBest(self):
+        vocab = Vocab(vocab_trg_file)
+        # two hypotheses for each of line 7 and line 3, with paddings after EOS
+        prediction = [vocab.convert_to_idlist("the of") + [vocab.eos_id],
+                      vocab.convert_to_idlist("a") + [vocab.eos_id] * 2,
+                      vocab.convert_to_idlist("in that ."),
+                      [vocab.eos_id] * 4]
+        scores = [-0.25, -1.5, -0.125, -3.0]
+        self.assertEqual(["7 ||| the of ||| -0.250000\n"
+                          "7 ||| a ||| -1.500000\n",
+                          "3 ||| in that . ||| -0.125000\n"
+                          "3 |||  ||| -3.000000\n"],
+                         _format_nbest([7, 3], prediction, scores, 2, vocab,
+                                       delimiter=" ", tokenize_output=False))
+
+    def testNBestLargerThanBeamSize(self):
+        def _configs(beam_size, n_best):
+            return {"infer": {"beam_size": beam_size, "n_best": n_best}, "infer_data": []}
+
+        for experiment_fn in [InferExperiment,
+                              lambda configs: EnsembleExperiment(configs, model_dirs=[])]:
+            with self.assertRaises(ValueError):
+                experiment_fn(_configs(beam_size=4, n_best=5))
+            # a single hypothesis with greedy decoding
+            with self.assertRaises(ValueError):
+                experiment_fn(_configs(beam_size=1, n_best=2))
+            experiment_fn(_configs(beam_size=1, n_best=1))
+            experiment_fn(_configs(beam_size=4, n_best=4))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from njunmt.data.text_inputter import PrefetchingIterator
+
+
+class _EpochIterator(object):
+    """ Yields 0..num_samples-1 and raises StopIteration at the end of each epoch. """
+
+    def __init__(self, num_samples):
+        self._num_samples = num_samples
+        self._idx = 0
+
+    def next(self):
+        if self._idx == self._num_samples:
+            self._idx = 0
+            raise StopIteration
+        self._idx += 1
+        return self._idx - 1
+
+
+class _ErrorIterator(object):
+    def next(self):
+        raise KeyError("error in producer")
+
+
+class PrefetchingIteratorTest(tf.test.TestCase):
+    def testEpochs(self):
+        data = PrefetchingIterator(_EpochIterator(7), prefetch_depth=3)
+        for _ in range(3):
+            outputs = []
+            try:
+                while True:
+                    outputs.append(data.next())
+            except StopIteration:
+                pass
+            self.assertAllEqual(list(range(7)), outputs)
+        _, num_batches, _ = data.pop_statistics()
+        self.assertEqual(21, num_batches)
+        data.stop()
+
+    def testProducerError(self):
+        data = PrefetchingIterator(_ErrorIterator(), prefetch_depth=3)
+        with self.assertRaises(KeyError):
+            data.next()
+        # raises again instead of blocking forever
+        with self.assertRaises(KeyError):
+            data.next()
+        data.stop()
+
+
+if __name__ == "__main__":
+    tf.test.main()
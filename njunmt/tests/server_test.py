@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+import tensorflow as tf
+from six.moves import urllib
+
+from njunmt.data.vocab import Vocab
+from njunmt.inference import server
+from njunmt.inference.server import TranslationServer
+from njunmt.inference.server import make_http_server
+from njunmt.utils.constants import Constants
+
+vocab_src_file = "testdata/vocab.zh"
+
+# the feeding data is keyed by these names instead of placeholders
+_INPUT_FIELDS = [{name: name for name in [Constants.FEATURE_IDS_NAME,
+                                          Constants.FEATURE_LENGTH_NAME]}]
+
+
+class _FakeInfer(object):
+    """ A stub of `infer()`, which "translates" each source sentence into
+    itself and records the decoded batches. """
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def __call__(self, sess, prediction_op, infer_data, output,
+                 vocab_source, vocab_target, **kwargs):
+        feature_ids = infer_data[0][Constants.FEATURE_IDS_NAME]
+        self.batches.append(feature_ids)
+        if self.fail:
+            raise RuntimeError("session failed")
+        hypothesis = [" ".join(vocab_target.convert_to_wordlist(ids)) for ids in feature_ids]
+        return hypothesis, hypothesis
+
+
+class TranslationServerTest(tf.test.TestCase):
+    def setUp(self):
+        self._infer = server.infer
+        self._fake_infer = _FakeInfer()
+        server.infer = self._fake_infer
+        self._vocab = Vocab(vocab_src_file)
+        self._servers = []
+
+    def tearDown(self):
+        for translation_server in self._servers:
+            translation_server.stop()
+        server.infer = self._infer
+
+    def _make_server(self, batch_size, max_wait_time, batch_tokens_size=None):
+        translation_server = TranslationServer(
+            sess=None, prediction_op=None, input_fields=_INPUT_FIELDS,
+            vocab_source=self._vocab, vocab_target=self._vocab,
+            batch_size=batch_size, batch_tokens_size=batch_tokens_size,
+            max_wait_time=max_wait_time)
+        self._servers.append(translation_server)
+        return translation_server
+
+    def _translate_concurrently(self, translation_server, lines_list):
+        requests = [None] * len(lines_list)
+
+        def _translate(idx):
+            requests[idx] = translation_server.translate(lines_list[idx])
+
+        threads = [threading.Thread(target=_translate, args=(idx,))
+                   for idx in range(len(lines_list))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return requests
+
+    def testWaitForPendingDeadline(self):
+        # a single sentence never fills the batch, so it waits until the deadline
+        translation_server = self._make_server(batch_size=100, max_wait_time=0.2)
+        request = translation_server.translate(["的 。"])
+        self.assertEqual(["的 。"], request.hypothesis)
+        self.assertGreaterEqual(request.finish_time - request.arrival_time, 0.19)
+        self.assertEqual(1, len(self._fake_infer.batches))
+
+    def testWaitForPendingFullBatch(self):
+        # a full batch is decoded without waiting for the deadline
+        translation_server = self._make_server(batch_size=2, max_wait_time=60.)
+        start_time = time.time()
+        request = translation_server.translate(["的", "在 和"])
+        self.assertLess(time.time() - start_time, 30.)
+        self.assertEqual(["的", "在 和"], request.hypothesis)
+        self.assertEqual(1, len(self._fake_infer.batches))
+        # so is a batch full of tokens
+        translation_server = self._make_server(batch_size=100, max_wait_time=60.,
+                                               batch_tokens_size=3)
+        start_time = time.time()
+        request = translation_server.translate(["的 在 和"])
+        self.assertLess(time.time() - start_time, 30.)
+        self.assertEqual(["的 在 和"], request.hypothesis)
+
+    def testWaitForPendingCoalescesRequests(self):
+        translation_server = self._make_server(batch_size=100, max_wait_time=1.)
+        requests = self._translate_concurrently(
+            translation_server, [["的"], ["在 和", "。"], ["和 的 。"]])
+        self.assertEqual([["的"], ["在 和", "。"], ["和 的 。"]],
+                         [request.hypothesis for request in requests])
+        self.assertEqual(1, len(self._fake_infer.batches))
+        # sorted by length (with EOS)
+        self.assertEqual([4, 3, 2, 2], [len(ids) for ids in self._fake_infer.batches[0]])
+
+    def testDecodingLoop(self):
+        # the pending sentences are split into batches of at most 2 sentences,
+        #   and the hypothesis are filled back to their requests
+        translation_server = self._make_server(batch_size=2, max_wait_time=1.)
+        requests = self._translate_concurrently(
+            translation_server, [["的"], ["在 和 的", "。"], ["和 的"]])
+        self.assertEqual([["的"], ["在 和 的", "。"], ["和 的"]],
+                         [request.hypothesis for request in requests])
+        self.assertTrue(all(len(batch) <= 2 for batch in self._fake_infer.batches))
+        self.assertEqual(4, sum(len(batch) for batch in self._fake_infer.batches))
+        for request in requests:
+            self.assertIsNone(request.error)
+            self.assertGreaterEqual(request.queueing_time, 0.)
+            self.assertGreaterEqual(request.decoding_time, 0.)
+
+    def testDecodingLoopFailure(self):
+        translation_server = self._make_server(batch_size=100, max_wait_time=0.)
+        self._fake_infer.fail = True
+        request = translation_server.translate(["的", "在"])
+        self.assertEqual("session failed", request.error)
+        # the decoding thread keeps serving
+        self._fake_infer.fail = False
+        request = translation_server.translate(["和"])
+        self.assertIsNone(request.error)
+        self.assertEqual(["和"], request.hypothesis)
+
+    def testEmptyRequest(self):
+        translation_server = self._make_server(batch_size=2, max_wait_time=60.)
+        request = translation_server.translate([])
+        self.assertEqual([], request.hypothesis)
+        self.assertEqual(0, len(self._fake_infer.batches))
+
+
+class HTTPServerTest(tf.test.TestCase):
+    def setUp(self):
+        self._infer = server.infer
+        server.infer = _FakeInfer()
+        vocab = Vocab(vocab_src_file)
+        self._translation_server = TranslationServer(
+            sess=None, prediction_op=None, input_fields=_INPUT_FIELDS,
+            vocab_source=vocab, vocab_target=vocab, batch_size=10, max_wait_time=0.)
+        self._http_server = make_http_server(self._translation_server, "localhost", 0)
+        self._thread = threading.Thread(target=self._http_server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def tearDown(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._translation_server.stop()
+        server.infer = self._infer
+
+    def _post(self, path, body):
+        request = urllib.request.Request(
+            "http://localhost:{}{}".format(self._http_server.server_address[1], path),
+            data=body.encode("utf-8"), headers={"Content-Type": "application/json"})
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            response = e
+        return response.getcode(), json.loads(response.read().decode("utf-8"))
+
+    def testTranslate(self):
+        code, result = self._post("/translate", json.dumps({"sentences": ["的 。", "和"]}))
+        self.assertEqual(200, code)
+        self.assertEqual(["的 。", "和"], result["translations"])
+
+    def testBadRequest(self):
+        for body in ["not json",
+                     json.dumps({"sentence": ["的"]}),
+                     json.dumps({"sentences": "的"}),
+                     json.dumps({"sentences": ["的", 1]}),
+                     json.dumps({"sentences": [["的"]]}),
+                     json.dumps({"sentences": [None]})]:
+            code, result = self._post("/translate", body)
+            self.assertEqual(400, code)
+            self.assertIn("error", result)
+        code, _ = self._post("/unknown", json.dumps({"sentences": ["的"]}))
+        self.assertEqual(404, code)
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from njunmt.inference.sharding import merge_shard_nbest
+from njunmt.inference.sharding import merge_shard_outputs
+from njunmt.inference.sharding import split_into_shards
+from njunmt.nmt_experiment import InferExperiment
+from njunmt.utils.misc import open_file
+
+features_file = "testdata/toy.zh"
+
+
+class ShardingTest(tf.test.TestCase):
+    def testSplitAndMerge(self):
+        with open_file(features_file) as fp:
+            lines = fp.readlines()
+        shards = split_into_shards(features_file, 3, os.path.join(self.get_temp_dir(), "shard"))
+        self.assertEqual(3, len(shards))
+        self.assertEqual(0, shards[0][1])
+        shard_outputs = []
+        for shard_filename, start_line in shards:
+            with open_file(shard_filename) as fp:
+                shard_lines = fp.readlines()
+            self.assertEqual(lines[start_line:start_line + len(shard_lines)], shard_lines)
+            # the shard "translations" are the source lines
+            shard_outputs.append(shard_filename)
+            with open_file(shard_filename + ".nbest", mode="w") as fw:
+                for idx, line in enumerate(shard_lines):
+                    fw.write(u"{} ||| {} ||| 0.0\n".format(idx, line.strip()))
+        output = os.path.join(self.get_temp_dir(), "merged")
+        merge_shard_outputs(shard_outputs, output)
+        merge_shard_nbest(shard_outputs, [start_line for _, start_line in shards], output)
+        with open_file(output) as fp:
+            self.assertEqual(lines, fp.readlines())
+        with open_file(output + ".nbest") as fp:
+            nbest = [line.split(" ||| ") for line in fp]
+        self.assertEqual(list(range(len(lines))), [int(item[0]) for item in nbest])
+        self.assertEqual([line.strip() for line in lines], [item[1] for item in nbest])
+
+    def testSplitIntoFewerShards(self):
+        filename = os.path.join(self.get_temp_dir(), "two_lines")
+        with open_file(filename, mode="w") as fw:
+            # the last line has no line break
+            fw.write(u"a b\nc")
+        shards = split_into_shards(filename, 3, os.path.join(self.get_temp_dir(), "short"))
+        self.assertEqual([0, 1], [start_line for _, start_line in shards])
+        shard_lines = []
+        for shard_filename, _ in shards:
+            with open_file(shard_filename) as fp:
+                shard_lines.append(fp.read())
+        self.assertEqual([u"a b\n", u"c"], shard_lines)
+
+    def testResumeWithShards(self):
+        def _configs(num_shards, resume):
+            return {"infer": {"num_shards": num_shards, "resume": resume}, "infer_data": []}
+
+        with self.assertRaises(ValueError):
+            InferExperiment(_configs(num_shards=2, resume=True))
+        InferExperiment(_configs(num_shards=1, resume=True))
+        InferExperiment(_configs(num_shards=2, resume=False))
+
+
+if __name__ == "__main__":
+    tf.test.main()
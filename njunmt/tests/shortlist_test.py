@@ -0,0 +1,40 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from njunmt.data.shortlist import build_lexical_shortlist
+from njunmt.data.shortlist import load_lexical_shortlist
+from njunmt.data.shortlist import save_lexical_shortlist
+from njunmt.data.vocab import Vocab
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+train_src_file = "testdata/toy.zh"
+train_trg_file = "testdata/toy.en0"
+
+
+class ShortlistTest(tf.test.TestCase):
+    def testBuildAndLoad(self):
+        vocab_src = Vocab(vocab_src_file)
+        vocab_trg = Vocab(vocab_trg_file)
+        shortlist = build_lexical_shortlist(
+            train_src_file, train_trg_file,
+            vocab_src, vocab_trg, num_candidates=5)
+        filename = os.path.join(self.get_temp_dir(), "shortlist")
+        save_lexical_shortlist(shortlist, filename, vocab_src, vocab_trg)
+        candidates, frequent_ids = load_lexical_shortlist(
+            filename, vocab_src, vocab_trg,
+            num_candidates=3, num_frequent_words=10)
+        self.assertEqual((vocab_src.vocab_size, 3), candidates.shape)
+        for s, ids in shortlist.items():
+            self.assertAllEqual(ids[:3], candidates[s, :len(ids[:3])])
+        self.assertEqual(vocab_trg.eos_id, frequent_ids[0])
+        self.assertEqual(13, len(frequent_ids))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from njunmt.tools.shuffle import build_line_offsets
+from njunmt.tools.shuffle import shuffle_data
+
+features_file = "testdata/toy.zh"
+labels_file = "testdata/toy.en0"
+
+
+class ShuffleTest(tf.test.TestCase):
+    def testBuildLineOffsets(self):
+        with open(features_file, "rb") as fp:
+            lines = fp.readlines()
+        offsets = build_line_offsets(features_file)
+        self.assertEqual(len(lines) + 1, offsets.shape[0])
+        self.assertEqual(os.path.getsize(features_file), offsets[-1])
+        self.assertEqual(len(lines[0]), offsets[1])
+
+    def testShuffleIsPermutation(self):
+        to_features_file = os.path.join(self.get_temp_dir(), "toy.zh.shuf")
+        to_labels_file = os.path.join(self.get_temp_dir(), "toy.en0.shuf")
+        # small chunks to go through the chunking path
+        shuffle_data([features_file, labels_file],
+                     [to_features_file, to_labels_file], chunk_size=100)
+        pairs = []
+        for from_file, to_file in [(features_file, to_features_file),
+                                   (labels_file, to_labels_file)]:
+            with open(from_file, "rb") as fp:
+                from_lines = [line.rstrip(b"\n") for line in fp]
+            with open(to_file, "rb") as fp:
+                to_lines = [line.rstrip(b"\n") for line in fp]
+            self.assertEqual(sorted(from_lines), sorted(to_lines))
+            pairs.append((from_lines, to_lines))
+        # the parallel lines are still aligned
+        self.assertEqual(sorted(zip(pairs[0][0], pairs[1][0])),
+                         sorted(zip(pairs[0][1], pairs[1][1])))
+
+
+if __name__ == "__main__":
+    tf.test.main()
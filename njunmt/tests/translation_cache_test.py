@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import os
+
+import tensorflow as tf
+
+from njunmt.inference.translation_cache import TranslationCache
+from njunmt.inference.translation_cache import make_translation_signature
+from njunmt.nmt_experiment import InferExperiment
+
+vocab_src_file = "testdata/vocab.zh"
+vocab_trg_file = "testdata/vocab.en"
+
+
+class TranslationCacheTest(tf.test.TestCase):
+    def testLRU(self):
+        cache = TranslationCache("signature", max_size=2)
+        cache.put([1, 2], [3])
+        cache.put([4], [5])
+        self.assertEqual([3], cache.get([1, 2]))
+        cache.put([6], [7])
+        self.assertIsNone(cache.get([4]))
+        self.assertEqual([7], cache.get([6]))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def testSaveAndLoad(self):
+        filename = os.path.join(self.get_temp_dir(), "translation_cache")
+        cache = TranslationCache("signature", filename=filename)
+        cache.put([1, 2], [3])
+        cache.save()
+        self.assertEqual([3], TranslationCache("signature", filename=filename).get([1, 2]))
+        self.assertIsNone(TranslationCache("other_signature", filename=filename).get([1, 2]))
+
+    def testLoadOnlyMatchingSignature(self):
+        filename = os.path.join(self.get_temp_dir(), "translation_cache")
+        cache = TranslationCache("signature", filename=filename)
+        cache.put([1, 2], [3])
+        cache.save()
+        other_cache = TranslationCache("other_signature", filename=filename)
+        self.assertEqual(0, len(other_cache))
+        other_cache.put([4], [5])
+        # the translations of the other signature are not saved again
+        other_cache.save()
+        self.assertEqual(0, TranslationCache("signature").load(filename))
+        self.assertEqual(1, TranslationCache("other_signature").load(filename))
+
+    def testSignature(self):
+        inference_options = InferExperiment.default_inference_options()
+        inference_options["source_words_vocabulary"] = vocab_src_file
+        inference_options["target_words_vocabulary"] = vocab_trg_file
+        checkpoint_path = os.path.join(self.get_temp_dir(), "model.ckpt-100")
+        signature = make_translation_signature(checkpoint_path, inference_options)
+        self.assertEqual(signature, make_translation_signature(
+            checkpoint_path, copy.deepcopy(inference_options)))
+
+        other_vocab_file = os.path.join(self.get_temp_dir(), "vocab.other")
+        with open(vocab_trg_file) as fp, open(other_vocab_file, "w") as fw:
+            fw.write(fp.readline())
+        bpecodes_file = os.path.join(self.get_temp_dir(), "bpe.codes")
+        with open(bpecodes_file, "w") as fw:
+            fw.write("t h\n")
+        for key, value in [("target_words_vocabulary", other_vocab_file),
+                           ("target_bpecodes", {"codes": bpecodes_file}),
+                           ("source_words_vocabulary", other_vocab_file),
+                           ("source_bpecodes", {"codes": bpecodes_file}),
+                           ("beam_size", 1)]:
+            other_options = copy.deepcopy(inference_options)
+            other_options[key] = value
+            self.assertNotEqual(signature, make_translation_signature(checkpoint_path, other_options))
+        # the BPE codes are identified by content
+        other_options = copy.deepcopy(inference_options)
+        other_options["target_bpecodes"] = {"codes": bpecodes_file}
+        bpe_signature = make_translation_signature(checkpoint_path, other_options)
+        with open(bpecodes_file, "w") as fw:
+            fw.write("t h\ne r\n")
+        self.assertNotEqual(bpe_signature, make_translation_signature(checkpoint_path, other_options))
+
+
+if __name__ == "__main__":
+    tf.test.main()
@@ -13,11 +13,12 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 
 from __future__ import unicode_literals
 
+import os
 import sys
 import codecs
 import re
-import copy
 import argparse
+from multiprocessing import Pool
 from collections import defaultdict, Counter
 
 # hack for python2/3 compatibility
@@ -46,6 +47,9 @@ def create_parser():
         help='Stop if no symbol pair has frequency >= FREQ (default: %(default)s))')
     parser.add_argument('--dict-input', action="store_true",
         help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+    parser.add_argument(
+        '--num-workers', type=int, default=1, metavar='N',
+        help="Count the vocabulary of the input file in N processes (default: %(default)s))")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
@@ -65,6 +69,47 @@ def get_vocabulary(fobj, is_dict=False):
                 vocab[word] += 1
     return vocab
 
+def _get_vocabulary_of_range(args):
+    """Read lines starting in the byte range [start, end) of a file and return the vocabulary
+    """
+    filename, start, end, is_dict = args
+    vocab = Counter()
+    with open(filename, 'rb') as fobj:
+        if start > 0:
+            # the line containing byte `start - 1` belongs to the previous range
+            fobj.seek(start - 1)
+            fobj.readline()
+        while fobj.tell() < end:
+            line = fobj.readline()
+            if not line:
+                break
+            line = line.decode('utf-8')
+            if is_dict:
+                word, count = line.strip().split()
+                vocab[word] = int(count)
+            else:
+                for word in line.split():
+                    vocab[word] += 1
+    return vocab
+
+
+def get_vocabulary_parallel(filename, num_workers, is_dict=False):
+    """Read text from byte ranges of a file in parallel and return dictionary that encodes vocabulary,
+    the same as get_vocabulary()
+    """
+    size = os.path.getsize(filename)
+    bounds = [size * i // num_workers for i in range(num_workers + 1)]
+    pool = Pool(num_workers)
+    partial_vocabs = pool.map(_get_vocabulary_of_range,
+                              [(filename, bounds[i], bounds[i + 1], is_dict) for i in range(num_workers)])
+    pool.close()
+    pool.join()
+    # merging in order keeps the order of first occurrences
+    vocab = Counter()
+    for partial_vocab in partial_vocabs:
+        vocab.update(partial_vocab)
+    return vocab
+
 def update_pair_statistics(pair, changed, stats, indices):
     """Minimally update the indices and frequency of symbol pairs
 
@@ -183,20 +228,27 @@ def prune_stats(stats, big_stats, threshold):
                 big_stats[item] = freq
 
 
-def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
+def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False, num_workers=1):
     """Learn num_symbols BPE operations from vocabulary, and write to outfile.
+
+    If num_workers > 1 and infile is a regular file, the vocabulary is counted in parallel.
     """
 
     # version 0.2 changes the handling of the end-of-word token ('</w>');
     # version numbering allows bckward compatibility
     outfile.write('#version: 0.2\n')
 
-    vocab = get_vocabulary(infile, is_dict)
+    filename = getattr(infile, 'name', None)
+    if num_workers > 1 and isinstance(filename, str) and os.path.isfile(filename):
+        vocab = get_vocabulary_parallel(filename, num_workers, is_dict)
+    else:
+        vocab = get_vocabulary(infile, is_dict)
     vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
     stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
+    # keys are tuples and values are integers, a shallow copy is enough
+    big_stats = stats.copy()
     # threshold is inspired by Zipfian assumption, but should only affect speed
     threshold = max(stats.values()) / 10
     for i in range(num_symbols):
@@ -206,7 +258,7 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
         # we probably missed the best pair because of pruning; go back to full statistics
         if not stats or (i and stats[most_frequent] < threshold):
             prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
+            stats = big_stats.copy()
             most_frequent = max(stats, key=lambda x: (stats[x], x))
             # threshold is inspired by Zipfian assumption, but should only affect speed
             threshold = stats[most_frequent] * i/(i+10000.0)
@@ -247,4 +299,5 @@ if __name__ == '__main__':
     if args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input)
+    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input,
+         num_workers=args.num_workers)
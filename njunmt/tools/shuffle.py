@@ -1,33 +1,70 @@
+""" Shuffles parallel files with the same permutation.
+
+Only the byte offsets of line starts are kept in memory (8 bytes per line),
+the lines are copied by seeking, so files larger than the memory can be
+shuffled. To reduce random reads, the permutation is processed in chunks:
+the lines of one chunk are read in the order of their offsets and then
+written in the shuffled order.
+
+Usage:
+    python njunmt/tools/shuffle.py from_file1,from_file2 to_file1,to_file2
+"""
 from __future__ import print_function
 import sys
 import numpy
 
 
-def shuffle_data(from_binding, to_binding):
-    lines_list = []
-    fps = []
-    fws = []
-    for idx in range(len(from_binding)):
-        lines_list.append([])
-        fps.append(open(from_binding[idx], "r"))
+def build_line_offsets(filename):
+    """ Returns a 1-d numpy.ndarray with `num_lines + 1` entries: the
+    byte offsets of the line starts and the size of the file. """
+    # an int64 buffer doubled when full, instead of a list of python ints
+    # (which costs more than 30 bytes per line)
+    offsets = numpy.zeros([1024], dtype=numpy.int64)
+    num_offsets = 1
+    with open(filename, "rb") as fp:
+        for line in fp:
+            if num_offsets == offsets.shape[0]:
+                offsets = numpy.concatenate([offsets, numpy.zeros_like(offsets)])
+            offsets[num_offsets] = offsets[num_offsets - 1] + len(line)
+            num_offsets += 1
+    return offsets[:num_offsets].copy()
+
+
+def shuffle_data(from_binding, to_binding, chunk_size=100000):
+    """ Shuffles the files in `from_binding` with the same permutation
+    and writes to `to_binding`.
 
-    for zip_lines in zip(*fps):
-        for idx in range(len(zip_lines)):
-            lines_list[idx].append(zip_lines[idx].strip())
+    Args:
+        from_binding: A list of files with same number of lines.
+        to_binding: A list of files to save to.
+        chunk_size: The maximum number of lines kept in memory.
+    """
+    assert len(from_binding) == len(to_binding), "Number of files mismatch."
+    offsets = [build_line_offsets(f) for f in from_binding]
+    num_lines = min([len(o) - 1 for o in offsets])
+    rands = numpy.random.permutation(num_lines)
+    fps = [open(f, "rb") for f in from_binding]
+    fws = [open(f, "wb") for f in to_binding]
+    for start in range(0, num_lines, chunk_size):
+        chunk = rands[start:start + chunk_size]
+        for fp, fw, offset in zip(fps, fws, offsets):
+            lines = dict()
+            for i in numpy.sort(chunk):
+                fp.seek(offset[i])
+                lines[i] = fp.read(offset[i + 1] - offset[i])
+            for i in chunk:
+                line = lines[i]
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                fw.write(line)
     for fp in fps:
         fp.close()
-    for idx in range(len(to_binding)):
-        fws.append(open(to_binding[idx], "w"))
-    rands = numpy.arange(len(lines_list[0]))
-    numpy.random.shuffle(rands)
-    for i in rands:
-        for idx in range(len(lines_list)):
-            fws[idx].write(lines_list[idx][i] + "\n")
     for fw in fws:
         fw.close()
 
 
-froms = sys.argv[1]
-tos = sys.argv[2]
+if __name__ == "__main__":
+    froms = sys.argv[1]
+    tos = sys.argv[2]
 
-shuffle_data(froms.strip().split(","), tos.strip().split(","))
+    shuffle_data(froms.strip().split(","), tos.strip().split(","))
@@ -266,6 +266,8 @@ class BleuMetricSpec(TextMetricSpec):
                  delimiter=" ",
                  maximum_keep_models=5,
                  char_level=False,
+                 batch_tokens_size=None,
+                 sort_by_length=False,
                  early_stop=True,
                  estop_patience=30,
                  do_summary=True,
@@ -288,6 +290,9 @@ class BleuMetricSpec(TextMetricSpec):
             maximum_keep_models: The maximum number of models that will have a
               backup according to the BLEU score.
             char_level: Whether to split words into characters (only for Chinese).
+            batch_tokens_size: A python integer, the maximum number of padded
+              source tokens for each inference step.
+            sort_by_length: Whether to batch source lines sorted by length.
             early_stop: Whether to early stop the program when the model does not
               improve BLEU anymore.
             estop_patience: A python integer, the maximum patience for early stop.
@@ -304,6 +309,8 @@ class BleuMetricSpec(TextMetricSpec):
         self._length_penalty = length_penalty
         self._delimiter = delimiter
         self._char_level = char_level
+        self._batch_tokens_size = batch_tokens_size
+        self._sort_by_length = sort_by_length
         self._early_stop = early_stop
         self._estop_patience_max = estop_patience
         self._maximum_keep_models = maximum_keep_models
@@ -344,9 +351,12 @@ class BleuMetricSpec(TextMetricSpec):
         text_inputter = TextLineInputter(
             dataset=self._dataset,
             data_field_name="eval_features_file",
-            batch_size=self._batch_size)
+            batch_size=self._batch_size,
+            batch_tokens_size=self._batch_tokens_size,
+            sort_by_length=self._sort_by_length)
+        # decoded at every evaluation
         self._infer_data = text_inputter.make_feeding_data(
-            input_fields=estimator_spec.input_fields)
+            input_fields=estimator_spec.input_fields, in_memory=True)
         tmp_trans_dir = os.path.join(self._model_configs["model_dir"], Constants.TMP_TRANS_DIRNAME)
         if not gfile.Exists(tmp_trans_dir):
             gfile.MakeDirs(tmp_trans_dir)
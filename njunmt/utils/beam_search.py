@@ -23,7 +23,7 @@ import tensorflow as tf
 
 class BeamSearchStateSpec(
     namedtuple(
-        "BeamSearchStat", "log_probs beam_ids")):
+        "BeamSearchStat", "log_probs beam_ids word_ids")):
     """ A class wrapper for namedtuple.  """
 
     @staticmethod
@@ -31,7 +31,8 @@ class BeamSearchStateSpec(
         """ Returns the types of this namedtuple. """
         return BeamSearchStateSpec(
             log_probs=tf.float32,
-            beam_ids=tf.int32)
+            beam_ids=tf.int32,
+            word_ids=tf.int32)
 
 
 def stack_beam_size(tensors, beam_size):
@@ -81,6 +82,21 @@ def stack_beam_size(tensors, beam_size):
             _stack, nest.flatten(tensors)))
 
 
+def stack_cache_beam_size(cache, beam_size):
+    """ Stacks the decoding cache `beam_size` times, except the tensors
+    under "beam_shared", which are shared by the beams of each sample, and
+    the timestep under "preallocated", which is shared by all rows.
+
+    Args:
+        cache: A dict returned by `Decoder.prepare()`.
+        beam_size: A python integer, the beam width.
+
+    Returns: A dict with the same structure as `cache`.
+    """
+    return {k: v if k in ["beam_shared", "preallocated"] else stack_beam_size(v, beam_size)
+            for k, v in cache.items()}
+
+
 def gather_states(states, beam_ids):
     """ Gathers states according to beam ids.
 
@@ -103,6 +119,65 @@ def gather_states(states, beam_ids):
             _gather, nest.flatten(states)))
 
 
+def backtrace_hypothesis(word_ids, beam_ids):
+    """ Rebuilds the hypothesis of each beam by following the back pointers
+    from the last timestep.
+
+    Args:
+        word_ids: A int32 Tensor with shape [timesteps, batch_size * beam_size],
+          the sampled word ids at each timestep.
+        beam_ids: A int32 Tensor with shape [timesteps, batch_size * beam_size],
+          the beam each word at each timestep is appended to, which indexes
+          the beams of the previous timestep.
+
+    Returns: A int32 Tensor with shape [batch_size * beam_size, timesteps].
+    """
+    initial_beam_pos = tf.range(tf.shape(word_ids)[1])
+
+    def _backtrace(prev, elems):
+        beam_pos = prev[1]
+        step_word_ids, step_beam_ids = elems
+        return tf.gather(step_word_ids, beam_pos), tf.gather(step_beam_ids, beam_pos)
+
+    hypothesis, _ = tf.scan(
+        _backtrace, (word_ids, beam_ids),
+        initializer=(tf.zeros_like(initial_beam_pos), initial_beam_pos),
+        reverse=True)
+    return tf.transpose(hypothesis)
+
+
+def scatter_live_rows(live_rows, updates, num_rows, defaults=None):
+    """ Scatters the values of live rows back to full-size tensors.
+
+    Args:
+        live_rows: A int32 Tensor with shape [num_live_rows, ], the indices
+          of live rows in the full-size tensors, in ascending order.
+        updates: A Tensor or a list/tuple/dict of Tensors. For each Tensor,
+          the first dimension must be num_live_rows.
+        num_rows: A int32 scalar, the number of rows of the full-size tensors.
+        defaults: A Tensor or a list/tuple/dict of Tensors with the same structure
+          as `updates`, providing the values of the rows not in `live_rows`. If
+          not provided, the rows are filled with zeros.
+
+    Returns: A Tensor or a list/tuple/dict of Tensors with the same structure
+      as `updates`, whose first dimensions are `num_rows`.
+    """
+    indices = tf.expand_dims(live_rows, axis=1)
+
+    def _scatter(x, d=None):
+        assert isinstance(x, tf.Tensor)
+        scattered = tf.scatter_nd(indices, x, tf.concat(
+            [[num_rows], tf.shape(x)[1:]], axis=0))
+        if d is None:
+            return scattered
+        is_live = tf.scatter_nd(indices, tf.ones_like(live_rows), [num_rows]) > 0
+        return tf.where(is_live, scattered, d)
+
+    if defaults is None:
+        return nest.map_structure(_scatter, updates)
+    return nest.map_structure(_scatter, updates, defaults)
+
+
 def finished_beam_one_entry_bias(on_entry, num_entries):
     """ Builds a bias vector to be added to log_probs of a finished beam.
 
@@ -186,6 +261,9 @@ def compute_length_penalty(lengths, alpha):
 def process_beam_predictions(decoding_result, beam_size, alpha):
     """ Processes beam search results.
 
+    If `decoding_result` has "pruned" (with early termination), the alive
+    beams of the terminated sentences are ranked after the finished ones.
+
     Args:
         decoding_result: A dict returned by
         beam_size: An integer, the beam width.
@@ -204,8 +282,13 @@ def process_beam_predictions(decoding_result, beam_size, alpha):
     scores = log_probs * penalty
     # [_batch * _beam, ] => [_batch, _beam]
     scores_flat = tf.reshape(scores, [-1, beam_size])
+    ranking_scores = scores
+    if "pruned" in decoding_result:
+        pseudo_float_min = -1.0e9
+        ranking_scores = tf.where(decoding_result["pruned"],
+                                  scores + pseudo_float_min, scores)
     # [_batch, _beam]
-    top_scores, top_indices = tf.nn.top_k(scores_flat, k=beam_size)
+    _, top_indices = tf.nn.top_k(tf.reshape(ranking_scores, [-1, beam_size]), k=beam_size)
     batch_beam_pos = compute_batch_indices(tf.shape(top_indices)[0], k=beam_size) * beam_size
     # [_batch * _beam, ]
     top_indices = tf.reshape(top_indices + batch_beam_pos, [-1])
@@ -213,5 +296,32 @@ def process_beam_predictions(decoding_result, beam_size, alpha):
     sorted_hypothesis = tf.gather(hypothesis, top_indices)
     decoding_result["sorted_hypothesis"] = sorted_hypothesis
     decoding_result["scores"] = scores_flat
+    # [_batch * _beam, ]
+    decoding_result["sorted_scores"] = tf.gather(scores, top_indices)
     decoding_result["sorted_argidx"] = top_indices
     return decoding_result
+
+
+def process_greedy_predictions(decoding_result, alpha):
+    """ Processes greedy search results, with the same keys
+    as `process_beam_predictions()` and beam_size=1.
+
+    Args:
+        decoding_result: A dict returned by `dynamic_decode()`
+          with a `GreedyFeedback`.
+        alpha: The length penalty rate.
+
+    Returns: A dict.
+    """
+    # [_batch, ]
+    log_probs = decoding_result["log_probs"][-1]
+    length = decoding_result["decoding_length"]
+    if alpha is None or alpha < 0.0:
+        penalty = 1.0 / tf.to_float(length)
+    else:
+        penalty = compute_length_penalty(length, alpha)
+    decoding_result["sorted_hypothesis"] = decoding_result["hypothesis"]
+    decoding_result["scores"] = tf.reshape(log_probs * penalty, [-1, 1])
+    decoding_result["sorted_scores"] = log_probs * penalty
+    decoding_result["sorted_argidx"] = tf.range(tf.shape(log_probs)[0])
+    return decoding_result
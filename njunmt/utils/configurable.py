@@ -335,7 +335,12 @@ def update_infer_params(
         model_configs,
         beam_size=None,
         maximum_labels_length=None,
-        length_penalty=None):
+        length_penalty=None,
+        shrink_finished_batch=None,
+        early_termination=None,
+        shortlist_file=None,
+        shortlist_num_candidates=None,
+        shortlist_num_frequent_words=None):
     """ Resets inference-specific parameters.
 
     Args:
@@ -346,6 +351,19 @@ def update_infer_params(
           if provided, pass it to `model_configs`'s "model_params".
         length_penalty: The length penalty, if provided, pass it to
           `model_configs`'s "model_params".
+        shrink_finished_batch: Whether to remove the finished sentences from
+          decoding, if provided, pass it to `model_configs`'s "model_params".
+        early_termination: Whether to finish a sentence once its alive beams
+          can not beat the best finished one, if provided, pass it to
+          `model_configs`'s "model_params".
+        shortlist_file: The lexical shortlist file restricting the output
+          vocabulary, if provided, pass it to `model_configs`'s "model_params".
+        shortlist_num_candidates: The maximum number of shortlist candidates
+          of each source token, if provided, pass it to `model_configs`'s
+          "model_params".
+        shortlist_num_frequent_words: The number of frequent target words
+          always in the shortlist, if provided, pass it to `model_configs`'s
+          "model_params".
 
     Returns: An updated dict.
     """
@@ -355,6 +373,16 @@ def update_infer_params(
         model_configs["model_params"]["inference.maximum_labels_length"] = maximum_labels_length
     if length_penalty is not None:
         model_configs["model_params"]["inference.length_penalty"] = length_penalty
+    if shrink_finished_batch is not None:
+        model_configs["model_params"]["inference.shrink_finished_batch"] = shrink_finished_batch
+    if early_termination is not None:
+        model_configs["model_params"]["inference.early_termination"] = early_termination
+    if shortlist_file is not None:
+        model_configs["model_params"]["inference.shortlist_file"] = shortlist_file
+    if shortlist_num_candidates is not None:
+        model_configs["model_params"]["inference.shortlist_num_candidates"] = shortlist_num_candidates
+    if shortlist_num_frequent_words is not None:
+        model_configs["model_params"]["inference.shortlist_num_frequent_words"] = shortlist_num_frequent_words
     return model_configs
 
 
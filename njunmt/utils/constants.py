@@ -65,6 +65,8 @@ class Constants:
     # collection name for key strs for tensors to be displayed
     DISPLAY_KEY_COLLECTION_NAME = "display_tensors_key"
     DISPLAY_VALUE_COLLECTION_NAME = "display_tensors_value"
+    # collection name for (placeholder, value) pairs initializing local variables
+    LOCAL_INIT_FEED_COLLECTION_NAME = "local_init_feed"
 
     # default placeholders
     FEATURE_NAME_PREFIX = "feature"
@@ -87,6 +87,11 @@ class Feedback:
         """Returns the vocabulary. """
         return self._vocab
 
+    @property
+    def maximum_labels_length(self):
+        """ Returns the maximum sequence length that decoder generates. """
+        return self._maximum_labels_length
+
     @abstractmethod
     def init_symbols(self, *args, **kwargs):
         """ Returns the first input symbols of the decoder. """
@@ -187,7 +192,7 @@ class BeamFeedback(Feedback):
 
     def __init__(self, vocab, maximum_labels_length,
                  batch_size, beam_size, alpha=None,
-                 ensemble_weight=None):
+                 ensemble_weight=None, shortlist_ids=None):
         """ Initializes the feedback for beam search.
 
         Args:
@@ -201,12 +206,30 @@ class BeamFeedback(Feedback):
               Refer to https://arxiv.org/abs/1609.08144.
             ensemble_weight: None or a list of floats to average the log
               probabilities from many models..
+            shortlist_ids: A 1-d int32 Tensor of target token ids including
+              EOS. If provided, the logits only cover these tokens (see
+              `Modality.top()`), and the sampled ids are mapped back to
+              the vocabulary.
         """
         super(BeamFeedback, self).__init__(vocab, maximum_labels_length)
         self._batch_size = batch_size
         self._beam_size = beam_size
         self._alpha = alpha
         self._ensemble_weights = ensemble_weight
+        self._shortlist_ids = shortlist_ids
+        if shortlist_ids is None:
+            self._num_entries = self._vocab.vocab_size
+            self._eos_entry = self._vocab.eos_id
+        else:
+            self._num_entries = tf.shape(shortlist_ids)[0]
+            self._eos_entry = tf.to_int32(tf.argmax(
+                tf.to_int32(tf.equal(shortlist_ids, self._vocab.eos_id)), axis=0))
+
+    @property
+    def shortlist_ids(self):
+        """ Returns the target token ids that logits cover, or None for
+        the whole vocabulary. """
+        return self._shortlist_ids
 
     def init_symbols(self):
         """ Returns a tuple `(init_finished_flags, init_input_symbols)`, where
@@ -255,7 +278,7 @@ class BeamFeedback(Feedback):
             probs = tf.log(tf.reshape(probs, [-1, dim_vocab]))
         return probs
 
-    def sample_symbols(self, logits, log_probs, finished, lengths, time):
+    def sample_symbols(self, logits, log_probs, finished, lengths, time, batch_size=None):
         """ Samples symbols and returns it.
 
         Args:
@@ -268,6 +291,9 @@ class BeamFeedback(Feedback):
             lengths: The length of each beam in each batch, a int32 Tensor with
               shape [beam_size * batch_size, ].
             time: A int32 Scalar, the current time.
+            batch_size: The number of sentences in `logits`, if not provided,
+              the batch size of this feedback is used. It is smaller than the
+              batch size when the finished sentences are removed from decoding.
 
         Returns: A tuple `(word_ids, beam_ids, next_log_probs, next_lengths)`, where
           `words_ids` is the ids of sampled word symbols; `beam_ids` indicates the index
@@ -276,6 +302,8 @@ class BeamFeedback(Feedback):
           each beam.
           All of the Tensors have shape [batch_size * beam_size, ].
         """
+        if batch_size is None:
+            batch_size = self._batch_size
         # [batch_size * beam_size,]
         prev_finished_float = tf.to_float(finished)
         # [batch_size * beam_size, ]
@@ -287,10 +315,10 @@ class BeamFeedback(Feedback):
         #   [target_vocab_size, ]: [float_min, float_min, float_min, ..., 0]
         #   this forces the beam with EOS continue to generate EOS
         finished_beam_bias = finished_beam_one_entry_bias(
-            on_entry=self._vocab.eos_id, num_entries=self._vocab.vocab_size)
+            on_entry=self._eos_entry, num_entries=self._num_entries)
         # [batch_size * beam_size, target_vocab_size]: outer product
         finished_beam_bias = expand_to_beam_size(
-            finished_beam_bias, self._beam_size * self._batch_size, axis=0)
+            finished_beam_bias, self._beam_size * batch_size, axis=0)
         finished_beam_bias *= tf.expand_dims(prev_finished_float, 1)
         # compute new probs, with finished flags & mask
         probs = probs * tf.expand_dims(1. - prev_finished_float, 1) + finished_beam_bias
@@ -307,11 +335,11 @@ class BeamFeedback(Feedback):
 
         # flatten: [batch_size, beam_size * target_vocab_size]
         scores = tf.reshape(tf.reshape(scores, [-1]),
-                            [self._batch_size, -1])
+                            [batch_size, -1])
         scores_flat = tf.cond(
             tf.convert_to_tensor(time) > 0, lambda: scores,  # time > 0: all
             lambda: tf.slice(scores, [0, 0],
-                             [-1, self._vocab.vocab_size]))  # time = 0: first logits in each batch
+                             [-1, self._num_entries]))  # time = 0: first logits in each batch
 
         # [batch_size, beam_size] will restore top live_k
         sample_scores, sample_ids = tf.nn.top_k(scores_flat, k=self._beam_size)
@@ -320,15 +348,17 @@ class BeamFeedback(Feedback):
 
         # because we do topk to scores with dim:[batch, beam * vocab]
         #   we need to cover the true word ids
-        word_ids = tf.mod(sample_ids, self._vocab.vocab_size)
+        word_ids = tf.mod(sample_ids, self._num_entries)
+        if self._shortlist_ids is not None:
+            word_ids = tf.gather(self._shortlist_ids, word_ids)
 
         # find beam_ids, indicating the current position is from which beam
         #  batch_pos, [batch_size, beam_size]: [[0, 0, ...], [1, 1,...], ..., [batch_size,...] ]
-        batch_pos = compute_batch_indices(self._batch_size, self._beam_size)
+        batch_pos = compute_batch_indices(batch_size, self._beam_size)
         #  beam_base_pos: [batch_size * beam_size,]: [0, 0, ..., beam, beam,..., 2beam, 2beam, ...]
         beam_base_pos = tf.reshape(batch_pos * self._beam_size, [-1])
         # compute new beam_ids, [batch_size * beam_size, ]
-        beam_ids = tf.div(sample_ids, self._vocab.vocab_size) + beam_base_pos
+        beam_ids = tf.div(sample_ids, self._num_entries) + beam_base_pos
 
         # gather states according to beam_ids
         next_lengths = gather_states(lengths, beam_ids)
@@ -336,11 +366,66 @@ class BeamFeedback(Feedback):
         # we need to recover log_probs according to scores's topk ids
         # [batch_size * beam_size * vocab_size, ]
         log_probs_flat = tf.reshape(log_probs, [-1])
-        log_probs_index = beam_base_pos * self._vocab.vocab_size + sample_ids
+        log_probs_index = beam_base_pos * self._num_entries + sample_ids
         next_log_probs = tf.gather(log_probs_flat, log_probs_index)
 
         return word_ids, beam_ids, next_log_probs, next_lengths
 
+    def _final_score_penalty(self, lengths):
+        """ Returns the length penalty used to rank the finished
+        hypotheses, see `process_beam_predictions()`. """
+        if self._alpha is None or self._alpha < 0.0:
+            return 1.0 / tf.to_float(lengths)
+        return compute_length_penalty(lengths, self._alpha)
+
+    def terminate_hopeless_beams(self, log_probs, finished, lengths, pruned):
+        """ Finishes the sentences whose alive beams can not beat the
+        best finished hypothesis.
+
+        The beams of each sentence are split into the finished set (the
+        hypotheses ending with EOS, i.e. `finished` and not `pruned`) and the
+        alive set (the others). The log probability of an alive beam never
+        increases, and the length penalty of the final score is the smallest
+        at the maximum length, so `log_probs * penalty(maximum_labels_length)`
+        bounds the final score of any hypothesis extending the beam. If the
+        best score of the finished set of a sentence is not lower than the
+        bounds of all its alive beams, the sentence is terminated: its alive
+        beams are frozen (marked as finished) and recorded in `pruned`, so
+        that they are ranked after the finished set by
+        `process_beam_predictions()`. Their log probabilities are kept.
+
+        Args:
+            log_probs: Accumulated log probabilities, a float32 Tensor with shape
+              [beam_size * batch_size, ].
+            finished: Finished flag of each beam in each batch, a bool Tensor with
+              shape [beam_size * batch_size, ], including the pruned beams.
+            lengths: The length of each beam in each batch, a int32 Tensor with
+              shape [beam_size * batch_size, ].
+            pruned: Whether each beam is an alive beam of a terminated sentence,
+              a bool Tensor with shape [beam_size * batch_size, ].
+
+        Returns: A tuple `(finished, pruned)` with the same shapes as inputs.
+        """
+        pseudo_float_min = -1.0e9
+        # [batch_size, beam_size]
+        finished_set = tf.reshape(tf.logical_and(finished, tf.logical_not(pruned)),
+                                  [-1, self._beam_size])
+        alive_set = tf.reshape(tf.logical_not(finished), [-1, self._beam_size])
+        final_scores = tf.reshape(log_probs * self._final_score_penalty(lengths),
+                                  [-1, self._beam_size])
+        upper_bounds = tf.reshape(log_probs * self._final_score_penalty(self._maximum_labels_length),
+                                  [-1, self._beam_size])
+        float_min = tf.fill(tf.shape(final_scores), pseudo_float_min)
+        # [batch_size, ]
+        best_finished_scores = tf.reduce_max(tf.where(finished_set, final_scores, float_min), axis=1)
+        best_alive_bounds = tf.reduce_max(tf.where(alive_set, upper_bounds, float_min), axis=1)
+        hopeless = tf.logical_and(tf.reduce_any(finished_set, axis=1),
+                                  best_finished_scores >= best_alive_bounds)
+        # [batch_size * beam_size, ]
+        hopeless = tf.reshape(expand_to_beam_size(hopeless, self._beam_size, axis=1), [-1])
+        pruned = tf.logical_or(pruned, tf.logical_and(hopeless, tf.logical_not(finished)))
+        return tf.logical_or(finished, hopeless), pruned
+
     def next_symbols(self, time, sample_ids):
         """ Returns the output at `time`, also known as the
         input at `time`+1.
@@ -361,6 +446,94 @@ class BeamFeedback(Feedback):
         return finished, sample_ids
 
 
+class GreedyFeedback(Feedback):
+    """ Define a helper class for inference with greedy search, which
+    takes the argmax at each step and never reorders the decoding states. """
+
+    def __init__(self, vocab, maximum_labels_length,
+                 batch_size, shortlist_ids=None):
+        """ Initializes the feedback for greedy search.
+
+        Args:
+            vocab: A `Vocab` object.
+            maximum_labels_length: A python integer, the maximum sequence
+              length that decoder generates.
+            batch_size: The batch size.
+            shortlist_ids: A 1-d int32 Tensor of target token ids. If provided,
+              the logits only cover these tokens (see `Modality.top()`), and
+              the sampled ids are mapped back to the vocabulary.
+        """
+        super(GreedyFeedback, self).__init__(vocab, maximum_labels_length)
+        self._batch_size = batch_size
+        self._shortlist_ids = shortlist_ids
+
+    @property
+    def shortlist_ids(self):
+        """ Returns the target token ids that logits cover, or None for
+        the whole vocabulary. """
+        return self._shortlist_ids
+
+    def init_symbols(self):
+        """ Returns a tuple `(init_finished_flags, init_input_symbols)`, where
+        `init_finished_flags` contains all False values and `init_input_symbols`
+        contains the index of start of sentence symbol. Both of two tensors have
+        shape [batch_size, ]
+        """
+        finished = tf.equal(0, self._maximum_labels_length)
+        finished = tf.tile([finished], [self._batch_size])
+        inputs = tf.tile([self._vocab.sos_id], [self._batch_size])
+        return finished, inputs
+
+    def sample_symbols(self, logits, log_probs, finished, lengths, time, batch_size=None):
+        """ Samples symbols and returns it.
+
+        Args:
+            logits: The logits Tensor with shape [batch_size, vocab_size].
+            log_probs: Accumulated log probabilities, a float32 Tensor with shape
+              [batch_size, ].
+            finished: Finished flag of each sample, a bool Tensor with
+              shape [batch_size, ].
+            lengths: The length of each sample, a int32 Tensor with
+              shape [batch_size, ].
+            time: A int32 Scalar, the current time.
+            batch_size: Not used.
+
+        Returns: A tuple `(word_ids, beam_ids, next_log_probs, next_lengths)`
+          as `BeamFeedback.sample_symbols()`, where `beam_ids` is simply
+          [0, 1, ..., batch_size - 1] and the finished samples generate EOS.
+          All of the Tensors have shape [batch_size, ].
+        """
+        _ = time
+        _ = batch_size
+        word_ids = tf.to_int32(tf.argmax(logits, axis=1))
+        if self._shortlist_ids is not None:
+            word_ids = tf.gather(self._shortlist_ids, word_ids)
+        word_ids = tf.where(finished, tf.fill(tf.shape(word_ids), self._vocab.eos_id), word_ids)
+        word_log_probs = tf.reduce_max(logits, axis=1) - tf.reduce_logsumexp(logits, axis=1)
+        next_log_probs = log_probs + word_log_probs * (1. - tf.to_float(finished))
+        next_lengths = lengths + 1 - tf.to_int32(finished)
+        beam_ids = tf.range(tf.shape(word_ids)[0])
+        return word_ids, beam_ids, next_log_probs, next_lengths
+
+    def next_symbols(self, time, sample_ids):
+        """ Returns the output at `time`, also known as the
+        input at `time`+1.
+
+        Args:
+            time: A int32 Scalar, the current time.
+            sample_ids: A Tensor with shape [batch_size, ], returned by
+              `sample_symbols()`.
+
+        Returns: A tuple `(finished, next_symbols)`, where `finished` indicates
+          whether each sequence is finished, and `next_symbols` is the next input
+          Tensor with shape [batch_size, ]
+        """
+        next_time = time + 1
+        finished = tf.logical_or((next_time >= self._maximum_labels_length),
+                                 tf.equal(self._vocab.eos_id, sample_ids))
+        return finished, sample_ids
+
+
 if __name__ == "__main__":
     a = tf.convert_to_tensor([[1, 2, 3], [4, 5, 6]], dtype=tf.int32)
     a_t = _transpose_batch_time(a)
@@ -19,8 +19,11 @@ from __future__ import print_function
 import codecs
 import os
 import socket
+import sys
+import threading
 
 import numpy
+import six
 import tensorflow as tf
 from tensorflow import gfile
 from tensorflow.python.client import device_lib
@@ -326,17 +329,59 @@ def deprecated(obj):
 
 
 def shuffle_data(from_binding, to_binding):
-    """ Calls njunmt/tools/shuffle.py to shuffle data.
+    """ Shuffles data in-process with bounded memory,
+    see njunmt/tools/shuffle.py.
 
     Args:
         from_binding: The original data files with same number of lines.
         to_binding: The files to save to.
     """
-    cmd = "python {script} {from_} {to_}".format(
-        script="njunmt/tools/shuffle.py",
-        from_=",".join(from_binding),
-        to_=",".join(to_binding))
-    os.system(cmd)
+    from njunmt.tools.shuffle import shuffle_data as _shuffle_data
+    _shuffle_data(from_binding, to_binding)
+
+
+class ShufflingThread(threading.Thread):
+    """ A thread for shuffling data in background. """
+
+    def __init__(self, from_binding, to_binding):
+        """ Initializes.
+
+        Args:
+            from_binding: The original data files with same number of lines.
+            to_binding: The files to save to.
+        """
+        super(ShufflingThread, self).__init__(name="ShufflingThread")
+        self.daemon = True
+        self._from_binding = from_binding
+        self._to_binding = to_binding
+        self._exc_info = None
+
+    def run(self):
+        try:
+            shuffle_data(self._from_binding, self._to_binding)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def wait(self):
+        """ Waits until shuffling finishes and re-raises its error if any. """
+        self.join()
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+
+def shuffle_data_in_background(from_binding, to_binding):
+    """ Starts shuffling data in a background thread.
+
+    Args:
+        from_binding: The original data files with same number of lines.
+        to_binding: The files to save to.
+
+    Returns: A `ShufflingThread` object, call its `wait()` before
+      reading `to_binding`.
+    """
+    thread = ShufflingThread(from_binding, to_binding)
+    thread.start()
+    return thread
 
 
 def get_labels_files(labels_file):